@@ -0,0 +1,331 @@
+"""
+Benchmarks for the checksum, tag, ingest and metadata paths
+
+Generates a synthetic corpus of JPEG, PNG, HEIC-like and MOV files, times each
+stage in a fresh process and writes the results as JSON, so that runs on
+different commits can be compared:
+
+    python bench/benchmark.py --count 50 --output before.json
+
+Each stage reports the number of files and bytes processed, the wall time,
+files/sec, MB/sec and the peak resident set size of its process. A stage that
+fails, for example without exiftool, fails the whole run with its error and no
+results are written; leave out the stages that cannot run here with --stages.
+"""
+import os
+import sys
+
+# run against the working tree rather than an installed copy
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STAGES = ['checksum', 'video_hash', 'get_tags', 'update_tags', 'add', 'meta']
+
+
+def box(kind, payload):
+    import struct
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def exif_block(model, date):
+    """
+    Build the Exif fields the readers look for
+    """
+    from PIL import Image
+
+    exif = Image.Exif()
+    exif[0x0110] = model
+    exif.get_ifd(0x8769)[0x9003] = date
+    exif.get_ifd(0x8769)[0x9004] = date
+    return exif
+
+
+def make_heic(path, tiff, payload):
+    """
+    Write a HEIF container holding an Exif item and an opaque payload
+    """
+    import struct
+
+    exif_item = struct.pack('>I', 0) + tiff
+    ftyp = box(b'ftyp', b'heic' + struct.pack('>I', 0) + b'mif1heic')
+    hdlr = box(b'hdlr', bytes(8) + b'pict' + bytes(13))
+    infe = box(b'infe', bytes([2, 0, 0, 0]) + struct.pack('>HH', 1, 0) + b'Exif' + b'\x00')
+    iinf = box(b'iinf', bytes(4) + struct.pack('>H', 1) + infe)
+
+    def build(offset):
+        iloc = box(b'iloc', bytes(4) + bytes([0x44, 0x00]) + struct.pack('>H', 1)
+                   + struct.pack('>HHHII', 1, 0, 1, offset, len(exif_item)))
+        return ftyp + box(b'meta', bytes(4) + hdlr + iinf + iloc)
+
+    header = build(0)
+    with open(path, 'wb') as fid:
+        fid.write(build(len(header) + 8) + box(b'mdat', exif_item + payload))
+
+
+def make_mov(path, date, payload):
+    """
+    Write a QuickTime movie with a creation date and an opaque payload
+    """
+    import struct
+    from datetime import datetime, timezone
+
+    seconds = int((date.astimezone(timezone.utc)
+                   - datetime(1904, 1, 1, tzinfo=timezone.utc)).total_seconds())
+    mvhd = box(b'mvhd', bytes(4) + struct.pack('>II', seconds, seconds) + bytes(88))
+    with open(path, 'wb') as fid:
+        fid.write(box(b'ftyp', b'qt  ' + bytes(4)) + box(b'mdat', payload) + box(b'moov', mvhd))
+
+
+def make_corpus(root, count=20, width=1024, height=768, video_mb=16, seed=0):
+    """
+    Generate the synthetic corpus
+
+    Arguments
+    ---------
+    root : str
+        The directory to fill
+
+    Keyword Arguments
+    -----------------
+    count : int
+        The number of files of each kind
+
+    width, height : int
+        The size of the images in pixels
+
+    video_mb : int
+        The size of each movie in MB
+
+    seed : int
+        The random seed, so corpora are the same between runs
+
+    Returns
+    -------
+    dict
+        The paths of the files of each kind
+
+    """
+    import numpy as np
+    from datetime import datetime, timedelta
+    from zoneinfo import ZoneInfo
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    start = datetime(2020, 1, 1, tzinfo=ZoneInfo("America/Los_Angeles"))
+    corpus = {'jpeg': [], 'png': [], 'heic': [], 'mov': []}
+    os.makedirs(root, exist_ok=True)
+
+    for idx in range(count):
+        date = start + timedelta(hours=idx)
+        exif_date = date.strftime('%Y:%m:%d %H:%M:%S')
+        # smooth gradients with noise compress like photos rather than static
+        base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        pixels = base + rng.normal(0, 24, (height, width, 3))
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+
+        jpeg_path = os.path.join(root, 'img{0:05d}.jpg'.format(idx))
+        img.save(jpeg_path, quality=90, exif=exif_block('Bench Camera', exif_date))
+        corpus['jpeg'].append(jpeg_path)
+
+        png_path = os.path.join(root, 'scan{0:05d}.png'.format(idx))
+        img.save(png_path)
+        corpus['png'].append(png_path)
+
+        heic_path = os.path.join(root, 'phone{0:05d}.heic'.format(idx))
+        tiff = exif_block('Bench Phone', exif_date).tobytes()[6:]
+        make_heic(heic_path, tiff, rng.bytes(os.path.getsize(jpeg_path)))
+        corpus['heic'].append(heic_path)
+
+        mov_path = os.path.join(root, 'clip{0:05d}.mov'.format(idx))
+        make_mov(mov_path, date, rng.bytes(video_mb * 1024 * 1024))
+        corpus['mov'].append(mov_path)
+
+    return corpus
+
+
+def _run_stage(stage, corpus, workdir):
+    """
+    Run one stage, returning the files and bytes it processed
+    """
+    import contextlib
+    import io
+    import shutil
+
+    photos = corpus['jpeg'] + corpus['png']
+    if stage == 'checksum':
+        from photo.exif import calculate_checksum
+        for filename in photos:
+            calculate_checksum(filename)
+        files = photos
+
+    elif stage == 'video_hash':
+        from photo.videohash import hash_video
+        for filename in corpus['mov']:
+            hash_video(filename)
+        files = corpus['mov']
+
+    elif stage == 'get_tags':
+        from photo.exif import get_tags
+        files = corpus['jpeg'] + corpus['heic']
+        for filename in files:
+            get_tags(filename)
+
+    elif stage == 'update_tags':
+        from photo.exif import update_tags
+        # tag copies, so the corpus stays the same for the other stages
+        files = []
+        os.makedirs(os.path.join(workdir, 'tagged'))
+        for filename in corpus['jpeg']:
+            files.append(shutil.copy(filename, os.path.join(workdir, 'tagged')))
+        for filename in files:
+            update_tags(filename, ['bench', 'run'])
+
+    elif stage == 'add':
+        from photo.cli import cli_add
+        files = [filename for kind in corpus.values() for filename in kind]
+        with contextlib.redirect_stdout(io.StringIO()):
+            cli_add(files, False)
+
+    elif stage == 'meta':
+        from photo.cli import cli_meta
+        files = corpus['jpeg']
+        with contextlib.redirect_stdout(io.StringIO()):
+            cli_meta(files)
+
+    else:
+        raise ValueError('Unrecognized stage "{0}"'.format(stage))
+
+    return len(files), sum(os.path.getsize(filename) for filename in files)
+
+
+def peak_rss_mb():
+    """
+    The peak resident set size of this process in MB
+    """
+    import resource
+
+    # Linux carries ru_maxrss over exec, so a spawned process would report
+    # the peak of its parent; the high water mark of its own memory is in
+    # /proc instead
+    try:
+        with open('/proc/self/status') as fid:
+            for line in fid:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1e3
+    except OSError:
+        pass
+
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def _stage_process(stage, corpus, workdir, queue):
+    """
+    Time a stage in its own process, so its peak RSS is its own
+    """
+    import time
+
+    # keep the configuration, catalog and caches out of the user's home
+    os.environ['XDG_CONFIG_HOME'] = os.path.join(workdir, 'config')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(workdir, 'cache')
+    os.makedirs(os.path.join(workdir, 'config', 'photo'), exist_ok=True)
+    with open(os.path.join(workdir, 'config', 'photo', 'photorc'), 'w') as fid:
+        fid.write('repo:\n    path: {0}\n'.format(os.path.join(workdir, 'repo')))
+
+    try:
+        start = time.perf_counter()
+        files, nbytes = _run_stage(stage, corpus, workdir)
+        seconds = time.perf_counter() - start
+    except BaseException as err:
+        queue.put({'error': '{0}: {1}'.format(type(err).__name__, err)})
+        return
+
+    queue.put({'files': files,
+               'bytes': nbytes,
+               'seconds': seconds,
+               'files_per_sec': files / seconds if seconds > 0 else None,
+               'mb_per_sec': nbytes / 1e6 / seconds if seconds > 0 else None,
+               'peak_rss_mb': peak_rss_mb(),
+               })
+
+
+def run(stages, corpus, workdir):
+    """
+    Run the stages, each in a fresh process
+
+    Returns
+    -------
+    dict
+        The results of each stage
+
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for stage in stages:
+        queue = context.Queue()
+        stage_dir = os.path.join(workdir, stage)
+        os.makedirs(stage_dir)
+        process = context.Process(target=_stage_process, args=(stage, corpus, stage_dir, queue))
+        process.start()
+        process.join()
+        results[stage] = queue.get() if not queue.empty() else {'error': 'exit code {0}'.format(process.exitcode)}
+        print('{0:12s} {1}'.format(stage, results[stage]), file=sys.stderr)
+
+    return results
+
+
+def main(argv=None):
+    """
+    Run the benchmarks
+
+    Returns
+    -------
+    int
+        The exit status: 0 if every stage ran, 1 otherwise
+
+    """
+    import argparse
+    import json
+    import platform
+    import tempfile
+    import time
+
+    parser = argparse.ArgumentParser(description='Benchmark the photo tool on a synthetic corpus')
+    parser.add_argument('-n', '--count', type=int, default=20, help='The number of files of each kind')
+    parser.add_argument('--width', type=int, default=1024, help='The image width in pixels')
+    parser.add_argument('--height', type=int, default=768, help='The image height in pixels')
+    parser.add_argument('--video-mb', type=int, default=16, help='The size of each movie in MB')
+    parser.add_argument('-s', '--stages', nargs='+', choices=STAGES, default=STAGES, help='The stages to run')
+    parser.add_argument('-o', '--output', default=None, help='The JSON file to write (default: stdout)')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='photo-bench-') as workdir:
+        corpus = make_corpus(os.path.join(workdir, 'corpus'), args.count, args.width, args.height,
+                             args.video_mb)
+        results = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'corpus': {'count': args.count, 'width': args.width, 'height': args.height,
+                              'video_mb': args.video_mb},
+                   'stages': run(args.stages, corpus, workdir),
+                   }
+
+    failed = {stage: result['error'] for stage, result in results['stages'].items() if 'error' in result}
+    if failed:
+        for stage, error in failed.items():
+            print('FAILED {0}: {1}'.format(stage, error), file=sys.stderr)
+        return 1
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as fid:
+            fid.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
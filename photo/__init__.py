@@ -1,5 +1,20 @@
-from .exif import *
+# The package is imported by every command line invocation, so nothing is
+# imported or written here until it is used: the public names of exif and
+# config are loaded on first access, and the configuration file is only
+# written by photo config init.
 
-from .config import *
-# ensure the global configuration file is present
-generate_global_config()
+# the modules re-exported at the package level
+_lazy_modules = ['exif', 'config']
+
+
+def __getattr__(name):
+    import importlib
+
+    for module_name in _lazy_modules:
+        module = importlib.import_module('.' + module_name, __name__)
+        if not name.startswith('_') and hasattr(module, name):
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,214 @@
+"""
+Asynchronous ingest for network mounted inboxes
+
+On an NFS or SMB inbox every stat, read and copy waits on a round trip, so
+throughput depends on how many of them are in flight rather than on the
+bandwidth or the number of cores. This driver runs the same per-file steps
+as `photo.ingest.ingest` from an asyncio loop, keeping up to `concurrency`
+file operations in flight on a thread-backed file layer, and retries the ones
+failing with transient errors.
+
+Settling, which decides placements and duplicates, runs in a single
+coordinating thread in walk order, exactly as in the threaded driver.
+"""
+
+# the errors worth retrying, by errno name: the server or the network hiccupped
+TRANSIENT_ERRORS = ['EIO', 'EAGAIN', 'EINTR', 'EBUSY', 'ETIMEDOUT', 'ESTALE', 'ECONNRESET',
+                    'ECONNABORTED', 'ENETUNREACH', 'EHOSTUNREACH']
+
+
+class RetryPolicy:
+    """
+    Retry transient I/O errors with exponential backoff
+
+    Keyword Arguments
+    -----------------
+    attempts : int
+        The number of tries before giving up
+
+    delay : float
+        The wait in seconds before the first retry
+
+    factor : float
+        The growth of the wait after each retry
+
+    max_delay : float
+        The longest wait between retries
+
+    """
+
+    def __init__(self, attempts=4, delay=0.1, factor=2.0, max_delay=5.0):
+        if attempts < 1:
+            raise ValueError('The number of attempts must be at least 1')
+        self.attempts = attempts
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.retries = 0
+
+    @staticmethod
+    def is_transient(err):
+        import errno
+
+        return isinstance(err, OSError) and errno.errorcode.get(err.errno) in TRANSIENT_ERRORS
+
+    def call(self, func, *args):
+        """
+        Call func(*args), retrying it while it fails with a transient error
+        """
+        import time
+
+        delay = self.delay
+        for attempt in range(self.attempts):
+            try:
+                return func(*args)
+            except OSError as err:
+                if attempt == self.attempts - 1 or not self.is_transient(err):
+                    raise
+            self.retries += 1
+            time.sleep(delay)
+            delay = min(delay * self.factor, self.max_delay)
+
+
+class AsyncFiles:
+    """
+    A thread-backed async file layer
+
+    Blocking file operations run on a pool of threads, with at most
+    `concurrency` of them in flight.
+
+    Arguments
+    ---------
+    concurrency : int
+        The number of operations in flight
+
+    """
+
+    def __init__(self, concurrency):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = asyncio.Semaphore(concurrency)
+
+    async def call(self, func, *args):
+        """
+        Run func(*args) on the file layer
+        """
+        import asyncio
+
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+async def ingest_async(path, walk, repo_path, concurrency=32, retry=None, summary=None,
+                       catalog=None, cache=None, mode='auto', video_hash=None, journal=None,
+                       heic_hash=None, walk_filter=None, jobs=None, photo_hash=None):
+    """
+    Add photos and videos to the repository from an asyncio loop
+
+    Arguments
+    ---------
+    path : list
+        The directory or filenames to process
+
+    walk : bool
+        If True, walk the directory tree below the first entry of path
+
+    repo_path : Path
+        The root of the photo repository
+
+    Keyword Arguments
+    -----------------
+    concurrency : int
+        The number of file reads, stats and copies in flight
+
+    retry : RetryPolicy
+        How transient I/O errors are retried. Defaults to RetryPolicy().
+
+    summary, catalog, cache, mode, video_hash, journal, heic_hash, walk_filter, photo_hash
+        As for `photo.ingest.ingest`
+
+    jobs : int
+        The number of processes decoding HEIC photos under the pixel
+        checksum. Defaults to the number of cores.
+
+    Returns
+    -------
+    Summary
+        The statistics of the ingest
+
+    """
+    import asyncio
+    import os
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from .ingest import Pipeline, Summary, COPY_BACKLOG, walk_files
+
+    if concurrency < 1:
+        raise ValueError('The concurrency must be at least 1')
+    if retry is None:
+        retry = RetryPolicy()
+    if summary is None:
+        summary = Summary()
+
+    loop = asyncio.get_running_loop()
+    # placements are retried inside the copy, which owns a copy slot
+    pipeline = Pipeline(repo_path, summary, catalog=catalog, cache=cache, mode=mode,
+                        video_hash=video_hash, copy_backlog=concurrency * COPY_BACKLOG,
+                        io=retry.call, journal=journal, heic_hash=heic_hash,
+                        processes=jobs if jobs is not None else os.cpu_count() or 1,
+                        photo_hash=photo_hash)
+    files = AsyncFiles(concurrency)
+    walker = iter(walk_files(path, walk, walk_filter))
+
+    def next_entry():
+        file_obj = next(walker, None)
+        return file_obj, file_obj is not None and not pipeline.resumed(file_obj)
+
+    def submit(func, *args):
+        # called from the coordinating thread
+        return asyncio.run_coroutine_threadsafe(files.call(func, *args), loop)
+
+    # the inspections in flight; results are settled in walk order
+    window = deque()
+    copies = []
+    coordinator = ThreadPoolExecutor(max_workers=1)
+    try:
+        async def settle_next():
+            file_obj, task = window.popleft()
+            result = await task
+            await loop.run_in_executor(coordinator, pipeline.settle, file_obj, result, copies, submit)
+
+        await loop.run_in_executor(coordinator, pipeline.replay, copies, submit)
+        while True:
+            # listing a remote directory is latency bound too; a failed
+            # generator cannot be resumed, so the walk is not retried
+            file_obj, candidate = await loop.run_in_executor(coordinator, next_entry)
+            if file_obj is None:
+                break
+            summary.total_files += 1
+            if not candidate:
+                continue
+
+            window.append((file_obj, asyncio.ensure_future(files.call(retry.call, pipeline.inspect, file_obj))))
+            while len(window) > 2 * concurrency:
+                await settle_next()
+
+        while window:
+            await settle_next()
+
+        # surface any copy failures
+        for future in copies:
+            await asyncio.wrap_future(future)
+    finally:
+        for _, task in window:
+            task.cancel()
+        coordinator.shutdown(wait=True)
+        files.close()
+        pipeline.close()
+
+    return summary
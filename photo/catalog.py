@@ -0,0 +1,668 @@
+"""
+Repository catalog
+
+A SQLite database kept in the root of the photo repository that records every
+file placed in it: the canonical path, the content checksum, the capture
+date, the tags, and the size and modification time of the file. Duplicate
+detection during an ingest is an indexed lookup on the checksum instead of a
+probe of the filesystem, so the same image is recognized even when it arrives
+with a different date or extension.
+
+A repository filled before it had a catalog, or whose catalog was lost, is
+brought back with `photo catalog rebuild`, which walks the repository and
+records the files the catalog lacks, with the tags embedded in them.
+"""
+
+# the name of the catalog file in the repository root; hidden so that walking
+# the repository never picks it up
+CATALOG_NAME = '.photo-catalog.db'
+
+# the number of files a rebuild checksums and records at a time
+REBUILD_BATCH = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    checksum TEXT NOT NULL,
+    date TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_checksum ON files (checksum);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    path TEXT NOT NULL REFERENCES files (path) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (tag, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_path ON tags (path);
+CREATE TABLE IF NOT EXISTS pending_tags (
+    path TEXT PRIMARY KEY REFERENCES files (path) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS verified (
+    path TEXT PRIMARY KEY REFERENCES files (path) ON DELETE CASCADE,
+    verified_ns INTEGER NOT NULL,
+    status TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS perceptual (
+    checksum TEXT NOT NULL,
+    scheme TEXT NOT NULL,
+    hash INTEGER NOT NULL,
+    PRIMARY KEY (checksum, scheme)
+) WITHOUT ROWID;
+"""
+
+
+class Catalog:
+    """
+    The catalog of a photo repository
+
+    The catalog may be shared between threads; every access is serialized.
+
+    Arguments
+    ---------
+    repo_path : str
+        The root of the photo repository
+
+    """
+
+    def __init__(self, repo_path):
+        import os
+        import sqlite3
+        import threading
+        from pathlib import Path
+
+        # keys are relative to the absolute root, however the root is given
+        self.repo_path = Path(repo_path).expanduser().absolute()
+        os.makedirs(self.repo_path, exist_ok=True)
+        self.path = self.repo_path / CATALOG_NAME
+
+        self._lock = threading.RLock()
+        # a generous timeout lets concurrent photo processes wait on each other
+        self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        self._conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Commit any pending changes and close the database
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    def relative(self, path):
+        """
+        The key of a file in the catalog, its path relative to the repository
+        """
+        from pathlib import Path
+
+        path = Path(path)
+        if path.is_absolute():
+            path = path.relative_to(self.repo_path)
+        return path.as_posix()
+
+    def add(self, path, checksum, date=None, tags=None):
+        """
+        Record a file placed in the repository
+
+        Arguments
+        ---------
+        path : str
+            The path of the file within the repository
+
+        checksum : str
+            The content checksum of the file
+
+        Keyword Arguments
+        -----------------
+        date : datetime
+            The date the photo or video was taken
+
+        tags : list
+            The tags of the file
+
+        """
+        key = self.relative(path)
+        stat = (self.repo_path / key).stat()
+        date_str = date.isoformat() if date is not None else None
+
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                               (key, checksum, date_str, stat.st_size, stat.st_mtime_ns))
+            self._set_tags(key, tags or [])
+
+    def remove(self, path):
+        """
+        Forget a file
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM files WHERE path = ?', (self.relative(path),))
+
+    def get(self, path):
+        """
+        Look up the record of a file
+
+        Arguments
+        ---------
+        path : str
+            The path of the file within the repository
+
+        Returns
+        -------
+        dict | None
+            The checksum, date, size, mtime_ns and tags of the file, or None if
+            the file is not in the catalog
+
+        """
+        key = self.relative(path)
+        with self._lock:
+            row = self._conn.execute('SELECT checksum, date, size, mtime_ns FROM files WHERE path = ?',
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            tags = self.get_tags(key)
+
+        checksum, date, size, mtime_ns = row
+        return {'path': self.repo_path / key,
+                'checksum': checksum,
+                'date': date,
+                'size': size,
+                'mtime_ns': mtime_ns,
+                'tags': tags,
+                }
+
+    def lookup(self, checksum):
+        """
+        Find the files with a given content checksum
+
+        Arguments
+        ---------
+        checksum : str
+            The full content checksum
+
+        Returns
+        -------
+        list
+            The paths of the matching files
+
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT path FROM files WHERE checksum = ? ORDER BY path',
+                                      (checksum,)).fetchall()
+        return [self.repo_path / row[0] for row in rows]
+
+    def with_size(self, size):
+        """
+        Find the files of a given size
+
+        Arguments
+        ---------
+        size : int
+            The size in bytes
+
+        Returns
+        -------
+        list
+            The path, checksum and date of each matching file
+
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT path, checksum, date FROM files WHERE size = ? ORDER BY path',
+                                      (size,)).fetchall()
+        return [{'path': self.repo_path / path, 'checksum': checksum, 'date': date}
+                for path, checksum, date in rows]
+
+    def duplicates(self):
+        """
+        Find the files sharing a content checksum
+
+        Returns
+        -------
+        list
+            A sorted list of paths for each checksum recorded more than once
+
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT checksum, path FROM files WHERE checksum IN '
+                                      '(SELECT checksum FROM files GROUP BY checksum HAVING COUNT(*) > 1) '
+                                      'ORDER BY checksum, path').fetchall()
+        groups = {}
+        for checksum, path in rows:
+            groups.setdefault(checksum, []).append(self.repo_path / path)
+        return list(groups.values())
+
+    def get_tags(self, path):
+        """
+        The tags recorded for a file, in the order they were written
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT tag FROM tags WHERE path = ? ORDER BY position',
+                                      (self.relative(path),)).fetchall()
+        return [row[0] for row in rows]
+
+    def set_tags(self, path, tags, pending=False):
+        """
+        Replace the tags recorded for a file
+
+        Arguments
+        ---------
+        path : str
+            The path of the file within the repository
+
+        tags : list
+            The tags of the file
+
+        Keyword Arguments
+        -----------------
+        pending : bool
+            The tags are not yet written to the file. Otherwise they are, and
+            any pending mark is cleared.
+
+        """
+        key = self.relative(path)
+        with self._lock, self._conn:
+            self._set_tags(key, tags)
+            if pending:
+                self._conn.execute('INSERT OR IGNORE INTO pending_tags VALUES (?)', (key,))
+            else:
+                self._conn.execute('DELETE FROM pending_tags WHERE path = ?', (key,))
+
+    def pending_tags(self):
+        """
+        The tags recorded but not yet written to their files
+
+        Returns
+        -------
+        dict
+            The tags of each pending file, by absolute path
+
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT path FROM pending_tags ORDER BY path').fetchall()
+            return {self.repo_path / row[0]: self.get_tags(row[0]) for row in rows}
+
+    def contains(self, path):
+        """
+        Check whether a file is recorded, anywhere it is given from
+        """
+        from pathlib import Path
+
+        root = self.repo_path.absolute()
+        path = Path(path).absolute()
+        if root not in path.parents:
+            return False
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM files WHERE path = ?',
+                                     (path.relative_to(root).as_posix(),)).fetchone()
+        return row is not None
+
+    def _set_tags(self, key, tags):
+        self._conn.execute('DELETE FROM tags WHERE path = ?', (key,))
+        self._conn.executemany('INSERT OR IGNORE INTO tags (tag, path, position) VALUES (?, ?, ?)',
+                               [(tag, key, idx) for idx, tag in enumerate(tags)])
+
+    def paths(self):
+        """
+        The set of every file in the catalog, relative to the repository
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT path FROM files').fetchall()
+        return {row[0] for row in rows}
+
+    def file_stats(self):
+        """
+        The size and modification time recorded for every file
+
+        Returns
+        -------
+        dict
+            The size and mtime_ns of each file, keyed by its path relative to
+            the repository
+
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT path, size, mtime_ns FROM files').fetchall()
+        return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def checksums(self):
+        """
+        The checksum of every file in the catalog
+
+        Returns
+        -------
+        list
+            The path and checksum of each file, ordered by path
+
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT path, checksum FROM files ORDER BY path').fetchall()
+        return [(self.repo_path / path, checksum) for path, checksum in rows]
+
+    def due_for_verification(self, before_ns):
+        """
+        The files to verify: never verified, verified before a time, or
+        failed their last verification
+
+        Arguments
+        ---------
+        before_ns : int
+            Files verified successfully since this time, in nanoseconds since
+            the epoch, are left out
+
+        Returns
+        -------
+        list
+            The path and checksum of each file, least recently verified first
+
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT files.path, files.checksum FROM files '
+                                      'LEFT JOIN verified ON verified.path = files.path '
+                                      "WHERE verified.path IS NULL OR verified.verified_ns < ? "
+                                      "OR verified.status != 'ok' "
+                                      'ORDER BY COALESCE(verified.verified_ns, 0), files.path',
+                                      (before_ns,)).fetchall()
+        return [(self.repo_path / path, checksum) for path, checksum in rows]
+
+    def set_verified(self, path, status, verified_ns):
+        """
+        Record the outcome of verifying a file
+
+        Arguments
+        ---------
+        path : str
+            The path of the file within the repository
+
+        status : str
+            The outcome, one of photo.verify.STATUSES
+
+        verified_ns : int
+            The time of the verification, in nanoseconds since the epoch
+
+        """
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO verified VALUES (?, ?, ?)',
+                               (self.relative(path), verified_ns, status))
+
+    def perceptual_hashes(self, scheme):
+        """
+        The perceptual hashes recorded with a scheme
+
+        Arguments
+        ---------
+        scheme : str
+            The perceptual hash, 'dhash' or 'phash'
+
+        Returns
+        -------
+        dict
+            The 64 bit hash of each content checksum
+
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT checksum, hash FROM perceptual WHERE scheme = ?',
+                                      (scheme,)).fetchall()
+        # SQLite integers are signed
+        return {checksum: value & 0xFFFFFFFFFFFFFFFF for checksum, value in rows}
+
+    def set_perceptual_hashes(self, scheme, hashes):
+        """
+        Record perceptual hashes
+
+        Arguments
+        ---------
+        scheme : str
+            The perceptual hash, 'dhash' or 'phash'
+
+        hashes : dict
+            The 64 bit hash of each content checksum
+
+        """
+        rows = [(checksum, scheme, value - (1 << 64) if value >= 1 << 63 else value)
+                for checksum, value in hashes.items()]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO perceptual VALUES (?, ?, ?)', rows)
+
+    def tagged(self, tag, prefix=False):
+        """
+        The files carrying a tag
+
+        Arguments
+        ---------
+        tag : str
+            The tag to look for
+
+        Keyword Arguments
+        -----------------
+        prefix : bool
+            Match every tag that starts with tag
+
+        Returns
+        -------
+        set
+            The matching files, relative to the repository
+
+        """
+        with self._lock:
+            if prefix and tag:
+                # a range on the primary key, so the index serves the prefix
+                upper = tag[:-1] + chr(ord(tag[-1]) + 1)
+                rows = self._conn.execute('SELECT path FROM tags WHERE tag >= ? AND tag < ?',
+                                          (tag, upper)).fetchall()
+            elif prefix:
+                rows = self._conn.execute('SELECT path FROM tags').fetchall()
+            else:
+                rows = self._conn.execute('SELECT path FROM tags WHERE tag = ?', (tag,)).fetchall()
+        return {row[0] for row in rows}
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+
+def _name_date(path):
+    """
+    The date in a canonical filename, or None for any other name
+    """
+    from datetime import datetime
+
+    try:
+        return datetime.strptime(path.stem[:13], '%y%m%d_%H%M%S')
+    except ValueError:
+        return None
+
+
+def rebuild(catalog, jobs=None, video_hash=None, heic_hash=None, photo_hash=None, report=None):
+    """
+    Bring a catalog in line with the files in its repository
+
+    The repository is walked for photos and videos. Files recorded with their
+    current size and modification time are left alone; the others are
+    checksummed, dated from their canonical name, or read from the file when
+    the name is not canonical, and recorded with the tags embedded in them.
+    Records of files no longer in the repository are removed.
+
+    Arguments
+    ---------
+    catalog : Catalog
+        The catalog to rebuild
+
+    Keyword Arguments
+    -----------------
+    jobs : int
+        The number of files checksummed in parallel. Defaults to the number
+        of cores.
+
+    video_hash : str
+        The video checksum scheme, one of photo.videohash.SCHEMES, or None for
+        the MD5 of the whole file
+
+    heic_hash : str
+        The HEIC checksum scheme, 'coded' or None for the pixel checksum
+
+    photo_hash : str
+        The pixel checksum scheme, 'raw' or None for the legacy checksum
+
+    report : callable
+        Called as report(path, problem) for every file that could not be
+        recorded as it is, as it is found
+
+    Returns
+    -------
+    dict
+        The number of files 'added', 'unchanged', 'removed' and 'unreadable'
+
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    from .exif import read_tags
+    from .ingest import compute_checksum, file_date, PHOTO_EXT, VIDEO_EXT
+    from .verify import name_checksum
+    from .walker import scan_tree, WalkFilter
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    recorded = catalog.file_stats()
+    counts = {'added': 0, 'unchanged': 0, 'removed': 0, 'unreadable': 0}
+
+    changed = []
+    for entry in scan_tree(catalog.repo_path, WalkFilter(extensions=PHOTO_EXT + VIDEO_EXT)):
+        key = catalog.relative(entry.path)
+        stat = entry.stat()
+        if recorded.pop(key, None) == (stat.st_size, stat.st_mtime_ns):
+            counts['unchanged'] += 1
+        else:
+            changed.append(catalog.repo_path / key)
+
+    def inspect(path):
+        try:
+            checksum = compute_checksum(path, video_hash, heic_hash, photo_hash)[1]
+        except OSError:
+            checksum = None
+        if checksum is None:
+            return path, None, None
+        date = _name_date(path)
+        if date is None:
+            date = file_date(path)
+        return path, checksum, date
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for start in range(0, len(changed), REBUILD_BATCH):
+            batch = changed[start:start + REBUILD_BATCH]
+            tags = read_tags(batch, backend='embedded')
+            for path, checksum, date in executor.map(inspect, batch):
+                if checksum is None:
+                    counts['unreadable'] += 1
+                    if report is not None:
+                        report(path, 'could not be read')
+                    continue
+                named = name_checksum(path)
+                if named is not None and checksum[:8] != named and report is not None:
+                    report(path, f'content checksum {checksum} does not match the name')
+                catalog.add(path, checksum, date, tags.get(str(path), []))
+                counts['added'] += 1
+
+    # what is left was recorded but is gone
+    for key in recorded:
+        catalog.remove(key)
+        counts['removed'] += 1
+
+    return counts
+
+
+def sync_tags(filename, tags):
+    """
+    Update the catalog after the tags of a file changed
+
+    Files outside the configured repository, or not recorded in its catalog,
+    are ignored.
+
+    Arguments
+    ---------
+    filename : str
+        The file whose tags changed
+
+    tags : list
+        The new tags of the file
+
+    """
+    sync_tag_map({filename: tags})
+
+
+def sync_tag_map(tag_map):
+    """
+    Update the catalog after the tags of many files changed
+
+    Arguments
+    ---------
+    tag_map : dict
+        The new list of tags of each changed file
+
+    """
+    from pathlib import Path
+
+    repo_path = repository_path()
+    if repo_path is None:
+        return
+
+    changed = {}
+    for filename, tags in tag_map.items():
+        path = Path(filename).absolute()
+        if repo_path in path.parents:
+            changed[path] = tags
+    if len(changed) == 0:
+        return
+
+    with Catalog(repo_path) as catalog:
+        for path, tags in changed.items():
+            if catalog.get(path) is not None:
+                catalog.set_tags(path, tags)
+
+
+def repository_path():
+    """
+    The root of the configured repository, if it has a catalog
+
+    Returns
+    -------
+    Path | None
+        The absolute root of the repository, or None
+
+    """
+    from pathlib import Path
+    from .config import get_global_config
+
+    cfg = get_global_config()
+    if not cfg:
+        return None
+
+    repo_path = Path(cfg["repo"]["path"])
+    if not (repo_path / CATALOG_NAME).exists():
+        return None
+    return repo_path
+
+
+def repository_catalog():
+    """
+    Open the catalog of the configured repository
+
+    Returns
+    -------
+    Catalog | None
+        The catalog, or None if the repository has none
+
+    """
+    repo_path = repository_path()
+    return Catalog(repo_path) if repo_path is not None else None
@@ -0,0 +1,27 @@
+"""
+Choices of the command line options
+
+The lists live here, apart from the modules that use them, so that building
+the argument parser imports nothing else.
+"""
+
+# the ways a file is placed in the repository
+MODES = ['auto', 'reflink', 'copy_file_range', 'hardlink', 'move', 'copy']
+
+# the video checksum schemes understood by photo.videohash.hash_video
+VIDEO_SCHEMES = ['file', 'mdat']
+
+# the checksum schemes of photos: the text of every pixel, or the raw pixel bytes
+PHOTO_SCHEMES = ['legacy', 'raw']
+
+# the checksum schemes of HEIC photos: the decoded pixels, or the coded data
+HEIC_SCHEMES = ['legacy', 'coded']
+
+# the ways tags can be stored
+TAG_BACKENDS = ['embedded', 'sidecar', 'catalog']
+
+# the perceptual hashes available
+SIMILAR_SCHEMES = ['dhash', 'phash']
+
+# the stages recorded by photo add, in pipeline order
+STAGES = ['walk', 'hash', 'date', 'exists', 'copy', 'exiftool']
@@ -1,5 +1,6 @@
-def main_entry():
+def main_entry(argv=None):
     import argparse
+    from .choices import MODES, VIDEO_SCHEMES, STAGES, SIMILAR_SCHEMES, HEIC_SCHEMES, PHOTO_SCHEMES
 
     description='Manage photos my way'
     parser = argparse.ArgumentParser(description=description)
@@ -17,8 +18,27 @@ def main_entry():
     descr = 'Tag the photo or video with EXIF metadata'
     tag = action.add_parser('tag', help=descr, description=descr)
 
-    tag.add_argument('filename', help='The filename to modify')
-    tag.add_argument('tags', nargs=argparse.REMAINDER, action='store', help='The name of the tag(s) to add or subtract')
+    tag.add_argument('-f', '--files', nargs='+', action='extend', default=None, help='The filenames, globs, directories or @filelists to modify; end the list with -- before the tags')
+    tag.add_argument('filename', nargs='?', help='The filename, glob, directory or @filelist to modify, when -f is not given')
+    tag.add_argument('tags', nargs=argparse.REMAINDER, action='store',
+                     help='The name of the tag(s) to add or subtract. Several files are given with -f, or ahead of the tags and a --')
+
+    # TAGS action: manage tags held outside the files
+    # ===============================================
+    descr = 'Manage the tags held in sidecars or the catalog'
+    tags = action.add_parser('tags', help=descr, description=descr)
+    tags_action = tags.add_subparsers(title='Tag operations', dest='tags_action')
+    tags_action.required = True
+
+    descr = 'Write the pending tags into the files, in batches'
+    tags_sync = tags_action.add_parser('sync', help=descr, description=descr)
+    tags_sync.add_argument('fileglob', nargs='*', help='The files to sync (default: the whole repository)')
+    tags_sync.add_argument('-b', '--backend', choices=['sidecar', 'catalog'], default=None, help='The backend holding the tags (default: the tags backend of photorc)')
+
+    descr = 'List the files whose tags are not yet written to them'
+    tags_status = tags_action.add_parser('status', help=descr, description=descr)
+    tags_status.add_argument('fileglob', nargs='*', help='The files to check (default: the whole repository)')
+    tags_status.add_argument('-b', '--backend', choices=['sidecar', 'catalog'], default=None, help='The backend holding the tags (default: the tags backend of photorc)')
 
     # ADD action: add a photo to the repository
     # =========================================
@@ -29,6 +49,36 @@ def main_entry():
 
     proc.add_argument('path', nargs="*", help='The directory or filenames to process')
     proc.add_argument('-w', '--walk', action="store_true", help='Walk the directory structure')
+    proc.add_argument('--include', action='append', default=None, help='With --walk, only add files matching this glob; may be repeated (adds to the walk include of photorc)')
+    proc.add_argument('--exclude', action='append', default=None, help='With --walk, skip files and directories matching this glob; may be repeated (adds to the walk exclude of photorc)')
+    proc.add_argument('-j', '--jobs', type=int, default=None, help='The number of files to checksum in parallel (default: number of cores)')
+    proc.add_argument('--no-cache', action="store_true", help='Checksum every file even if it was seen unchanged before')
+    proc.add_argument('-m', '--mode', choices=MODES, default=None, help='How files are placed in the repository (default: the add mode of photorc, or auto)')
+    proc.add_argument('--thumbs', action='store_true', help='Make thumbnails of the photos added')
+    proc.add_argument('--resume', action='store_true', help='Continue an interrupted import from its journal')
+    proc.add_argument('--async', dest='use_async', action='store_true', help='Keep many file operations in flight, for network mounted inboxes')
+    proc.add_argument('--concurrency', type=int, default=32, help='The number of file operations in flight with --async (default: 32)')
+    proc.add_argument('--retries', type=int, default=3, help='The number of retries of transient I/O errors with --async (default: 3)')
+    proc.add_argument('--stats', nargs='?', const='text', default=None, choices=['text', 'json', 'prometheus'], help='Report the time, calls and bytes of each stage (default format: text)')
+    proc.add_argument('--stats-file', default=None, help='Write the --stats report to this file instead of the screen')
+    proc.add_argument('--profile', default=None, choices=STAGES, help='Profile a single stage with cProfile and print the hottest calls')
+    proc.add_argument('--video-hash', choices=['legacy'] + VIDEO_SCHEMES, default=None, help='How videos are checksummed (default: the add video_hash of photorc, or legacy)')
+    proc.add_argument('--photo-hash', choices=PHOTO_SCHEMES, default=None, help='How photos are checksummed: legacy hashes the text of every pixel, raw hashes the pixel bytes, much faster but a different checksum (default: the add photo_hash of photorc, or legacy)')
+    proc.add_argument('--heic-hash', choices=HEIC_SCHEMES, default=None, help='How HEIC photos are checksummed: legacy decodes the pixels, coded hashes the coded image data (default: the add heic_hash of photorc, or legacy)')
+
+    # WATCH action: add photos as they land in an inbox
+    # ==================================================
+    descr = 'Watch an inbox and add photos to the repository as they land'
+    watch = action.add_parser('watch', help=descr, description=descr)
+
+    watch.add_argument('inbox', nargs='?', default=None, help='The directory to watch')
+    watch.add_argument('-j', '--jobs', type=int, default=None, help='The number of files to checksum in parallel (default: number of cores)')
+    watch.add_argument('-m', '--mode', choices=MODES, default=None, help='How files are placed in the repository (default: the add mode of photorc, or auto)')
+    watch.add_argument('--settle', type=float, default=None, help='The seconds a file must stop changing before it is added (default: the watch settle of photorc, or 2)')
+    watch.add_argument('--batch', type=int, default=None, help='The most files added in one batch (default: the watch batch of photorc, or 100)')
+    watch.add_argument('--poll', type=float, default=None, help='Scan the inbox every this many seconds instead of using inotify')
+    watch.add_argument('--scan', action='store_true', help='Also add the files already in the inbox')
+    watch.add_argument('--status', action='store_true', help='Print the status of the running watch and exit')
 
     # META action: print the meta data for a photo
     # ============================================
@@ -36,8 +86,76 @@ def main_entry():
     descr = 'Display meta data of a specified photo on screen'
     meta = action.add_parser('meta', help=descr, description=descr)
 
-    meta.add_argument('fileglob', nargs='*', help='The filename or glob of photos or videos to show')
-    meta.add_argument('-v', '--verbose', help='List all metadata fields in the file')
+    meta.add_argument('fileglob', nargs='*', help='The filenames, globs, directories or @filelists of photos or videos to show')
+    meta.add_argument('-f', '--format', choices=['table', 'json', 'csv'], default='table', help='The output format (default: table)')
+    meta.add_argument('--fields', default=None, help='Comma separated exiftool tag names to show (default: the common fields)')
+    meta.add_argument('-v', '--verbose', action='store_true', help='List all metadata fields in the file')
+
+    # SEARCH action: find photos by tag
+    # ================================
+    # Search answers boolean tag queries from the repository catalog
+    descr = 'Find photos and videos in the repository by tag'
+    search = action.add_parser('search', help=descr, description=descr)
+
+    search.add_argument('query', nargs='+', help='The tag query, e.g. travel and karen not work, or trav*. Files added before the catalog are found after photo catalog rebuild')
+
+    # DEDUPE action: find duplicates already in the repository
+    # ========================================================
+    descr = 'Report or reclaim duplicate files in the repository'
+    dedupe = action.add_parser('dedupe', help=descr, description=descr)
+
+    dedupe.add_argument('--reclaim', action='store_true', help='Delete all but one of each set of byte identical files')
+
+    # CATALOG action: maintain the repository catalog
+    # ================================================
+    descr = 'Maintain the catalog of the repository'
+    catalog = action.add_parser('catalog', help=descr, description=descr)
+    catalog_action = catalog.add_subparsers(title='Catalog operations', dest='catalog_action')
+    catalog_action.required = True
+
+    descr = 'Walk the repository and record the files the catalog lacks, with their embedded tags'
+    catalog_rebuild = catalog_action.add_parser('rebuild', help=descr, description=descr)
+    catalog_rebuild.add_argument('-j', '--jobs', type=int, default=None, help='The number of files to checksum in parallel (default: number of cores)')
+
+    # VERIFY action: checksum the repository again
+    # ============================================
+    descr = 'Check the repository files against their checksums'
+    verify = action.add_parser('verify', help=descr, description=descr)
+
+    verify.add_argument('-j', '--jobs', type=int, default=None, help='The number of files to checksum in parallel (default: number of cores)')
+    verify.add_argument('--rate', type=float, default=None, help='The most megabytes read per second, 0 for no limit (default: the verify rate of photorc)')
+    verify.add_argument('--window', type=float, default=None, help='Skip files verified within this many days (default: the verify window_days of photorc, or 30)')
+    verify.add_argument('--all', action='store_true', help='Verify every file, however recently it was verified')
+
+    # THUMBS action: fill the thumbnail cache
+    # =======================================
+    descr = 'Report on or fill the thumbnail cache of the repository'
+    thumbs = action.add_parser('thumbs', help=descr, description=descr)
+
+    thumbs.add_argument('--rebuild', action='store_true', help='Make the thumbnails missing from the cache')
+    thumbs.add_argument('--force', action='store_true', help='With --rebuild, make every thumbnail again')
+    thumbs.add_argument('-s', '--size', type=int, default=None, help='The longest side in pixels (default: the thumbs size of photorc, or 256)')
+    thumbs.add_argument('-j', '--jobs', type=int, default=None, help='The number of processes (default: number of cores)')
+
+    # SIMILAR action: find near duplicates by perceptual hash
+    # =======================================================
+    descr = 'Find photos that look alike: re-encoded, resized or lightly edited copies'
+    similar = action.add_parser('similar', help=descr, description=descr)
+
+    similar.add_argument('fileglob', nargs='*', help='The photos to find look-alikes of (default: report every set of similar photos in the repository)')
+    similar.add_argument('-d', '--distance', type=int, default=None, help='The largest number of differing hash bits (default: the similar distance of photorc, or 6)')
+    similar.add_argument('--scheme', choices=SIMILAR_SCHEMES, default=None, help='The perceptual hash (default: the similar scheme of photorc, or dhash)')
+    similar.add_argument('-j', '--jobs', type=int, default=None, help='The number of processes hashing new photos (default: number of cores)')
+
+    # CONFIG action: manage the configuration file
+    # ============================================
+    descr = 'Manage the global configuration file photorc'
+    config = action.add_parser('config', help=descr, description=descr)
+    config_action = config.add_subparsers(title='Configuration operations', dest='config_action')
+    config_action.required = True
+
+    descr = 'Create photorc, or add the settings it lacks, with their defaults and documentation'
+    config_action.add_parser('init', help=descr, description=descr)
 
     # VERSION action: Print the version of the software and exit
     # ==========================================================
@@ -47,25 +165,53 @@ def main_entry():
     # END action definition
     # Move on to parsing
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     try:
         if args.action.lower() == 'tag':
-            cli_tag(args.filename, args.tags)
+            cli_tag(*split_tag_args(args.filename, args.files, args.tags))
+
+        elif args.action.lower() == 'tags':
+            cli_tags(args.tags_action, args.fileglob, args.backend)
 
         elif args.action.lower() == 'add':
-            cli_add(args.path, args.walk)
+            cli_add(args.path, args.walk, jobs=args.jobs, use_cache=not args.no_cache, mode=args.mode,
+                    video_hash=args.video_hash, stats=args.stats, stats_file=args.stats_file,
+                    profile=args.profile, use_async=args.use_async, concurrency=args.concurrency,
+                    retries=args.retries, resume=args.resume, thumbs=args.thumbs, heic_hash=args.heic_hash,
+                    include=args.include, exclude=args.exclude, photo_hash=args.photo_hash)
+
+        elif args.action.lower() == 'watch':
+            cli_watch(args.inbox, args.jobs, args.mode, args.settle, args.batch, args.poll, args.scan,
+                      args.status)
 
         elif args.action.lower() == 'meta':
-            cli_meta(args.fileglob)
+            fields = args.fields.split(',') if args.fields is not None else None
+            cli_meta(args.fileglob, args.format, fields, args.verbose)
 
-        elif args.action.lower() == 'version':
-            from os.path import join, dirname
-            import os
-            import subprocess
+        elif args.action.lower() == 'search':
+            cli_search(' '.join(args.query))
+
+        elif args.action.lower() == 'catalog':
+            cli_catalog(args.catalog_action, args.jobs)
+
+        elif args.action.lower() == 'verify':
+            cli_verify(args.jobs, args.rate, 0 if args.all else args.window)
+
+        elif args.action.lower() == 'thumbs':
+            cli_thumbs(args.rebuild, args.force, args.size, args.jobs)
+
+        elif args.action.lower() == 'similar':
+            cli_similar(args.fileglob, args.distance, args.scheme, args.jobs)
 
-            with open(join(dirname(__file__), 'version'), 'r') as fid:
-                print('Photo Version: {0}'.format(fid.readline()))
+        elif args.action.lower() == 'dedupe':
+            cli_dedupe(args.reclaim)
+
+        elif args.action.lower() == 'config':
+            cli_config(args.config_action)
+
+        elif args.action.lower() == 'version':
+            print('Photo Version: {0}'.format(get_version()))
 
         else:
             raise ValueError('Unrecognized action, "{0}"'.format(args.action))
@@ -74,84 +220,839 @@ def main_entry():
         raise
 
 
-def cli_meta(fileglob):
+def get_version():
+    """
+    The version of the package
+
+    Returns
+    -------
+    str
+        The version setuptools_scm wrote to photo/version.py at build time,
+        that of the installed distribution, or 'unknown' in a bare checkout
+
+    """
+    try:
+        from .version import version
+    except ImportError:
+        from importlib.metadata import version as dist_version, PackageNotFoundError
+        try:
+            return dist_version('photo')
+        except PackageNotFoundError:
+            return 'unknown'
+    return version
+
+
+def cli_config(operation):
+    """
+    Manage the global configuration file
+
+    Arguments
+    ---------
+    operation : str
+        'init' creates photorc with the default of every setting, or adds
+        the settings an existing file lacks. The settings already in the file
+        are left alone.
+
+    Returns
+    -------
+    str
+        The location of the configuration file
+
+    """
+    from .config import generate_global_config
+
+    if operation != 'init':
+        raise ValueError('Unrecognized config operation, "{0}"'.format(operation))
+
+    rc_file = generate_global_config()
+    print(f"Configuration file: {rc_file}")
+    return rc_file
+
+
+def cli_meta(fileglob, fmt='table', fields=None, verbose=False):
     """
     Display meta data to screen
 
+    All the files are read in one batched pass. The count of files shown goes
+    to stderr, so json and csv output can be redirected to a file.
+
+    Example:
+    photo meta -f csv --fields FileName,Model,DateTimeOriginal album/ > album.csv
+
+    Arguments
+    ---------
+    fileglob : list
+        The filenames, globs, directories or @filelists of the files to show
+
+    Keyword Arguments
+    -----------------
+    fmt : str
+        The output format: 'table', 'json' or 'csv'
+
+    fields : list
+        The exiftool tag names to show. Defaults to the common fields.
+
+    verbose : bool
+        Show every field in the files
+
+    Returns
+    -------
+    int
+        The number of files shown
+
     """
-    from .exif import list_metadata
+    import os
+    import sys
+    from .exif import read_metadata, COMMON_FIELDS
+    from .utilities import expand_paths
 
     if isinstance(fileglob, str):
         fileglob = [fileglob]
-    if len(fileglob) == 0:
+    filenames = expand_paths(fileglob)
+    if len(filenames) == 0:
         raise ValueError('No files found')
+    for filename in filenames:
+        if not os.path.exists(filename):
+            raise IOError('Requested file does not exist')
+
+    if verbose:
+        fields = None
+    elif fields is None:
+        fields = COMMON_FIELDS
+    records = read_metadata(filenames, fields)
+
+    print(format_metadata(records, fmt, fields))
+    print('Displayed meta data for {0} images'.format(len(records)), file=sys.stderr)
+    return len(records)
+
+
+def format_metadata(records, fmt, fields=None):
+    """
+    Format metadata records for output
+
+    Arguments
+    ---------
+    records : list
+        The dictionaries returned by photo.exif.read_metadata
+
+    fmt : str
+        'table', 'json' or 'csv'
+
+    Keyword Arguments
+    -----------------
+    fields : list
+        The columns, after the filename. Defaults to every field found.
+
+    Returns
+    -------
+    str
+        The formatted text
+
+    """
+    import csv
+    import io
+    import json
+
+    if fmt == 'json':
+        return json.dumps(records, indent=2)
 
-    count = 0
-    for filename in fileglob:
-        import pudb; pudb.set_trace()
-        status = list_metadata(filename)
-        if status == 0:
-            count += 1
+    if fields is None:
+        columns = list(dict.fromkeys(key for record in records for key in record if key != 'SourceFile'))
+    else:
+        columns = list(fields)
+
+    def text(value):
+        if isinstance(value, list):
+            return ', '.join(str(item) for item in value)
+        return '' if value is None else str(value)
+
+    rows = [[record['SourceFile']] + [text(record.get(column)) for column in columns] for record in records]
+
+    if fmt == 'csv':
+        stream = io.StringIO()
+        writer = csv.writer(stream, lineterminator='\n')
+        writer.writerow(['SourceFile'] + columns)
+        writer.writerows(rows)
+        return stream.getvalue().rstrip('\n')
+
+    elif fmt == 'table':
+        if fields is None:
+            # too many fields for columns; list each file on its own
+            blocks = []
+            for record in records:
+                width = max(len(key) for key in record)
+                blocks.append('\n'.join(f"{key:{width}s} : {text(value)}" for key, value in record.items()))
+            return '\n\n'.join(blocks)
+        header = ['SourceFile'] + columns
+        widths = [max(len(row[idx]) for row in rows + [header]) for idx in range(len(header))]
+        lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                 for row in [header, ['-' * width for width in widths]] + rows]
+        return '\n'.join(lines)
+
+    raise ValueError('Unrecognized output format "{0}"'.format(fmt))
+
+
+def cli_search(query):
+    """
+    Print the repository files matching a tag query
+
+    The tags are looked up in the catalog; files it lacks are recorded with
+    their embedded tags by `photo catalog rebuild`.
+
+    Example:
+    photo search travel and karen not work
+
+    Arguments
+    ---------
+    query : str
+        The query. Terms are combined with and, or, not and parentheses, and
+        a trailing * matches any tag with that prefix.
+
+    Returns
+    -------
+    list
+        The paths of the matching files
+
+    """
+    import sys
+    from pathlib import Path
+    from .catalog import Catalog
+    from .config import get_global_config
+    from .search import search
+
+    cfg = get_global_config()
+    repo_path = Path(cfg["repo"]["path"])
+
+    with Catalog(repo_path) as catalog:
+        if len(catalog) == 0:
+            print(f"WARNING: the catalog of {repo_path} is empty; run photo catalog rebuild to index "
+                  "the files already in the repository", file=sys.stderr)
+        matches = search(query, catalog)
+
+    for path in matches:
+        print(path)
+    return matches
+
+
+def cli_thumbs(rebuild=False, force=False, size=None, jobs=None):
+    """
+    Report on or fill the thumbnail cache of the repository
+
+    Filling is incremental: only the photos without a thumbnail are decoded,
+    unless force is set.
+
+    Keyword Arguments
+    -----------------
+    rebuild : bool
+        Make the thumbnails missing from the cache
+
+    force : bool
+        With rebuild, make every thumbnail again
+
+    size : int
+        The longest side of the thumbnails in pixels. Defaults to the thumbs
+        size of the configuration file.
+
+    jobs : int
+        The number of worker processes. Defaults to the number of cores.
+
+    Returns
+    -------
+    tuple
+        The number of thumbnails made, the number already cached and the
+        failures
+
+    """
+    from pathlib import Path
+    from .catalog import Catalog
+    from .config import get_global_config
+    from .ingest import PHOTO_EXT
+    from .thumbs import build_thumbnails, thumb_path, THUMB_SIZE
+
+    cfg = get_global_config()
+    repo_path = Path(cfg["repo"]["path"])
+    if size is None:
+        size = cfg.get("thumbs", {}).get("size", THUMB_SIZE)
+
+    with Catalog(repo_path) as catalog:
+        photos = [(path, checksum) for path, checksum in catalog.checksums()
+                  if path.suffix.upper() in PHOTO_EXT]
+
+    if not rebuild:
+        checksums = {checksum for _, checksum in photos}
+        cached = sum(thumb_path(repo_path, checksum, size).exists() for checksum in checksums)
+        print(f"{cached} of {len(checksums)} photos have a {size} pixel thumbnail")
+        return 0, cached, []
+
+    made, cached, failures = build_thumbnails(photos, repo_path, size, jobs, rebuild=force)
+    for failure in failures:
+        print(f"WARNING: {failure}")
+    print(f"{made} thumbnails made, {cached} already cached, {len(failures)} failed")
+    return made, cached, failures
+
+
+def cli_similar(fileglob=None, distance=None, scheme=None, jobs=None):
+    """
+    Print the photos that look alike
 
-    print('Displayed meta data for {0} images'.format(count))
-    return count
+    The perceptual hash of every repository photo is kept in the catalog;
+    photos added since the last run are hashed first.
+
+    Keyword Arguments
+    -----------------
+    fileglob : list
+        The photos to find look-alikes of in the repository. When empty,
+        every set of similar photos in the repository is reported.
+
+    distance : int
+        The largest number of differing hash bits. Defaults to the similar
+        distance of the configuration file.
+
+    scheme : str
+        The perceptual hash, dhash or phash. Defaults to the similar scheme of
+        the configuration file.
+
+    jobs : int
+        The number of worker processes hashing new photos. Defaults to the
+        number of cores.
+
+    Returns
+    -------
+    list
+        The groups of similar files
+
+    """
+    from pathlib import Path
+    from .catalog import Catalog
+    from .config import get_global_config
+    from .similar import HammingIndex, group_pairs, index_photos, perceptual_hash, DISTANCE
+    from .utilities import expand_paths
+
+    cfg = get_global_config()
+    repo_path = Path(cfg["repo"]["path"])
+    if distance is None:
+        distance = cfg.get("similar", {}).get("distance", DISTANCE)
+    if scheme is None:
+        scheme = cfg.get("similar", {}).get("scheme", "dhash")
+
+    with Catalog(repo_path) as catalog:
+        photos = catalog.checksums()
+        hashed, failures = index_photos(photos, catalog, scheme, jobs)
+        for failure in failures:
+            print(f"WARNING: {failure}")
+        if hashed > 0:
+            print(f"{hashed} new photos hashed")
+        known = catalog.perceptual_hashes(scheme)
+
+    checksums = list(known)
+    index = HammingIndex([known[checksum] for checksum in checksums], distance)
+    paths = {}
+    for path, checksum in photos:
+        if checksum in known:
+            paths.setdefault(checksum, []).append(path)
+
+    groups = []
+    if fileglob:
+        for filename in expand_paths(fileglob):
+            try:
+                value = perceptual_hash(filename, scheme)
+            except Exception as err:
+                print(f"WARNING: {filename}: {err}")
+                continue
+            group = [path for _, idx in index.query(value) for path in paths.get(checksums[idx], [])
+                     if path.resolve() != Path(filename).resolve()]
+            print(f"{filename}: {', '.join(str(path) for path in group) or 'no similar photos'}")
+            groups.append(group)
+    else:
+        for ids in group_pairs(index.pairs()):
+            group = sorted(path for idx in ids for path in paths.get(checksums[idx], []))
+            print(f"Similar: {', '.join(str(path) for path in group)}")
+            groups.append(group)
+        print(f"{len(groups)} sets of similar photos among {len(known)} photos")
+
+    return groups
+
+
+def cli_catalog(operation, jobs=None):
+    """
+    Maintain the catalog of the repository
+
+    Arguments
+    ---------
+    operation : str
+        'rebuild' records the files in the repository the catalog lacks, with
+        their embedded tags, and forgets the files no longer there. Files
+        recorded unchanged are not read, so it is quick to run again.
+
+    Keyword Arguments
+    -----------------
+    jobs : int
+        The number of files checksummed in parallel. Defaults to the number
+        of cores.
+
+    Returns
+    -------
+    dict
+        The number of files added, unchanged, removed and unreadable
+
+    """
+    from pathlib import Path
+    from .catalog import Catalog, rebuild
+    from .config import get_global_config
+
+    if operation != 'rebuild':
+        raise ValueError('Unrecognized catalog operation, "{0}"'.format(operation))
+
+    cfg = get_global_config()
+    repo_path = Path(cfg["repo"]["path"])
+    video_hash = cfg.get("add", {}).get("video_hash", "legacy")
+    heic_hash = cfg.get("add", {}).get("heic_hash", "legacy")
+    photo_hash = cfg.get("add", {}).get("photo_hash", "legacy")
+
+    def report(path, problem):
+        print(f"WARNING: {path}: {problem}")
+
+    with Catalog(repo_path) as catalog:
+        counts = rebuild(catalog, jobs=jobs, video_hash=None if video_hash == 'legacy' else video_hash,
+                         heic_hash=None if heic_hash == 'legacy' else heic_hash,
+                         photo_hash=None if photo_hash == 'legacy' else photo_hash, report=report)
+
+    print(f"{counts['added']} files recorded, {counts['unchanged']} unchanged, "
+          f"{counts['removed']} no longer in the repository, {counts['unreadable']} unreadable")
+    return counts
+
+
+def cli_verify(jobs=None, rate=None, window=None):
+    """
+    Checksum the repository files again and report those that changed
+
+    The results are recorded in the catalog as they are found, so an
+    interrupted run continues where it stopped when started again. Files the
+    catalog lacks are checked against their names and reported.
+
+    Keyword Arguments
+    -----------------
+    jobs : int
+        The number of files checksummed in parallel. Defaults to the number
+        of cores.
+
+    rate : float
+        The most megabytes read per second, or 0 for no limit. Defaults to
+        the verify rate of the configuration file.
+
+    window : float
+        Skip the files verified successfully within this many days. Defaults
+        to the verify window_days of the configuration file.
+
+    Returns
+    -------
+    dict
+        The number of files of each status
+
+    """
+    from pathlib import Path
+    from .catalog import Catalog
+    from .config import get_global_config
+    from .verify import verify_repository, WINDOW_DAYS
+
+    cfg = get_global_config()
+    repo_path = Path(cfg["repo"]["path"])
+    if rate is None:
+        rate = cfg.get("verify", {}).get("rate", 0)
+    if window is None:
+        window = cfg.get("verify", {}).get("window_days", WINDOW_DAYS)
+    video_hash = cfg.get("add", {}).get("video_hash", "legacy")
+    video_hash = None if video_hash == 'legacy' else video_hash
+    heic_hash = cfg.get("add", {}).get("heic_hash", "legacy")
+    heic_hash = None if heic_hash == 'legacy' else heic_hash
+    photo_hash = cfg.get("add", {}).get("photo_hash", "legacy")
+    photo_hash = None if photo_hash == 'legacy' else photo_hash
+
+    messages = {'corrupt': 'content matches neither the catalog nor the name',
+                'catalog_mismatch': 'content matches the name but not the catalog',
+                'name_mismatch': 'content matches the catalog but not the name',
+                'missing': 'file is missing',
+                'unreadable': 'file could not be read',
+                'uncataloged': 'file is not in the catalog; photo catalog rebuild records it',
+                }
+
+    def report(path, status, expected, actual):
+        found = [f"catalog {expected}"] if expected is not None else []
+        found += [f"found {actual}"] if actual is not None else []
+        detail = f" ({', '.join(found)})" if found else ''
+        print(f"FAILED {path}: {messages[status]}{detail}")
+
+    with Catalog(repo_path) as catalog:
+        counts = verify_repository(catalog, jobs=jobs, rate=rate * 1e6 if rate else None,
+                                   window_days=window, video_hash=video_hash, heic_hash=heic_hash,
+                                   photo_hash=photo_hash, report=report)
+
+    failed = sum(count for status, count in counts.items() if status != 'ok')
+    print(f"Verified {counts['ok'] + failed} files: {counts['ok']} ok, {failed} failed")
+    return counts
+
+
+def cli_dedupe(reclaim=False):
+    """
+    Report or reclaim the duplicate files in the repository
+
+    Byte identical files are found by size, then a partial hash, then a full
+    hash. Files sharing a content checksum in the catalog but differing in
+    their bytes (the same photo with other metadata) are reported only.
+
+    Keyword Arguments
+    -----------------
+    reclaim : bool
+        Delete all but the first of each set of byte identical files
+
+    Returns
+    -------
+    tuple
+        The groups of byte identical files and the groups of files with the
+        same content only
+
+    """
+    from pathlib import Path
+    from .catalog import Catalog
+    from .config import get_global_config
+    from .dedupe import repository_duplicates, reclaim as reclaim_groups
+
+    cfg = get_global_config()
+    repo_path = Path(cfg["repo"]["path"])
+
+    with Catalog(repo_path) as catalog:
+        identical, similar = repository_duplicates(repo_path, catalog)
+
+        for group in identical:
+            print(f"Identical: {', '.join(str(path) for path in group)}")
+        for group in similar:
+            print(f"Same content, different metadata: {', '.join(str(path) for path in group)}")
+
+        print(f"{len(identical)} sets of identical files, {len(similar)} sets of files with the same content")
+        if reclaim:
+            freed = reclaim_groups(identical, catalog)
+            print(f"Reclaimed {freed} bytes from {sum(len(group) - 1 for group in identical)} files")
+
+    return identical, similar
+
+
+def split_tag_args(filename, files, rest):
+    """
+    Tell the files from the tags on a photo tag command line
+
+    The files are never guessed from the arguments, since a tag may look
+    like a path. They are the -f/--files option, or the arguments ahead of a
+    --, or else the first argument alone:
+
+    photo tag IMG2133.jpg +travel -sailing
+    photo tag 2021/*.jpg -- 2021
+    photo tag -f 2021/*.jpg -- 2021
+
+    Arguments
+    ---------
+    filename : str
+        The first positional argument
+
+    files : list
+        The -f/--files arguments, or None
+
+    rest : list
+        The remaining arguments
+
+    Returns
+    -------
+    tuple
+        The files to modify and the tags
+
+    """
+    rest = list(rest)
+    if files:
+        targets = list(files)
+        tags = ([filename] if filename is not None else []) + rest
+    elif '--' in rest:
+        split = rest.index('--')
+        targets, tags = [filename] + rest[:split], rest[split + 1:]
+    else:
+        targets, tags = [filename], rest
+
+    if None in targets:
+        raise ValueError('No files given')
+    # a -- left over after -f separates nothing
+    return targets, [tag for tag in tags if tag != '--']
 
 
 def cli_tag(filename, arg_list):
     """
-    Add or remove EXIF tags from a file
+    Add or remove EXIF tags from one or many files
 
     + or no prefix adds tags
 
     - removes tags
 
+    The current tags of every file are read in bulk, the changes are worked
+    out per file, and the files are written back in batches.
+
     Example:
     photo tag IMG2133.jpg +travel +steve -sailing
+    photo tag -f 'album/*.jpg' @more_files.txt -- +travel
 
-    """
-    import subprocess
-    from .exif import get_tags, update_tags
+    Arguments
+    ---------
+    filename : str | list
+        The file(s) to modify. Each may be a filename, glob, directory or
+        @filelist.
 
-    if len(arg_list) == 0:
-        raise ValueError('No tags provided')
+    arg_list : str | list
+        The tags to add or subtract
+
+    Returns
+    -------
+    dict
+        True for each file that now has the requested tags, False for each
+        file that could not be read or written
+
+    """
+    import os
+    from .exif import read_tags, write_tags
+    from .utilities import expand_paths
 
-    cur_tags = get_tags(filename)
+    if isinstance(arg_list, str):
+        arg_list = arg_list.split(' ')
     tag_list = []
-    arg_list = arg_list.split(' ')
     for arg in arg_list:
         tag_elem = arg.split(',')
         for tag in tag_elem:
+            tag = tag.strip()
             if tag != '':
                 tag_list.append(tag)
 
-    for tag in tag_list:
-        if tag[0] == '-':
-            add_str = '-'
-            tag_str = tag[1:]
-        elif tag[0] == '+':
-            add_str = '+'
-            tag_str = tag[1:]
-        else:
-            add_str = '+'
-            tag_str = tag
+    if len(tag_list) == 0:
+        raise ValueError('No tags provided')
 
-        if tag_str in cur_tags and add_str == '+':
-            print('Tag already exists')
-            continue
-        elif tag_str not in cur_tags and add_str == '-':
-            print('Tag does not exist')
+    if isinstance(filename, (str, os.PathLike)):
+        filename = [filename]
+    filenames = expand_paths(filename)
+    if len(filenames) == 0:
+        raise IOError('No files found')
+    if len(filenames) == 1 and not os.path.exists(filenames[0]):
+        raise IOError('Requested file does not exist')
+
+    current = read_tags(filenames)
+    updates = {}
+    for name in filenames:
+        if name not in current:
             continue
-        elif add_str == '+':
-            cur_tags.append(tag_str)
-        elif add_str == '-':
-            cur_tags.remove(tag_str)
+        cur_tags = list(current[name])
+        for tag in tag_list:
+            if tag[0] == '-':
+                if tag[1:] in cur_tags:
+                    cur_tags.remove(tag[1:])
+            else:
+                tag_str = tag[1:] if tag[0] == '+' else tag
+                if tag_str not in cur_tags:
+                    cur_tags.append(tag_str)
+        if cur_tags != current[name]:
+            updates[name] = cur_tags
+
+    written = write_tags(updates) if updates else {}
+
+    results = {}
+    for name in filenames:
+        if name not in current:
+            print(f"FAILED {name}: could not read tags")
+            results[name] = False
+        elif name not in updates:
+            print(f"Unchanged {name}: {','.join(current[name])}")
+            results[name] = True
+        elif written[name]:
+            print(f"Tagged {name}: {','.join(updates[name])}")
+            results[name] = True
         else:
-            raise ValueError('Malformed tag')
+            print(f"FAILED {name}: could not write tags")
+            results[name] = False
 
-    update_tags(filename, cur_tags)
+    tagged = list(written.values()).count(True)
+    failed = list(results.values()).count(False)
+    print(f"Tagged {tagged} files, {len(results) - tagged - failed} unchanged, {failed} failed")
+    return results
 
 
-def cli_add(path, walk):
+def cli_tags(operation, fileglob=None, backend=None):
+    """
+    Report or flush the tags held in sidecars or the catalog
+
+    Example:
+    photo tags sync
+
+    Arguments
+    ---------
+    operation : str
+        'status' lists the files with pending tags; 'sync' writes them into
+        the files
+
+    Keyword Arguments
+    -----------------
+    fileglob : list
+        The files to consider. Defaults to the whole repository.
+
+    backend : str
+        sidecar or catalog. Defaults to the tags backend of the configuration
+        file.
+
+    Returns
+    -------
+    dict
+        The pending tags of each file for status, and for sync True for each
+        file whose tags were written, False otherwise
+
+    """
+    from .tagstore import pending_tags, resolve_backend, sync_tags
+    from .utilities import expand_paths
+
+    backend = resolve_backend(backend)
+    if backend == 'embedded':
+        print('Tags are embedded in the files; there is nothing to sync')
+        return {}
+    filenames = expand_paths(fileglob) if fileglob else None
+
+    if operation == 'status':
+        pending = pending_tags(filenames, backend)
+        for name, tags in sorted(pending.items()):
+            print(f"Pending {name}: {','.join(tags)}")
+        print(f"{len(pending)} files with pending tags")
+        return pending
+
+    written = sync_tags(filenames, backend)
+    for name, success in written.items():
+        if not success:
+            print(f"FAILED {name}: could not write tags")
+    synced = list(written.values()).count(True)
+    print(f"Synced {synced} files, {len(written) - synced} failed")
+    return written
+
+
+def cli_watch(inbox=None, jobs=None, mode=None, settle=None, batch=None, poll=None, scan=False,
+              status=False):
+    """
+    Add photos to the repository as they land in an inbox, until interrupted
+
+    Arguments
+    ---------
+    inbox : str
+        The directory to watch
+
+    Keyword Arguments
+    -----------------
+    jobs : int
+        The number of workers computing checksums and dates. Defaults to the
+        number of cores.
+
+    mode : str
+        How files are placed in the repository. Defaults to the add mode of
+        the configuration file.
+
+    settle : float
+        The seconds a file must stop changing before it is added. Defaults
+        to the watch settle of the configuration file.
+
+    batch : int
+        The most files added in one batch. Defaults to the watch batch of
+        the configuration file.
+
+    poll : float
+        Scan the inbox at this interval instead of using inotify
+
+    scan : bool
+        Also add the files already in the inbox
+
+    status : bool
+        Print the status of the watch running on the repository and return
+
+    """
+    import threading
+    from datetime import datetime
+    from pathlib import Path
+    from .catalog import Catalog
+    from .config import get_global_config, refresh_config
+    from .fingerprint import FingerprintCache
+    from .ingest import ingest, Summary
+    from .journal import Journal, interrupted
+    from . import watch
+
+    cfg = get_global_config()
+    repo_path = Path(cfg["repo"]["path"])
+    socket_path = repo_path / watch.SOCKET_NAME
+
+    if status:
+        try:
+            report = watch.read_status(socket_path)
+        except OSError:
+            raise IOError(f'No photo watch is running on {repo_path}')
+        for key, value in report.items():
+            print(f"{key}: {value}")
+        return
+
+    if inbox is None:
+        raise ValueError('The inbox to watch is required')
+    if settle is None:
+        settle = cfg.get("watch", {}).get("settle", watch.SETTLE_SECONDS)
+    if batch is None:
+        batch = cfg.get("watch", {}).get("batch", watch.BATCH_SIZE)
+
+    counters = watch.WatchStatus()
+    with Catalog(repo_path) as catalog, FingerprintCache() as cache:
+        def add(paths, resume=False):
+            # edits to the configuration apply from the next batch on
+            if refresh_config():
+                print("Configuration changed, reloaded")
+            add_cfg = get_global_config().get("add", {})
+            video_hash = add_cfg.get("video_hash", "legacy")
+            heic_hash = add_cfg.get("heic_hash", "legacy")
+            photo_hash = add_cfg.get("photo_hash", "legacy")
+
+            # every batch has its own journal, locked while it runs, so a
+            # photo add into the same repository is left alone
+            summary = Summary()
+            walk = False
+            with Journal(repo_path, resume=resume) as journal:
+                if resume:
+                    paths = journal.args['path'] if journal.args is not None else []
+                    walk = journal.args['walk'] if journal.args is not None else False
+                journal.start(paths, walk)
+                ingest(paths, walk, repo_path, jobs=jobs, summary=summary, catalog=catalog, cache=cache,
+                       mode=mode or add_cfg.get("mode", "auto"),
+                       video_hash=None if video_hash == 'legacy' else video_hash, journal=journal,
+                       heic_hash=None if heic_hash == 'legacy' else heic_hash,
+                       photo_hash=None if photo_hash == 'legacy' else photo_hash)
+            counters.count(summary)
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {summary.added_files} of {len(paths)} files added, "
+                  f"{summary.duplicate_files} duplicates, {summary.corrupt_count} corrupt")
+
+        # imports cut short earlier are finished first; those still running
+        # hold their journals and are skipped
+        for journal_path in interrupted(repo_path):
+            try:
+                add(None, resume=journal_path)
+            except IOError as err:
+                print(f"WARNING: cannot resume {journal_path}: {err}")
+
+        server = watch.serve_status(counters, socket_path)
+        stop = threading.Event()
+        print(f"Watching {inbox}; press Ctrl-C to stop")
+        try:
+            watch.watch(inbox, add, stop, settle=settle, batch_size=batch, status=counters,
+                        poll_interval=poll, scan=scan)
+        except KeyboardInterrupt:
+            stop.set()
+        finally:
+            server.shutdown()
+            server.server_close()
+            socket_path.unlink(missing_ok=True)
+
+
+def cli_add(path, walk, jobs=None, use_cache=True, mode=None, video_hash=None, stats=None,
+            stats_file=None, profile=None, use_async=False, concurrency=32, retries=3, resume=False,
+            thumbs=False, heic_hash=None, include=None, exclude=None, photo_hash=None):
     """
     Add photos to the directory repository
 
@@ -160,109 +1061,147 @@ def cli_add(path, walk):
     path : str
         The path of the data to process. Can be a filename, directory, or glob.
 
+    walk : bool
+        Walk the directory structure below path
+
+    Keyword Arguments
+    -----------------
+    jobs : int
+        The number of workers computing checksums and dates. Defaults to the
+        number of cores.
+
+    use_cache : bool
+        Reuse the checksums and dates of source files seen unchanged before
+
+    mode : str
+        How files are placed in the repository: auto, reflink,
+        copy_file_range, hardlink, move or copy. Defaults to the add mode of
+        the configuration file.
+
+    video_hash : str
+        How videos are checksummed: legacy, file or mdat. Defaults to the add
+        video_hash of the configuration file.
+
+    stats : str
+        Report the time, calls and bytes of each stage as 'text', 'json' or
+        'prometheus'
+
+    stats_file : str
+        Write the stats report to this file rather than the screen
+
+    profile : str
+        A stage to profile with cProfile; the hottest calls are printed
+
+    use_async : bool
+        Run the asyncio driver, which keeps many file operations in flight
+        for high latency inboxes
+
+    concurrency : int
+        The number of file operations in flight with use_async
+
+    retries : int
+        The number of retries of transient I/O errors with use_async
+
+    resume : bool
+        Continue the oldest interrupted import journaled in the repository
+        that no running import holds. The paths and walk of that import are
+        used when path is empty.
+
+    thumbs : bool
+        Make thumbnails of the photos added
+
+    heic_hash : str
+        How HEIC photos are checksummed: legacy (the decoded pixels) or coded
+        (the coded image data). Defaults to the add heic_hash of the
+        configuration file.
+
+    include : list
+        Glob patterns the walked files must match, added to the walk include
+        of the configuration file
+
+    exclude : list
+        Glob patterns of walked files and directories to skip, added to the
+        walk exclude of the configuration file
+
+    photo_hash : str
+        How photos are checksummed: legacy (the text of every pixel) or raw
+        (the pixel bytes). Defaults to the add photo_hash of the
+        configuration file.
+
     """
+    from contextlib import nullcontext
     from pathlib import Path
-    import os
-    import shutil
-    from .photo import get_photo_date, compute_photo_checksum
-    from .video import get_video_date, compute_video_checksum
+    from .catalog import Catalog
     from .config import get_global_config
-    from datetime import datetime
-    from zoneinfo import ZoneInfo
-
-    tzla = ZoneInfo("America/Los_Angeles")
-    default_date = datetime(1970, 1, 1, tzinfo=tzla)
+    from .fingerprint import FingerprintCache
+    from .ingest import ingest
+    from .journal import Journal
+    from .stats import Stats, collect
+    from .videohash import throughput
+    from .walker import WalkFilter
 
     cfg = get_global_config()
     repo_path = Path(cfg["repo"]["path"])
+    if mode is None:
+        mode = cfg.get("add", {}).get("mode", "auto")
+    if video_hash is None:
+        video_hash = cfg.get("add", {}).get("video_hash", "legacy")
+    if heic_hash is None:
+        heic_hash = cfg.get("add", {}).get("heic_hash", "legacy")
+    if photo_hash is None:
+        photo_hash = cfg.get("add", {}).get("photo_hash", "legacy")
+    walk_filter = WalkFilter.from_config(cfg, include, exclude)
 
-    # Set up initial statistics
-    added_files = 0
-    duplicate_files = 0
-    skipped_files = 0
-    total_files = 0
-    missing_date = 0
-    corrupt_files = []
-    corrupt_count = 0
-    first_date = datetime.now(tzla)
-    last_date = default_date
-    total_files = 0
-
-    # Process each file
-    if walk:
-        dir_path = Path(path[0])
-        all_files = dir_path.rglob("*")
-    else:
-        all_files = path
-
-    for file in all_files:
-        total_files += 1
-        file_obj = Path(file)
-        if file_obj.is_dir():
-            # Skip directories
-            continue
-            #  path_files = os.listdir(file_obj)
-            #  import pudb; pudb.set_trace()
-
-        if any(part.startswith('.') for part in file_obj.parts):
-            # Skip hidden files (usually thumbnails)
-            continue
+    collector = Stats() if stats is not None or profile is not None else None
+    if profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        collector.attach_profiler(profile, profiler)
 
-        if file_obj.suffix.upper() in [".AVI", ".MOV", ".MP4", ".MPG", ".M4V", ".MOD"]:
-            # Compute the checksum of the file
-            checksum = compute_video_checksum(file_obj)
-            # Get the date the photo was taken
-            date = get_video_date(file_obj)
-        elif file_obj.suffix.upper() in [".JPG", ".JPEG", ".PNG", ".HEIC"]:
-            # Compute the checksum of the file
-            checksum = compute_photo_checksum(file_obj)
-            # Get the date the photo was taken
-            date = get_photo_date(file_obj)
-            if checksum is None:
-                corrupt_count += 1
-                corrupt_files.append(file_obj)
-                print(f"WARNING: {file_obj} is corrupt!")
-                continue
+    with (collect(collector) if collector is not None else nullcontext()), \
+            Catalog(repo_path) as catalog, \
+            (FingerprintCache() if use_cache else nullcontext()) as cache, \
+            Journal(repo_path, resume=resume) as journal:
+        if resume and len(path) == 0:
+            if journal.args is None:
+                raise IOError('The journal does not record what was being imported')
+            path, walk = journal.args['path'], journal.args['walk']
+        journal.start(path, walk)
+        video_hash = None if video_hash == 'legacy' else video_hash
+        heic_hash = None if heic_hash == 'legacy' else heic_hash
+        photo_hash = None if photo_hash == 'legacy' else photo_hash
+        if use_async:
+            import asyncio
+            from .async_ingest import ingest_async, RetryPolicy
+            summary = asyncio.run(ingest_async(path, walk, repo_path, concurrency=concurrency,
+                                               retry=RetryPolicy(attempts=retries + 1), catalog=catalog,
+                                               cache=cache, mode=mode, video_hash=video_hash,
+                                               journal=journal, heic_hash=heic_hash,
+                                               walk_filter=walk_filter, jobs=jobs, photo_hash=photo_hash))
         else:
-            # File not recoginized as an image. Skip it.
-            print(f"{file_obj} not recognized as an image file. Skipping.")
-            skipped_files += 1
-            continue
-
-        if date is None:
-            date = default_date
-            missing_date += 1
-
-        # Check for earliest or latest date
-        if date < first_date and date != default_date:
-            first_date = date
-        if date > last_date:
-            last_date = date
+            summary = ingest(path, walk, repo_path, jobs=jobs, catalog=catalog, cache=cache, mode=mode,
+                             video_hash=video_hash, journal=journal, heic_hash=heic_hash,
+                             walk_filter=walk_filter, photo_hash=photo_hash)
+    summary.report()
 
-        # Create new filename
-        canonical_file = Path(f"{date.strftime("%y%m%d_%H%M%S")}_{checksum[:8]}{file_obj.suffix}")
-        canonical_folder = Path(f"{date.year}/{date.month:02}")
+    if thumbs:
+        from .thumbs import build_thumbnails, THUMB_SIZE
+        size = cfg.get("thumbs", {}).get("size", THUMB_SIZE)
+        made, cached, failures = build_thumbnails(summary.added, repo_path, size, jobs)
+        print(f"{made} thumbnails made, {len(failures)} failed")
 
-        # Rename file to the new filename
-        insert_path = repo_path / canonical_folder / canonical_file
+    nbytes, rate = throughput()
+    if nbytes > 0:
+        print(f"{nbytes / 1e6:.1f} MB of video hashed at {rate:.1f} MB/s")
 
-        if not insert_path.exists():
-            os.makedirs(repo_path / canonical_folder, exist_ok=True)
-            shutil.copy2(file_obj, insert_path)
-            print(f"Added {canonical_file} (from {file_obj}) to the photo repository")
-            added_files += 1
+    if stats is not None:
+        report = collector.export(stats)
+        if stats_file is None:
+            print(report)
         else:
-            print(f"File {canonical_file} (from {file_obj}) already exists in the repository")
-            duplicate_files += 1
-
-    print("")
-    print("Summary")
-    print("=======")
-    print(f"Processed {total_files} files from {first_date} to {last_date}")
-    print(f"{added_files} files added to the photo repository")
-    print(f"{duplicate_files} files skipped as duplicates")
-    print(f"{skipped_files} files skipped as unrecognized format")
-    print(f"{missing_date} files did not have date metadata")
-    print(f"{corrupt_count} files were corrupt: {corrupt_files}")
-    process_sum = added_files + duplicate_files + skipped_files + corrupt_count
-    print(f"{total_files - process_sum} files unaccounted")
+            with open(stats_file, 'w') as fid:
+                fid.write(report)
+    if profile is not None:
+        import pstats
+        print(f"\nProfile of the {profile} stage")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
@@ -1,7 +1,28 @@
 """
 Global configuration interface
+
+The settings are compiled from layers, each overriding the ones before:
+
+1. the defaults of cfgmap,
+2. the global photorc,
+3. the .photorc at the root of the repository, for settings that differ from
+   one repository to another, and
+4. PHOTO_<SECTION>_<NAME> environment variables, e.g. PHOTO_ADD_MODE=copy.
+
+Reading the settings never writes a file. Without a photorc the defaults
+apply, and `photo config init` writes one, with every setting documented.
+The original flat preferences format, as in the sample config/preferences.yaml
+of the source tree, is still understood in either file; the sample itself is
+not loaded.
+
+Every setting is checked against the type of its default and, where there is
+one, its list of choices. The result is compiled once per process and shared,
+so hot code may read it freely; refresh_config() compiles it again when a
+layer has changed, for long running processes such as photo watch.
 """
 
+from .choices import MODES, VIDEO_SCHEMES, PHOTO_SCHEMES, HEIC_SCHEMES, TAG_BACKENDS, SIMILAR_SCHEMES
+
 # the canonical contents of the {photorc} configuration file
 # it is a map of variable names to their default values and documentation
 cfgmap = {
@@ -14,21 +35,130 @@ cfgmap = {
             "# The file location of transaction resister information",
         ],
     },
+    # Settings for adding files to the repository
+    "add": {
+        # How files are placed: auto, reflink, copy_file_range, hardlink, move or copy
+        "mode": "auto",
+        # How videos are checksummed: legacy (the same as file), file or mdat
+        "video_hash": "legacy",
+        # How photos are checksummed: legacy or raw
+        "photo_hash": "legacy",
+        # How HEIC photos are checksummed: legacy or coded
+        "heic_hash": "legacy",
+        # the documentation
+        "doc": [
+            "# How photo add places files in the repository:",
+            "# auto, reflink, copy_file_range, hardlink, move or copy",
+            "# How photo add checksums videos: legacy or file (the whole file) or",
+            "# mdat (the media payload only)",
+            "# How photo add checksums photos: legacy (the text of every pixel) or",
+            "# raw (the pixel bytes, much faster, but a different checksum)",
+            "# How photo add checksums HEIC photos: legacy (decoded pixels) or",
+            "# coded (the coded image data, without decoding)",
+        ],
+    },
+    # Settings for walking an inbox
+    "walk": {
+        # Glob patterns the files added must match; all files when empty
+        "include": [],
+        # Glob patterns of files and directories to skip
+        "exclude": [],
+        # The extensions of the files added; all files when empty
+        "extensions": [],
+        # the documentation
+        "doc": [
+            "# Which files photo add --walk visits. Patterns match the path below",
+            "# the inbox or the name, e.g. [\"DCIM/*\"] or [\"*.tmp\", \"Trash\"];",
+            "# excluded directories are not entered. Hidden files and",
+            "# directories are always skipped",
+        ],
+    },
+    # Settings for the thumbnail cache
+    "thumbs": {
+        # The longest side of a thumbnail in pixels
+        "size": 256,
+        # the documentation
+        "doc": [
+            "# The longest side of the thumbnails cached in the repository, in pixels",
+        ],
+    },
+    # Settings for storing tags
+    "tags": {
+        # Where tags are written: embedded, sidecar or catalog
+        "backend": "embedded",
+        # the documentation
+        "doc": [
+            "# Where photo tag stores tags: embedded (rewrites the file), sidecar",
+            "# (an XMP file alongside) or catalog (repository files only). Use",
+            "# photo tags sync to write sidecar or catalog tags into the files",
+        ],
+    },
+    # Settings for verifying the repository
+    "verify": {
+        # Files verified within this many days are skipped
+        "window_days": 30.0,
+        # The most megabytes read per second, or 0 for no limit
+        "rate": 0.0,
+        # the documentation
+        "doc": [
+            "# How photo verify scrubs the repository: files verified within",
+            "# window_days are skipped, and reads are held under rate MB/s (0",
+            "# for no limit)",
+        ],
+    },
+    # Settings for finding near duplicates
+    "similar": {
+        # The perceptual hash: dhash or phash
+        "scheme": "dhash",
+        # The largest number of differing bits between similar photos
+        "distance": 6,
+        # the documentation
+        "doc": [
+            "# How photo similar compares photos: the perceptual hash (dhash or",
+            "# phash) and the largest number of its 64 bits that may differ",
+        ],
+    },
+    # Settings for the watch-folder daemon
+    "watch": {
+        # The seconds a file must stop changing before it is added
+        "settle": 2.0,
+        # The most files added in one batch
+        "batch": 100,
+        # the documentation
+        "doc": [
+            "# How photo watch adds files landing in its inbox: once they have",
+            "# not changed for settle seconds, in batches of at most batch files",
+        ],
+    },
 }
 
+# the allowed values of the settings that are a choice
+choices = {
+    ("add", "mode"): MODES,
+    ("add", "video_hash"): ["legacy"] + VIDEO_SCHEMES,
+    ("add", "photo_hash"): PHOTO_SCHEMES,
+    ("add", "heic_hash"): HEIC_SCHEMES,
+    ("tags", "backend"): TAG_BACKENDS,
+    ("similar", "scheme"): SIMILAR_SCHEMES,
+}
 
-def locate_global_config():
-    """
-    Locate the global configuration file
+# settings of the original flat preferences file, and where they live now
+legacy_keys = {
+    "repo_dir": ("repo", "path"),
+    # files are always named by date and checksum
+    "name_format": None,
+}
 
-    Checks the following locations, in order:
-      - $XDG_CONFIG_HOME//photo/photorc
-      - ~/.config/photo/photorc
+# the name of the per-repository settings file in the repository root
+REPO_CONFIG_NAME = ".photorc"
 
-    Returns
-    -------
-      str | None
-        the location of the configuration file
+# the prefix of the environment variables overriding settings
+ENV_PREFIX = "PHOTO_"
+
+
+def _global_path():
+    """
+    The path of the global configuration file, whether or not it exists
     """
     # support
     import os
@@ -47,11 +177,33 @@ def locate_global_config():
         cfg_dir = os.path.join(home_dir, ".config")
 
     # form the full path to the configuration file
-    rc_file = os.path.join(cfg_dir, "photo", "photorc")
+    return os.path.join(cfg_dir, "photo", "photorc")
+
+
+def locate_global_config():
+    """
+    Locate the global configuration file
+
+    Checks the following locations, in order:
+      - $XDG_CONFIG_HOME//photo/photorc
+      - ~/.config/photo/photorc
+
+    Returns
+    -------
+      str | None
+        the location of the configuration file
+    """
+    # support
+    import os
+    import sys
+
+    # form the full path to the configuration file
+    rc_file = _global_path()
     # if it doesn't exist
-    if not os.path.exists(rc_file):
+    if rc_file is None or not os.path.exists(rc_file):
         # complain
-        print("WARNING: Global config file photorc does not exist!")
+        print("WARNING: Global config file photorc does not exist! Run photo config init to create it",
+              file=sys.stderr)
         # and bail
         return
 
@@ -62,23 +214,25 @@ def locate_global_config():
 def generate_global_config():
     """
     Create the global configuration file
+
+    Settings missing from an existing file are appended with their defaults.
+    Only photo config init calls this; reading the settings never writes.
+
+    Returns
+    -------
+    str
+        The location of the configuration file
     """
     # externals
     import os
     import yaml
 
-    # look up the standard directory with user configurations; we prefer the XDG compliant way
-    cfgdir = os.getenv("XDG_CONFIG_HOME")
-    # and fall back to
-    if cfgdir is None:
-        # something u*ix friendly; windows support?
-        cfgdir = os.path.expanduser(os.path.join("~", ".config"))
-    # build the path to the photo configuration directory
-    cfgdir = os.path.join(cfgdir, "photo")
-    # enforce its existence
-    os.makedirs(cfgdir, exist_ok=True)
-    # and form the path to the configuration file
-    rcfile = os.path.join(cfgdir, "photorc")
+    # the same location the settings are read from
+    rcfile = _global_path()
+    if rcfile is None:
+        raise IOError("Cannot locate the home directory for the configuration file")
+    # enforce the existence of its directory
+    os.makedirs(os.path.dirname(rcfile), exist_ok=True)
 
     # initialize the pile of configuration settings
     new = set(cfgmap)
@@ -87,24 +241,239 @@ def generate_global_config():
         # open it
         with open(rcfile, mode="r") as stream:
             # parse it; make sure we get an actual dictionary even if the file is empty
-            usercfg = yaml.load(stream, yaml.Loader) or {}
+            usercfg = yaml.load(stream, _loader()) or {}
             # and remove any existing settings from my to-do pile
             new -= set(usercfg)
+            # including the sections given by the keys of the original flat file
+            new -= {legacy_keys[key][0] for key in usercfg if legacy_keys.get(key) is not None}
+
+    # if there is nothing to add, leave the file alone
+    if not new:
+        return rcfile
 
     # update the file
     with open(rcfile, mode="a") as stream:
         # go through the new settings
-        for key in new:
+        for key in sorted(new, key=list(cfgmap).index):
             # write the documentation
             print("", file=stream)
-            print("\n".join(cfgmap[key].pop("doc", "\n")), file=stream)
+            print("\n".join(cfgmap[key].get("doc", [])), file=stream)
             # make the assignment
             print(f"{key}:", file=stream)
             for subkey in cfgmap[key]:
-                print(f"    {subkey}: {cfgmap[key][subkey]}", file=stream)
+                if subkey != "doc":
+                    print(f"    {subkey}: {cfgmap[key][subkey]}", file=stream)
+
+    # the cached settings are out of date
+    _cache.pop(rcfile, None)
 
     # all done
-    return
+    return rcfile
+
+
+# the compiled configuration and the state of its layers, by global file
+_cache = {}
+
+
+def _loader():
+    """
+    The fastest safe YAML loader available
+    """
+    import yaml
+
+    # the C loader needs libyaml, which is not always present
+    return getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def _state(path):
+    """
+    The modification time and size of a layer, or None if it does not exist
+    """
+    import os
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _environment():
+    """
+    The environment variables that may override settings
+    """
+    import os
+
+    return tuple(sorted((name, value) for name, value in os.environ.items() if name.startswith(ENV_PREFIX)))
+
+
+def _read_layer(path):
+    """
+    Parse a configuration file
+
+    Returns
+    -------
+    dict
+        The settings of the file, empty if it is empty
+
+    """
+    import yaml
+
+    with open(path, "r") as fid:
+        try:
+            layer = yaml.load(fid, Loader=_loader()) or {}
+        except yaml.YAMLError as err:
+            raise ValueError(f"{path} is not valid YAML: {err}")
+    if not isinstance(layer, dict):
+        raise ValueError(f"{path} must map sections to settings")
+    return layer
+
+
+def _environment_layer(environment):
+    """
+    The settings given by PHOTO_<SECTION>_<NAME> environment variables
+
+    Values are parsed as YAML, so numbers and lists can be given, except
+    for settings that are strings.
+    """
+    import sys
+    import yaml
+
+    layer = {}
+    for name, value in environment:
+        for section in cfgmap:
+            prefix = f"{ENV_PREFIX}{section.upper()}_"
+            if not name.startswith(prefix):
+                continue
+            key = name[len(prefix):].lower()
+            if key not in cfgmap[section] or key == "doc":
+                print(f"WARNING: {name} is not a setting", file=sys.stderr)
+                break
+            if not isinstance(cfgmap[section][key], str):
+                try:
+                    value = yaml.load(value, Loader=_loader())
+                except yaml.YAMLError:
+                    pass
+            layer.setdefault(section, {})[key] = value
+            break
+    return layer
+
+
+def _check(source, section, key, value):
+    """
+    Check a setting against the type of its default and its choices
+    """
+    default = cfgmap[section][key]
+    if isinstance(default, list):
+        valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+        kind = "a list of strings"
+    elif isinstance(default, float):
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+        kind = "a number, at least 0"
+    elif isinstance(default, int):
+        valid = isinstance(value, int) and not isinstance(value, bool) and value >= 0
+        kind = "a whole number, at least 0"
+    else:
+        valid = isinstance(value, str)
+        kind = "a string"
+    if not valid:
+        raise ValueError(f"{source}: {section}.{key} must be {kind}, not {value!r}")
+
+    allowed = choices.get((section, key))
+    if allowed is not None and value not in allowed:
+        raise ValueError(f"{source}: {section}.{key} must be one of {', '.join(allowed)}, not {value!r}")
+
+
+def _merge(settings, layer, source, sections=None):
+    """
+    Check the settings of a layer and apply them over the others
+
+    Arguments
+    ---------
+    settings : dict
+        The settings so far, updated in place
+
+    layer : dict
+        The settings of the layer
+
+    source : str
+        The name of the layer, for the messages
+
+    Keyword Arguments
+    -----------------
+    sections : list
+        The sections the layer may set. Defaults to all of them.
+
+    """
+    import sys
+
+    for section, values in layer.items():
+        # the original preferences were flat
+        if section in legacy_keys and not isinstance(values, dict):
+            if legacy_keys[section] is None:
+                print(f"WARNING: {source}: {section} is no longer used", file=sys.stderr)
+                continue
+            section, key = legacy_keys[section]
+            values = {key: values}
+
+        if section not in cfgmap:
+            print(f"WARNING: {source}: unknown section {section}", file=sys.stderr)
+            settings[section] = values
+            continue
+        if sections is not None and section not in sections:
+            print(f"WARNING: {source}: the {section} settings cannot be set here", file=sys.stderr)
+            continue
+        if not isinstance(values, dict):
+            raise ValueError(f"{source}: {section} must map names to settings")
+
+        for key, value in values.items():
+            if key not in cfgmap[section] or key == "doc":
+                print(f"WARNING: {source}: unknown setting {section}.{key}", file=sys.stderr)
+            elif value is None:
+                # an empty setting keeps the value below it
+                continue
+            else:
+                _check(source, section, key, value)
+            settings[section][key] = value
+
+
+def _compile(rc_file, environment):
+    """
+    Compile the settings of every layer
+
+    Returns
+    -------
+    tuple
+        The settings, and the layers with their states
+
+    """
+    import copy
+    import os
+
+    # start from the defaults
+    settings = {section: {key: copy.copy(value) for key, value in values.items() if key != "doc"}
+                for section, values in cfgmap.items()}
+    env_layer = _environment_layer(environment)
+
+    # then the global file, if there is one
+    layers = [(rc_file, _state(rc_file))] if rc_file is not None else []
+    if layers and layers[0][1] is not None:
+        _merge(settings, _read_layer(rc_file), rc_file)
+
+    # then the repository file; the environment may point at another repository
+    repo_path = env_layer.get("repo", {}).get("path", settings["repo"]["path"])
+    repo_file = os.path.join(os.path.expanduser(str(repo_path)), REPO_CONFIG_NAME)
+    layers.append((repo_file, _state(repo_file)))
+    if layers[-1][1] is not None:
+        _merge(settings, _read_layer(repo_file), repo_file,
+               sections=[section for section in cfgmap if section != "repo"])
+
+    # and the environment last
+    _merge(settings, env_layer, "the environment")
+
+    # the one place the root is normalized; everything after uses it as is
+    settings["repo"]["path"] = os.path.abspath(os.path.expanduser(settings["repo"]["path"]))
+    return settings, layers
 
 
 def get_global_config():
@@ -117,25 +486,54 @@ def get_global_config():
 
     2. $HOME/.config/photo/photorc
 
+    The file is never written here; without it the defaults apply, with a
+    warning, until photo config init creates it. The settings are compiled
+    once per process, with those of the repository .photorc and the
+    environment over them, and read from memory afterwards; the dictionary
+    returned is shared and must not be modified.
+
     Returns
     -------
-    dict | None
-        A dictionary of values from the rc file
+    dict
+        A dictionary of settings, by section
 
     """
-    # support
-    import yaml
+    # the compiled settings need no disk access at all
+    rc_path = _global_path()
+    entry = _cache.get(rc_path)
+    if entry is not None:
+        return entry[0]
 
-    # attempt to locate the global configuration file
-    rc_file = locate_global_config()
-    # if it could not be found
-    if not rc_file:
-        # bail
-        return
+    # warns when there is no file; refresh_config notices one created later
+    locate_global_config()
+
+    environment = _environment()
+    settings, layers = _compile(rc_path, environment)
+    _cache[rc_path] = (settings, layers, environment)
+
+    return settings
+
+
+def refresh_config():
+    """
+    Drop the compiled settings if any layer changed since they were compiled
+
+    Compares the modification time and size of every layer, so it is cheap
+    enough to call between units of work in long running processes.
+
+    Returns
+    -------
+    bool
+        True if the settings will be compiled again on the next read
+
+    """
+    entry = _cache.get(_global_path())
+    if entry is None:
+        return False
 
-    # otherwise, try to open it
-    with open(rc_file, "r") as fid:
-        # and parse the contents
-        result_dict = yaml.load(fid, Loader=yaml.Loader)
+    _, layers, environment = entry
+    if environment == _environment() and all(_state(path) == state for path, state in layers):
+        return False
 
-    return result_dict
+    del _cache[_global_path()]
+    return True
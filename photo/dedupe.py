@@ -0,0 +1,238 @@
+"""
+Tiered duplicate detection
+
+Finding byte identical files does not need every file to be read in full.
+Files are first grouped by size, which costs a stat; only files sharing a size
+have their first and last PARTIAL_BYTES hashed; only files sharing that
+partial hash are hashed in full. Since almost every photo and video has a size
+of its own, most files are never read at all.
+
+Pixel identical files whose metadata differ have different sizes, so those are
+found through the content checksums recorded in the catalog instead.
+"""
+
+# the number of bytes hashed at each end of a file for the partial hash
+PARTIAL_BYTES = 64 * 1024
+
+# the read size used when hashing whole files
+CHUNK_BYTES = 1024 * 1024
+
+
+def partial_hash(path):
+    """
+    Hash the size and the first and last PARTIAL_BYTES of a file
+
+    Arguments
+    ---------
+    path : str
+        The file to hash
+
+    Returns
+    -------
+    str
+        The hex digest
+
+    """
+    import hashlib
+    import os
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fid:
+        size = os.fstat(fid.fileno()).st_size
+        digest.update(str(size).encode('utf-8'))
+        digest.update(fid.read(PARTIAL_BYTES))
+        if size > PARTIAL_BYTES:
+            fid.seek(max(PARTIAL_BYTES, size - PARTIAL_BYTES))
+            digest.update(fid.read(PARTIAL_BYTES))
+
+    return digest.hexdigest()
+
+
+def file_hash(path):
+    """
+    Hash the full contents of a file
+
+    Arguments
+    ---------
+    path : str
+        The file to hash
+
+    Returns
+    -------
+    str
+        The hex digest
+
+    """
+    import hashlib
+
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(CHUNK_BYTES), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _refine(groups, key):
+    """
+    Split each group by a key, dropping the groups left with a single file
+    """
+    result = []
+    for group in groups:
+        split = {}
+        for path in group:
+            split.setdefault(key(path), []).append(path)
+        result += [paths for paths in split.values() if len(paths) > 1]
+    return result
+
+
+def find_duplicates(paths):
+    """
+    Find the byte identical files among paths
+
+    Arguments
+    ---------
+    paths : iterable
+        The files to compare
+
+    Returns
+    -------
+    list
+        A sorted list of paths for each set of identical files
+
+    """
+    import os
+
+    by_size = {}
+    for path in paths:
+        by_size.setdefault(os.stat(path).st_size, []).append(path)
+
+    groups = [group for group in by_size.values() if len(group) > 1]
+    groups = _refine(groups, partial_hash)
+    groups = _refine(groups, file_hash)
+
+    return sorted(sorted(group) for group in groups)
+
+
+def match_existing(file_obj, stat, catalog):
+    """
+    Find a repository file byte identical to file_obj
+
+    Only repository files of the same size are considered, and they are only
+    read in full when their partial hashes match.
+
+    Arguments
+    ---------
+    file_obj : Path
+        The candidate file
+
+    stat : os.stat_result
+        The stat of the candidate
+
+    catalog : Catalog
+        The catalog of the repository
+
+    Returns
+    -------
+    dict | None
+        The catalog record of the identical file, or None
+
+    """
+    records = catalog.with_size(stat.st_size)
+    if len(records) == 0:
+        return None
+
+    candidate_partial = partial_hash(file_obj)
+    candidate_full = None
+    for record in records:
+        try:
+            if partial_hash(record['path']) != candidate_partial:
+                continue
+            if candidate_full is None:
+                candidate_full = file_hash(file_obj)
+            if file_hash(record['path']) == candidate_full:
+                return record
+        except FileNotFoundError:
+            # the catalog is ahead of the repository
+            continue
+
+    return None
+
+
+def repository_duplicates(repo_path, catalog=None):
+    """
+    Find the duplicates already in a repository
+
+    Arguments
+    ---------
+    repo_path : Path
+        The root of the photo repository
+
+    Keyword Arguments
+    -----------------
+    catalog : Catalog
+        The catalog of the repository, used to find pixel identical files
+
+    Returns
+    -------
+    tuple
+        The groups of byte identical files, and the groups of files with the
+        same content checksum that are not byte identical (for example the
+        same photo with different tags)
+
+    """
+    import os
+    from pathlib import Path
+    from .tagstore import SIDECAR_EXT
+    from .walker import scan_tree
+
+    # sidecars with the same tags are identical but belong to different files
+    paths = [Path(entry.path) for entry in scan_tree(repo_path)
+             if os.path.splitext(entry.name)[1].lower() != SIDECAR_EXT]
+    identical = find_duplicates(paths)
+
+    similar = []
+    if catalog is not None:
+        covered = {path for group in identical for path in group}
+        for group in catalog.duplicates():
+            remaining = [path for path in group if path not in covered]
+            # a group entirely made of identical files is already reported
+            if len(remaining) > 0 and len(group) > 1:
+                similar.append(group)
+
+    return identical, similar
+
+
+def reclaim(groups, catalog=None):
+    """
+    Delete all but the first file of each group, with their tag sidecars
+
+    Arguments
+    ---------
+    groups : list
+        Groups of byte identical files, as returned by find_duplicates
+
+    Keyword Arguments
+    -----------------
+    catalog : Catalog
+        The catalog to remove the deleted files from
+
+    Returns
+    -------
+    int
+        The number of bytes freed
+
+    """
+    import os
+    from .tagstore import remove_sidecar
+
+    freed = 0
+    for group in groups:
+        for path in group[1:]:
+            freed += os.stat(path).st_size
+            os.unlink(path)
+            remove_sidecar(path)
+            if catalog is not None:
+                catalog.remove(path)
+
+    return freed
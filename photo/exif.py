@@ -1,3 +1,19 @@
+# the approximate number of bytes of pixel data hashed at a time
+STRIP_BYTES = 8 * 1024 * 1024
+
+# the number of files handed to a single exiftool command by batch operations
+BATCH_SIZE = 250
+
+# the fields shown by photo meta by default, those of exiftool -common and
+# the tags
+COMMON_FIELDS = ['FileName', 'FileSize', 'Model', 'DateTimeOriginal', 'ImageSize', 'Quality',
+                 'FocalLength', 'ShutterSpeed', 'Aperture', 'ISO', 'WhiteBalance', 'Flash',
+                 'ImageDescription']
+
+# the fields photo.reader can provide without exiftool
+NATIVE_FIELDS = ['DateTimeOriginal', 'CreateDate', 'Model', 'ImageDescription']
+
+
 def list_metadata(filename):
     """
     Print the relevant metadata to screen
@@ -14,8 +30,8 @@ def list_metadata(filename):
         unsuccessful.
 
     """
-    import subprocess
     from os.path import exists
+    from .exiftool import execute
 
     if not exists(filename):
         raise IOError('Requested file does not exist')
@@ -23,13 +39,80 @@ def list_metadata(filename):
     valid_ext = ['jpg', 'png', 'gif', 'mov', 'mpg', 'avi']
     file_ext = filename.split('.')[-1]
     if file_ext.lower() in valid_ext:
-        subprocess.run(['exiftool', '-common', '-imagedescription', filename])
+        stdout = execute('-common', '-imagedescription', filename)
+        print(stdout.decode('utf-8'), end='')
         print('')
         return 0
     else:
         return -1
 
 
+def read_metadata(filenames, fields=None):
+    """
+    Read the metadata of many files at once
+
+    When every requested field is one photo.reader understands, photos are
+    read in process. Everything else goes through one exiftool -json command
+    per batch of files, with the batches spread over the exiftool pool.
+
+    Arguments
+    ---------
+    filenames : list
+        The filenames of the photos and videos to read
+
+    Keyword Arguments
+    -----------------
+    fields : list
+        The exiftool tag names to read, or None for every tag
+
+    Returns
+    -------
+    list
+        One dictionary of field values per file, in the order of filenames,
+        each with the filename as 'SourceFile'. Fields a file lacks are left
+        out, as are files exiftool could not read.
+
+    """
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from .exiftool import execute, get_pool
+    from .reader import read_fields
+
+    filenames = [str(filename) for filename in filenames]
+
+    # Read what we can in process and leave the rest to exiftool
+    result = {}
+    remaining = filenames
+    if fields is not None and set(fields) <= set(NATIVE_FIELDS):
+        remaining = []
+        for filename in filenames:
+            try:
+                native = read_fields(filename)
+            except OSError:
+                native = None
+            # QuickTime dates are stored in UTC, unlike what exiftool reports
+            if native is not None and native['format'] != 'quicktime':
+                record = {'SourceFile': filename}
+                record.update((field, native[field]) for field in fields if native.get(field) is not None)
+                result[filename] = record
+            else:
+                remaining.append(filename)
+
+    tag_args = ['-' + field for field in fields] if fields is not None else []
+    batches = [remaining[idx:idx + BATCH_SIZE] for idx in range(0, len(remaining), BATCH_SIZE)]
+
+    def read_batch(batch):
+        stdout = execute('-json', *tag_args, *batch)
+        return json.loads(stdout.decode('utf-8')) if stdout.strip() else []
+
+    with ThreadPoolExecutor(max_workers=get_pool().size) as executor:
+        for records in executor.map(read_batch, batches):
+            for record in records:
+                result[record['SourceFile']] = record
+
+    return [result[filename] for filename in filenames if filename in result]
+
+
 def get_metadata(filename, tag):
     """
     Retrieve a specified metadata tag
@@ -48,25 +131,25 @@ def get_metadata(filename, tag):
         The content of the EXIF metadata
 
     """
-    import subprocess
     import re
     from os.path import exists
+    from .exiftool import execute
 
     if not exists(filename):
         raise IOError('Requested file does not exist')
 
-    stdout = subprocess.check_output(['exiftool', filename, '-{0}'.format(tag)])
+    stdout = execute(filename, '-{0}'.format(tag))
     if stdout == bytes():
         result = None
     else:
-        raw_str = result.decode('utf-8')
+        raw_str = stdout.decode('utf-8')
         values = re.search('(?<=: ).*(?=\n)$', raw_str)
         result = values.group(0)
 
     return result
 
 
-def get_tags(filename):
+def get_tags(filename, backend=None):
     """
     Get the tags stored by the photo tool
 
@@ -77,15 +160,31 @@ def get_tags(filename):
     filename : str
         The filename of the photo to retrieve data from
 
+    Keyword Arguments
+    -----------------
+    backend : str
+        Where tags are kept: embedded, sidecar or catalog. Defaults to the
+        tags backend of the configuration file.
+
     """
-    import subprocess
     import re
     from os.path import exists
+    from .exiftool import execute
+    from .reader import read_fields
+    from .tagstore import resolve_backend, read_tags as read_held
 
     if not exists(filename):
         raise IOError('Requested file does not exist')
 
-    result = subprocess.check_output(['exiftool', filename, '-imagedescription'])
+    if resolve_backend(backend) != 'embedded':
+        return read_held([filename], backend)[str(filename)]
+
+    # QuickTime files keep the description in XMP, which the reader skips
+    fields = read_fields(filename)
+    if fields is not None and fields['format'] != 'quicktime':
+        return split_tags(fields['ImageDescription'] or '')
+
+    result = execute(filename, '-imagedescription')
     if result != bytes():
         # Current tags exist
         raw_str = result.decode('utf-8')
@@ -100,7 +199,7 @@ def get_tags(filename):
     return cur_tags
 
 
-def update_tags(filename, tag_list):
+def update_tags(filename, tag_list, backend=None):
     """
     Add a tag to a photo via EXIF data
 
@@ -114,13 +213,25 @@ def update_tags(filename, tag_list):
     tag_list : list
         A list of strings for the photo tags
 
+    Keyword Arguments
+    -----------------
+    backend : str
+        Where tags are kept: embedded, sidecar or catalog. Defaults to the
+        tags backend of the configuration file.
+
     """
-    import subprocess
     from os.path import exists
+    from .catalog import sync_tags
+    from .exiftool import execute
+    from .tagstore import resolve_backend, write_tags as write_held
 
     if not exists(filename):
         raise IOError('Requested file does not exist')
 
+    if resolve_backend(backend) != 'embedded':
+        write_held({filename: tag_list}, backend)
+        return
+
     # Make sure no comma characters are present in tags
     for idx in range(len(tag_list)):
         tag_list[idx] = tag_list[idx].replace(',', '.')
@@ -128,13 +239,155 @@ def update_tags(filename, tag_list):
     # Convert tag_list to string
     tag_str = ','.join(tag_list)
     # Write out new tags
-    subprocess.run(['exiftool', 
-                    filename, 
-                    '-overwrite_original',
-                    '-imagedescription={0}'.format(tag_str)])
+    execute(filename,
+            '-overwrite_original',
+            '-imagedescription={0}'.format(tag_str))
+    # Keep the tag index of the repository in step
+    sync_tags(filename, tag_list)
 
 
-def search_tags(filename, tag_name):
+def read_tags(filenames, backend=None):
+    """
+    Get the tags of many files at once
+
+    The ImageDescription fields are read in process where the format allows,
+    and otherwise with one exiftool command per batch of files, with the
+    batches spread over the exiftool pool.
+
+    Arguments
+    ---------
+    filenames : list
+        The filenames of the photos to retrieve data from
+
+    Keyword Arguments
+    -----------------
+    backend : str
+        Where tags are kept: embedded, sidecar or catalog. Defaults to the
+        tags backend of the configuration file.
+
+    Returns
+    -------
+    dict
+        The list of tags of each file, keyed by the filename as given. Files
+        exiftool could not read are left out.
+
+    """
+    import csv
+    import io
+    from concurrent.futures import ThreadPoolExecutor
+    from .exiftool import execute, get_pool
+    from .reader import read_fields
+    from .tagstore import resolve_backend, read_tags as read_held
+
+    if resolve_backend(backend) != 'embedded':
+        return read_held(filenames, backend)
+
+    filenames = [str(filename) for filename in filenames]
+
+    # Read what we can in process and leave the rest to exiftool
+    result = {}
+    remaining = []
+    for filename in filenames:
+        try:
+            fields = read_fields(filename)
+        except OSError:
+            continue
+        if fields is not None and fields['format'] != 'quicktime':
+            result[filename] = split_tags(fields['ImageDescription'] or '')
+        else:
+            remaining.append(filename)
+
+    batches = [remaining[idx:idx + BATCH_SIZE] for idx in range(0, len(remaining), BATCH_SIZE)]
+
+    def read_batch(batch):
+        # csv output keeps every value as text, unlike -j which turns
+        # numeric looking descriptions into numbers
+        stdout = execute('-csv', '-imagedescription', *batch)
+        rows = csv.DictReader(io.StringIO(stdout.decode('utf-8')))
+        return {row['SourceFile']: split_tags(row.get('ImageDescription') or '') for row in rows}
+
+    with ThreadPoolExecutor(max_workers=get_pool().size) as executor:
+        for tags in executor.map(read_batch, batches):
+            result.update(tags)
+
+    return result
+
+
+def write_tags(tag_map, backend=None):
+    """
+    Set the tags of many files at once
+
+    Files receiving the same tags are written by a single exiftool command,
+    and the result is checked by reading the tags back in bulk. A file whose
+    name or tags hold a line break cannot be passed to exiftool; it fails
+    alone, without holding up the others.
+
+    Arguments
+    ---------
+    tag_map : dict
+        The list of tags to store in each file
+
+    Keyword Arguments
+    -----------------
+    backend : str
+        Where tags are kept: embedded, sidecar or catalog. Defaults to the
+        tags backend of the configuration file.
+
+    Returns
+    -------
+    dict
+        True for each file whose tags were written, False otherwise
+
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from .catalog import sync_tag_map
+    from .exiftool import execute, get_pool
+    from .tagstore import resolve_backend, write_tags as write_held
+
+    if resolve_backend(backend) != 'embedded':
+        return write_held(tag_map, backend)
+
+    # Make sure no comma characters are present in tags
+    tag_map = {str(filename): [tag.replace(',', '.') for tag in tags]
+               for filename, tags in tag_map.items()}
+
+    # exiftool takes its arguments one per line
+    valid = {filename: tags for filename, tags in tag_map.items()
+             if not any('\n' in text for text in [filename] + tags)}
+
+    groups = {}
+    for filename, tags in valid.items():
+        groups.setdefault(','.join(tags), []).append(filename)
+
+    commands = []
+    for tag_str, filenames in groups.items():
+        for idx in range(0, len(filenames), BATCH_SIZE):
+            commands.append(['-overwrite_original',
+                             '-imagedescription={0}'.format(tag_str)] + filenames[idx:idx + BATCH_SIZE])
+
+    if commands:
+        with ThreadPoolExecutor(max_workers=get_pool().size) as executor:
+            list(executor.map(lambda command: execute(*command), commands))
+
+    written = read_tags(list(valid), backend='embedded')
+    result = {filename: filename in valid and written.get(filename) == tags for filename, tags in tag_map.items()}
+
+    # Keep the tag index of the repository in step
+    sync_tag_map({filename: tag_map[filename] for filename, success in result.items() if success})
+
+    return result
+
+
+def split_tags(description):
+    """
+    Split the contents of the ImageDescription field into tags
+    """
+    if description == '':
+        return []
+    return description.split(',')
+
+
+def search_tags(filename, tag_name, backend=None):
     """
     Search for a tag within a file
 
@@ -148,19 +401,63 @@ def search_tags(filename, tag_name):
     tag_name : str
         The tag name to search for
 
+    Keyword Arguments
+    -----------------
+    backend : str
+        Where tags are kept: embedded, sidecar or catalog. Defaults to the
+        tags backend of the configuration file.
+
     Returns
     -------
     bool
         The result of the search. True if the tag is present.
 
     """
-    tags = get_tags(filename)
+    tags = get_tags(filename, backend)
     if tag_name in tags:
         return True
     else:
         return False
 
 
+def get_date(filename):
+    """
+    Get the date a photo or video was taken, with exiftool
+
+    This is the fallback of `photo.reader.read_date` for the formats it
+    does not parse itself.
+
+    Arguments
+    ---------
+    filename : str
+        The photo or video to read
+
+    Returns
+    -------
+    datetime | None
+        The DateTimeOriginal, or CreateDate if that is missing, in the
+        America/Los_Angeles timezone. None if the file has no date.
+
+    """
+    import json
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+    from .exiftool import execute
+
+    stdout = execute('-json', '-DateTimeOriginal', '-CreateDate', str(filename))
+    records = json.loads(stdout.decode('utf-8')) if stdout.strip() else []
+    if len(records) == 0:
+        return None
+
+    value = records[0].get('DateTimeOriginal') or records[0].get('CreateDate')
+    try:
+        date = datetime.strptime(str(value)[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        # missing, zeroed or garbled dates
+        return None
+    return date.replace(tzinfo=ZoneInfo("America/Los_Angeles"))
+
+
 def get_filename(filename, fmt=''):
     """
     Get a standardized file name for the photo
@@ -183,39 +480,51 @@ def get_filename(filename, fmt=''):
         while the second value is a list of the directory within the repository
 
     """
-    import subprocess
     import re
     from datetime import datetime
     from os.path import exists
+    from .exiftool import execute
+    from .reader import read_fields
     from .utilities import sha1_hash
 
     if not exists(filename):
         raise IOError('Requested file does not exist')
 
-    tag_names = ['-CreateDate',
-                 '-Model',
-                ]
-
-    stdout = subprocess.check_output(['exiftool', filename]+tag_names)
-    if stdout == bytes():
-        name = None
-        loc = None
+    fields = read_fields(filename)
+    if fields is not None:
+        create_date_str = fields['CreateDate']
+        camera_model = fields['Model']
+        found = create_date_str is not None or camera_model is not None
     else:
+        # Not a format the reader handles, ask exiftool
+        tag_names = ['-CreateDate',
+                     '-Model',
+                    ]
+
+        stdout = execute(filename, *tag_names)
+        found = stdout != bytes()
         raw_str = stdout.decode('utf-8')
-        create_date_match = re.search('(?<=Create Date)[\s:]*(.*)(?=\n)', raw_str)
+        create_date_str = None
+        create_date_match = re.search(r'(?<=Create Date)[\s:]*(.*)(?=\n)', raw_str)
         if create_date_match is not None:
-            create_date = datetime.strptime(create_date_match.group(1), '%Y:%m:%d %H:%M:%S')
-        else:
-            raise ValueError('No creation date. Cannot create filename.')
-        camera_model_match = re.search('(?<=Camera Model Name)[\s:]*(.*)(?=\n)', raw_str)
+            create_date_str = create_date_match.group(1)
+        camera_model = None
+        camera_model_match = re.search(r'(?<=Camera Model Name)[\s:]*(.*)(?=\n)', raw_str)
+        if camera_model_match is None:
+            camera_model_match = re.search(r'(?<=Model)[\s:]*(.*)(?=\n)', raw_str)
         if camera_model_match is not None:
             camera_model = camera_model_match.group(1)
+
+    if not found:
+        name = None
+        loc = None
+    else:
+        if create_date_str is not None:
+            create_date = datetime.strptime(create_date_str, '%Y:%m:%d %H:%M:%S')
         else:
-            camera_model_match = re.search('(?<=Model)[\s:]*(.*)(?=\n)', raw_str)
-            if camera_model_match is not None:
-                camera_model = camera_model_match.group(1)
-            else:
-                camera_model = 'unknown'
+            raise ValueError('No creation date. Cannot create filename.')
+        if camera_model is None:
+            camera_model = 'unknown'
 
         ext = filename.split('.')[-1]
 
@@ -229,7 +538,25 @@ def get_filename(filename, fmt=''):
     return name, loc
 
 
-def calculate_checksum(image_path):
+def _pixel_text(strip):
+    """
+    The text form of the pixels of an image, as the original checksum hashed
+    them: the values of single band pixels, the tuples of the others
+    """
+    import numpy as np
+
+    if strip.mode == '1':
+        # bilevel pixels read as 0 and 255, one byte each once converted
+        strip = strip.convert('L')
+    dtype = {'I': '=i4', 'F': '=f4', 'I;16': '<u2', 'I;16L': '<u2', 'I;16B': '>u2'}.get(strip.mode, 'u1')
+    values = np.frombuffer(strip.tobytes(), dtype=dtype).tolist()
+    bands = len(strip.getbands())
+    if bands == 1:
+        return ''.join(map(str, values))
+    return ''.join(map(str, zip(*[iter(values)] * bands)))
+
+
+def calculate_checksum(image_path, legacy=False, strip_bytes=STRIP_BYTES):
     """
     Calculate the checksum on an image
 
@@ -237,11 +564,24 @@ def calculate_checksum(image_path):
     This allows you to add tags and otherwise alter meta data but still know
     that the underlying image is identical to another in the repo already
 
+    The image is decoded in full once; its pixels are then handed to the hash
+    in strips of whole rows, so no second copy of the whole image is made.
+
     Arguments
     ---------
     image_path : str
         The path to the image to be computed
 
+    Keyword Arguments
+    -----------------
+    legacy : bool
+        Use the original per-pixel algorithm, which hashes the text form of
+        every pixel. This is much slower, and is only needed to verify
+        checksums computed by earlier versions.
+
+    strip_bytes : int
+        The approximate size of each strip of pixel data handed to the hash
+
     Returns
     -------
     str
@@ -249,20 +589,30 @@ def calculate_checksum(image_path):
 
     """
     import hashlib
-    from PIL import Image
+    from .thumbs import open_image
 
-    # Open the image using Pillow
-    img = Image.open(image_path)
-
-    # Get the image data (content only, no metadata)
-    image_data = list(img.getdata())
-
-    # Calculate the MD5 hash of the image content
     md5_hash = hashlib.md5()
-    for pixel in image_data:
-        if hasattr(pixel, 'tobytes'):  # Check if pixel is a tuple
-            md5_hash.update(pixel.tobytes())
-        else:  # Pixel is a single value (e.g., RGB or grayscale)
-            md5_hash.update(str(pixel).encode('utf-8'))
+
+    # Open the image using Pillow, or pyheif for HEIC photos
+    with open_image(image_path) as img:
+        width, height = img.size
+        if width == 0 or height == 0:
+            return md5_hash.hexdigest()
+        img.load()
+
+        # Size the strips from the raw size of one row in the native mode
+        row_bytes = len(img.crop((0, 0, width, 1)).tobytes())
+        strip_rows = max(1, strip_bytes // max(1, row_bytes))
+
+        if not legacy:
+            # Include the pixel layout so equal bytes of different shapes differ
+            md5_hash.update('{0} {1}x{2}'.format(img.mode, width, height).encode('utf-8'))
+
+        for top in range(0, height, strip_rows):
+            strip = img.crop((0, top, width, min(height, top + strip_rows)))
+            if legacy:
+                md5_hash.update(_pixel_text(strip).encode('utf-8'))
+            else:
+                md5_hash.update(strip.tobytes())
 
     return md5_hash.hexdigest()
@@ -0,0 +1,270 @@
+"""
+Persistent exiftool sessions
+
+Starting exiftool means starting a Perl interpreter, which costs far more than
+reading the tags of a single file. This module keeps a small pool of
+long-lived exiftool processes running in ``-stay_open`` mode. Commands are
+written to their stdin one argument per line and the replies are framed by
+the ``{ready}`` markers exiftool prints after each ``-execute``.
+"""
+
+# the executable to launch
+EXECUTABLE = 'exiftool'
+
+# the shared pool used by the module level helpers
+_pool = None
+
+
+class ExifTool:
+    """
+    A single exiftool process running in -stay_open mode
+
+    Keyword Arguments
+    -----------------
+    executable : str
+        The exiftool executable to launch
+
+    """
+
+    def __init__(self, executable=EXECUTABLE):
+        self.executable = executable
+        self.process = None
+        self.counter = 0
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """
+        Launch the exiftool process
+        """
+        import subprocess
+
+        self.process = subprocess.Popen([self.executable,
+                                         '-stay_open', 'True',
+                                         '-@', '-'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+
+    def terminate(self):
+        """
+        Ask exiftool to exit and reap the process
+        """
+        import subprocess
+
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write(b'-stay_open\nFalse\n')
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout, self.process.stderr):
+            stream.close()
+        self.process = None
+
+    def execute(self, *args):
+        """
+        Run a single exiftool command
+
+        Arguments
+        ---------
+        args : str
+            The command line arguments, exactly as they would be passed to a
+            one-shot exiftool call. Arguments may not contain newlines.
+
+        Returns
+        -------
+        tuple
+            The raw stdout and stderr bytes of the command, with the framing
+            markers removed
+
+        """
+        lines = [str(arg) for arg in args]
+        for line in lines:
+            if '\n' in line:
+                raise ValueError('exiftool arguments may not contain newlines')
+
+        if not self.running:
+            self.start()
+
+        self.counter += 1
+        marker = '{{ready{0}}}'.format(self.counter)
+        # -echo4 writes the marker to stderr once the command is done, so both
+        # streams have a terminator to read up to
+        lines += ['-echo4', marker, '-execute{0}'.format(self.counter)]
+        self.process.stdin.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+
+        return self._read_reply(marker.encode('utf-8'))
+
+    def _read_reply(self, marker):
+        """
+        Read stdout and stderr up to the ready marker
+        """
+        import os
+        import selectors
+
+        buffers = {self.process.stdout: bytearray(), self.process.stderr: bytearray()}
+        pending = set(buffers)
+
+        selector = selectors.DefaultSelector()
+        for stream in pending:
+            selector.register(stream, selectors.EVENT_READ)
+        try:
+            while pending:
+                for key, _ in selector.select():
+                    stream = key.fileobj
+                    chunk = os.read(stream.fileno(), 65536)
+                    if not chunk:
+                        raise RuntimeError('exiftool exited unexpectedly')
+                    buffer = buffers[stream]
+                    buffer += chunk
+                    # wait for the newline after the marker as well, so it
+                    # is not left behind to prefix the next reply
+                    if buffer.endswith(b'\n') and buffer[:-1].rstrip(b'\r').endswith(marker):
+                        pending.discard(stream)
+                        selector.unregister(stream)
+        finally:
+            selector.close()
+
+        stdout, stderr = (bytes(buffers[stream][:-1].rstrip(b'\r')[:-len(marker)])
+                          for stream in (self.process.stdout, self.process.stderr))
+        return stdout, stderr
+
+
+class ExifToolPool:
+    """
+    A thread safe pool of exiftool processes
+
+    Workers are launched lazily, so a pool that only ever serves a single
+    caller at a time holds a single process.
+
+    Keyword Arguments
+    -----------------
+    size : int
+        The maximum number of exiftool processes. Defaults to the number of
+        cores, capped at 4.
+
+    executable : str
+        The exiftool executable to launch
+
+    """
+
+    def __init__(self, size=None, executable=EXECUTABLE):
+        import os
+        import queue
+        import threading
+
+        if size is None:
+            size = min(4, os.cpu_count() or 1)
+        if size < 1:
+            raise ValueError('The pool needs at least one worker')
+
+        self.size = size
+        self.executable = executable
+        self._workers = []
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        import queue
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._workers) < self.size:
+                worker = ExifTool(self.executable)
+                self._workers.append(worker)
+                return worker
+
+        return self._idle.get()
+
+    def execute(self, *args):
+        """
+        Run an exiftool command on the next free worker
+
+        See `ExifTool.execute` for the arguments. Anything exiftool writes to
+        stderr is forwarded to sys.stderr, as a one-shot call would.
+
+        Returns
+        -------
+        bytes
+            The stdout of the command
+
+        """
+        import sys
+        from .stats import stage
+
+        worker = self._acquire()
+        try:
+            with stage('exiftool'):
+                stdout, stderr = worker.execute(*args)
+        except Exception:
+            # the framing is lost, so the process cannot be reused
+            worker.terminate()
+            raise
+        finally:
+            self._idle.put(worker)
+
+        if stderr:
+            sys.stderr.write(stderr.decode('utf-8', errors='replace'))
+
+        return stdout
+
+    def close(self):
+        """
+        Terminate every worker in the pool
+
+        The workers are relaunched if the pool is used again.
+        """
+        with self._lock:
+            for worker in self._workers:
+                worker.terminate()
+
+
+def get_pool():
+    """
+    Get the shared exiftool pool, creating it on first use
+
+    Returns
+    -------
+    ExifToolPool
+        The pool shared by all the functions in photo.exif
+
+    """
+    import atexit
+
+    global _pool
+
+    if _pool is None:
+        _pool = ExifToolPool()
+        atexit.register(_pool.close)
+
+    return _pool
+
+
+def execute(*args):
+    """
+    Run an exiftool command on the shared pool
+
+    Arguments
+    ---------
+    args : str
+        The command line arguments to exiftool
+
+    Returns
+    -------
+    bytes
+        The stdout of the command
+
+    """
+    return get_pool().execute(*args)
@@ -0,0 +1,198 @@
+"""
+Source file fingerprint cache
+
+Re-running an ingest over the same inbox or card would otherwise checksum
+every file again before finding out it is a duplicate. This cache remembers
+the checksum and date computed for a source file, keyed by its device, inode,
+size and modification time, so an unchanged file is recognized from a single
+stat. Checksums computed with a different scheme (see photo.videohash) are
+kept apart. The cache is a SQLite database in the user cache directory; SQLite
+serializes concurrent photo processes sharing it. It holds at most a fixed
+number of entries and evicts the least recently used ones.
+"""
+
+# the maximum number of files remembered
+MAX_ENTRIES = 1000000
+
+# the number of insertions between checks for eviction
+EVICT_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    scheme TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    date TEXT,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (device, inode, size, mtime_ns, scheme)
+);
+CREATE INDEX IF NOT EXISTS fingerprints_last_used ON fingerprints (last_used);
+"""
+
+
+def default_cache_path():
+    """
+    Locate the fingerprint cache
+
+    Uses $XDG_CACHE_HOME/photo/fingerprints.db, falling back to
+    ~/.cache/photo/fingerprints.db
+
+    Returns
+    -------
+    str
+        The path of the cache database
+    """
+    import os
+
+    cache_dir = os.getenv("XDG_CACHE_HOME")
+    if not cache_dir:
+        cache_dir = os.path.expanduser(os.path.join("~", ".cache"))
+
+    return os.path.join(cache_dir, "photo", "fingerprints.db")
+
+
+class FingerprintCache:
+    """
+    A persistent map from source file fingerprints to checksums and dates
+
+    The cache may be shared between threads; every access is serialized.
+
+    Keyword Arguments
+    -----------------
+    path : str
+        The cache database. Defaults to `default_cache_path()`.
+
+    max_entries : int
+        The number of entries kept when the cache is pruned
+
+    """
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES):
+        import os
+        import sqlite3
+        import threading
+
+        if path is None:
+            path = default_cache_path()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._inserts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Prune the cache to its maximum size and close it
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._evict()
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    @staticmethod
+    def key(stat):
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def get(self, stat, scheme=''):
+        """
+        Look up a file by its stat result
+
+        Arguments
+        ---------
+        stat : os.stat_result
+            The stat of the source file
+
+        Keyword Arguments
+        -----------------
+        scheme : str
+            The checksum scheme, empty for the default one
+
+        Returns
+        -------
+        tuple | None
+            The kind, checksum and date stored for the file, or None if the
+            file has not been seen in this state
+
+        """
+        import time
+        from datetime import datetime
+
+        key = self.key(stat) + (scheme,)
+        with self._lock, self._conn:
+            row = self._conn.execute('SELECT kind, checksum, date FROM fingerprints '
+                                     'WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ? AND scheme = ?',
+                                     key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute('UPDATE fingerprints SET last_used = ? '
+                               'WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ? AND scheme = ?',
+                               (time.time_ns(),) + key)
+
+        kind, checksum, date = row
+        return kind, checksum, datetime.fromisoformat(date) if date is not None else None
+
+    def put(self, stat, kind, checksum, date, scheme=''):
+        """
+        Remember the checksum and date of a file
+
+        Arguments
+        ---------
+        stat : os.stat_result
+            The stat of the source file, taken before it was read
+
+        kind : str
+            The kind of file, 'photo' or 'video'
+
+        checksum : str
+            The content checksum
+
+        date : datetime | None
+            The date the photo or video was taken
+
+        Keyword Arguments
+        -----------------
+        scheme : str
+            The checksum scheme, empty for the default one
+
+        """
+        import time
+
+        date_str = date.isoformat() if date is not None else None
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               self.key(stat) + (scheme, kind, checksum, date_str, time.time_ns()))
+            self._inserts += 1
+            if self._inserts % EVICT_INTERVAL == 0:
+                self._evict()
+
+    def _evict(self):
+        count = self._conn.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute('DELETE FROM fingerprints WHERE rowid IN '
+                               '(SELECT rowid FROM fingerprints ORDER BY last_used LIMIT ?)',
+                               (count - self.max_entries,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
@@ -0,0 +1,111 @@
+"""
+Fast path for HEIC photos
+
+Decoding a HEIC photo means decoding every HEVC tile of its grid, which makes
+it by far the most expensive step of importing photos from a phone. Neither
+the date nor a content checksum needs the pixels:
+
+- the date comes from the Exif item of the HEIF container, which
+  photo.reader locates and parses without touching the image data, and
+- the coded checksum hashes the coded HEVC data of the primary image, tile by
+  tile, straight from the file. Like the pixel checksum it ignores the
+  metadata items, so retagged copies of a photo still match.
+
+The coded checksum differs from the pixel checksum, so it is a separate
+scheme, chosen with the add heic_hash setting. Under the legacy scheme HEIC
+photos are still decoded, in a pool of processes so the decodes do not
+serialize on the interpreter lock.
+"""
+
+# the checksum schemes of HEIC photos, kept with the command line choices
+from .choices import HEIC_SCHEMES as SCHEMES
+
+# the extensions of the photos handled here
+HEIC_EXT = ['.HEIC']
+
+
+def coded_checksum(filename):
+    """
+    Checksum the coded image data of a HEIF photo
+
+    Arguments
+    ---------
+    filename : str
+        The photo
+
+    Returns
+    -------
+    str | None
+        The md5 hex digest of the coded data of the primary image, or None
+        if the file is not a HEIF photo whose layout photo.reader handles
+
+    """
+    import hashlib
+    import mmap
+    import struct
+    from .reader import heif_image_extents
+
+    with open(filename, 'rb') as fid:
+        try:
+            buf = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return None
+
+    try:
+        try:
+            extents = heif_image_extents(buf)
+        except (struct.error, ValueError, IndexError, KeyError, OverflowError):
+            extents = None
+        if extents is None or any(offset + length > len(buf) for offset, length in extents):
+            return None
+
+        md5_hash = hashlib.md5()
+        with memoryview(buf) as view:
+            for offset, length in extents:
+                md5_hash.update(view[offset:offset + length])
+    finally:
+        buf.close()
+
+    return md5_hash.hexdigest()
+
+
+class DecodePool:
+    """
+    A pool of processes for full HEIC decodes
+
+    The processes are only started by the first decode.
+
+    Arguments
+    ---------
+    processes : int
+        The number of processes
+
+    """
+
+    def __init__(self, processes):
+        import threading
+
+        self.processes = processes
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def call(self, func, *args):
+        """
+        Run func(*args) in a process of the pool and wait for the result
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._executor is None:
+                # forking a process full of threads is not safe
+                self._executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return self._executor.submit(func, *args).result()
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -0,0 +1,776 @@
+"""
+Ingest engine for adding photos and videos to the repository
+
+The work of adding a file is split into three stages that run concurrently:
+
+1. a walker that lists the candidate files,
+
+2. a pool of workers that compute checksums and extract dates, and
+
+3. a bounded pool that copies new files into the repository.
+
+Deciding where a file goes and whether it is a duplicate happens in a single
+coordinating thread, in walk order, so the placement and the summary are the
+same as processing the files one at a time.
+"""
+
+# file extensions recognized as videos and photos
+VIDEO_EXT = [".AVI", ".MOV", ".MP4", ".MPG", ".M4V", ".MOD"]
+PHOTO_EXT = [".JPG", ".JPEG", ".PNG", ".HEIC"]
+HEIC_EXT = [".HEIC"]
+
+# the number of copies allowed in flight per copy worker
+COPY_BACKLOG = 4
+
+
+def default_date():
+    """
+    The date given to files without date metadata
+
+    Returns
+    -------
+    datetime
+        Midnight on January 1 1970 in the repository timezone
+
+    """
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+
+    return datetime(1970, 1, 1, tzinfo=ZoneInfo("America/Los_Angeles"))
+
+
+class Summary:
+    """
+    Running statistics of an ingest
+    """
+
+    def __init__(self):
+        from datetime import datetime
+        from zoneinfo import ZoneInfo
+
+        self.added_files = 0
+        self.duplicate_files = 0
+        self.skipped_files = 0
+        self.total_files = 0
+        self.missing_date = 0
+        self.corrupt_files = []
+        self.added = []
+        self.corrupt_count = 0
+        self.resumed_files = 0
+        self.first_date = datetime.now(ZoneInfo("America/Los_Angeles"))
+        self.last_date = default_date()
+
+    def add_date(self, date):
+        """
+        Track the earliest and latest dates seen
+        """
+        if date < self.first_date and date != default_date():
+            self.first_date = date
+        if date > self.last_date:
+            self.last_date = date
+
+    def report(self):
+        """
+        Print the summary to screen
+        """
+        print("")
+        print("Summary")
+        print("=======")
+        print(f"Processed {self.total_files} files from {self.first_date} to {self.last_date}")
+        print(f"{self.added_files} files added to the photo repository")
+        print(f"{self.duplicate_files} files skipped as duplicates")
+        print(f"{self.skipped_files} files skipped as unrecognized format")
+        print(f"{self.missing_date} files did not have date metadata")
+        print(f"{self.corrupt_count} files were corrupt: {self.corrupt_files}")
+        if self.resumed_files > 0:
+            print(f"{self.resumed_files} files were handled by the interrupted import")
+        process_sum = (self.added_files + self.duplicate_files + self.skipped_files + self.corrupt_count
+                       + self.resumed_files)
+        print(f"{self.total_files - process_sum} files unaccounted")
+
+
+def walk_files(path, walk, walk_filter=None):
+    """
+    List the candidate files for an ingest
+
+    Arguments
+    ---------
+    path : list
+        The directory or filenames to process
+
+    walk : bool
+        If True, walk the directory tree below the first entry of path
+
+    Keyword Arguments
+    -----------------
+    walk_filter : WalkFilter
+        The files and directories a walk visits. Defaults to every file
+        outside hidden directories, except hidden files (usually thumbnails).
+
+    Returns
+    -------
+    iterator
+        The Path of every candidate file. Directories and hidden files given
+        in path are left out as well.
+
+    """
+    from pathlib import Path
+    from .walker import scan_tree
+
+    if walk:
+        for entry in scan_tree(path[0], walk_filter):
+            yield Path(entry.path)
+    else:
+        for file in path:
+            file_obj = Path(file)
+            if not file_obj.name.startswith('.') and not file_obj.is_dir():
+                yield file_obj
+
+
+def inspect_file(file_obj, video_hash=None, heic_hash=None, photo_hash=None):
+    """
+    Compute the checksum and date of a file
+
+    Arguments
+    ---------
+    file_obj : Path
+        The file to inspect
+
+    Keyword Arguments
+    -----------------
+    video_hash : str
+        The streaming checksum scheme used for videos, one of
+        photo.videohash.SCHEMES. Defaults to the MD5 of the whole file.
+
+    heic_hash : str
+        The checksum scheme used for HEIC photos, 'coded' to hash the coded
+        image data. Defaults to the pixel checksum.
+
+    photo_hash : str
+        The pixel checksum scheme, 'raw' to hash the pixel bytes. Defaults to
+        the legacy checksum of the text of every pixel.
+
+    Returns
+    -------
+    tuple
+        The kind of file ('video', 'photo' or None for unrecognized files),
+        the checksum and the date. The checksum of a corrupt photo and the
+        date of a file without date metadata are None.
+
+    """
+    kind, checksum = compute_checksum(file_obj, video_hash, heic_hash, photo_hash)
+    if kind is None:
+        return None, None, None
+    return kind, checksum, file_date(file_obj)
+
+
+def file_date(file_obj):
+    """
+    Read the date of a photo or video, timed as the date stage
+
+    Dates come from the native header reader; exiftool is only asked for
+    formats it does not handle.
+    """
+    from .exif import get_date
+    from .reader import read_date
+    from .stats import stage
+
+    with stage('date'):
+        return read_date(file_obj, fallback=get_date)
+
+
+def compute_checksum(file_obj, video_hash=None, heic_hash=None, photo_hash=None):
+    """
+    Compute the content checksum of a file
+
+    Arguments
+    ---------
+    file_obj : Path
+        The file to checksum
+
+    Keyword Arguments
+    -----------------
+    video_hash : str
+        The streaming checksum scheme used for videos, one of
+        photo.videohash.SCHEMES. Defaults to the MD5 of the whole file.
+
+    heic_hash : str
+        The checksum scheme used for HEIC photos, 'coded' to hash the coded
+        image data. Defaults to the pixel checksum.
+
+    photo_hash : str
+        The pixel checksum scheme, 'raw' to hash the pixel bytes. Defaults to
+        the legacy checksum of the text of every pixel.
+
+    Returns
+    -------
+    tuple
+        The kind of file ('video', 'photo' or None for unrecognized files)
+        and the checksum, which is None for a corrupt photo or an
+        unrecognized file
+
+    """
+    from .stats import stage
+
+    suffix = file_obj.suffix.upper()
+    if suffix in VIDEO_EXT:
+        from .videohash import hash_video
+        with stage('hash', file_obj.stat().st_size):
+            # without a scheme, videos are hashed whole
+            return 'video', hash_video(file_obj, video_hash or 'file')
+    elif suffix in PHOTO_EXT:
+        with stage('hash', file_obj.stat().st_size):
+            if heic_hash == 'coded' and suffix in HEIC_EXT:
+                from .heic import coded_checksum
+                checksum = coded_checksum(file_obj)
+                if checksum is not None:
+                    return 'photo', checksum
+            return 'photo', photo_checksum(file_obj, photo_hash)
+    else:
+        return None, None
+
+
+def photo_checksum(file_obj, photo_hash=None):
+    """
+    Compute the pixel checksum of a photo
+
+    Keyword Arguments
+    -----------------
+    photo_hash : str
+        'raw' to hash the pixel bytes. Defaults to the legacy checksum, which
+        repositories filled by earlier versions are named with.
+
+    Returns
+    -------
+    str | None
+        The checksum of `photo.exif.calculate_checksum`, or None if the photo
+        cannot be decoded
+
+    """
+    from PIL import Image
+    from .exif import calculate_checksum
+
+    try:
+        return calculate_checksum(file_obj, legacy=photo_hash != 'raw')
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        # Pillow reports truncated and garbled files in all of these ways
+        return None
+
+
+def canonical_path(repo_path, date, checksum, suffix):
+    """
+    Form the location of a file within the repository
+
+    Arguments
+    ---------
+    repo_path : Path
+        The root of the photo repository
+
+    date : datetime
+        The date the photo or video was taken
+
+    checksum : str
+        The content checksum of the file
+
+    suffix : str
+        The file extension, including the leading period
+
+    Returns
+    -------
+    Path
+        The canonical path, <repo>/YYYY/MM/YYMMDD_HHMMSS_<checksum8><suffix>
+
+    """
+    from pathlib import Path
+
+    canonical_file = Path(f"{date.strftime('%y%m%d_%H%M%S')}_{checksum[:8]}{suffix}")
+    canonical_folder = Path(f"{date.year}/{date.month:02}")
+
+    return Path(repo_path) / canonical_folder / canonical_file
+
+
+def place_file(file_obj, insert_path, mode='auto'):
+    """
+    Copy a file to its place in the repository
+
+    The file is written under a hidden temporary name and renamed into place,
+    so an interrupted copy never leaves a truncated file at the canonical
+    path. See photo.placement for the available modes.
+    """
+    import os
+    from .journal import partial_path
+    from .placement import place
+    from .stats import stage
+
+    os.makedirs(insert_path.parent, exist_ok=True)
+    partial = partial_path(insert_path)
+    if partial.exists():
+        # left over from an interrupted run
+        os.unlink(partial)
+    with stage('copy', os.stat(file_obj).st_size):
+        try:
+            place(file_obj, partial, mode)
+            os.replace(partial, insert_path)
+        except BaseException:
+            if partial.exists():
+                os.unlink(partial)
+            raise
+
+
+class Pipeline:
+    """
+    The per-file steps of an ingest
+
+    Inspecting a file may run in any worker thread. Settling, which decides
+    where a file goes and whether it is a duplicate, must be called for one
+    file at a time in walk order. The threaded and the asyncio drivers share
+    these steps, so they place files the same way.
+
+    Arguments
+    ---------
+    repo_path : Path
+        The root of the photo repository
+
+    summary : Summary
+        The statistics to update
+
+    Keyword Arguments
+    -----------------
+    catalog, cache, mode, video_hash, heic_hash, photo_hash
+        As for `ingest`
+
+    copy_backlog : int
+        The number of copies allowed to be queued but not finished
+
+    io : callable
+        Called as io(func, *args) to place a file, for example to retry it.
+        By default files are placed with a plain call.
+
+    journal : Journal
+        The import journal recording every decision
+
+    processes : int
+        The number of processes decoding HEIC photos under the pixel
+        checksum. With fewer than 2 they are decoded in the calling thread.
+
+    """
+
+    def __init__(self, repo_path, summary, catalog=None, cache=None, mode='auto', video_hash=None,
+                 copy_backlog=4 * COPY_BACKLOG, io=None, journal=None, heic_hash=None, processes=0,
+                 photo_hash=None):
+        import threading
+        from pathlib import Path
+
+        self.repo_path = Path(repo_path)
+        self.summary = summary
+        self.catalog = catalog
+        self.cache = cache
+        self.mode = mode
+        self.video_hash = video_hash
+        self.heic_hash = heic_hash
+        self.photo_hash = photo_hash
+        self.io = io
+        self.journal = journal
+        self.missing = default_date()
+
+        # the checksums and canonical paths placed during this run, which may
+        # still be copying and so are not yet in the catalog or on disk
+        self.claimed = {}
+        self.claimed_paths = set()
+        self.print_lock = threading.Lock()
+        # placed files whose embedded tags are still to be read into the
+        # catalog, a batch at a time
+        self.untagged = []
+        self.tag_lock = threading.Lock()
+        # bounds the number of copies queued but not finished
+        self.copy_slots = threading.BoundedSemaphore(copy_backlog)
+        self.decode_pool = None
+        if processes > 1 and heic_hash != 'coded':
+            from .heic import DecodePool
+            self.decode_pool = DecodePool(processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Record the tags of the last placed files and stop the HEIC decode
+        processes
+        """
+        try:
+            if self.catalog is not None:
+                self.record_tags()
+        finally:
+            if self.decode_pool is not None:
+                self.decode_pool.close()
+
+    def record(self, insert_path, checksum, date):
+        """
+        Record a placed file in the catalog
+
+        Its embedded tags are read later, together with those of other placed
+        files, so files exiftool has to read cost one command per batch
+        rather than one each.
+        """
+        from .exif import BATCH_SIZE
+
+        self.catalog.add(insert_path, checksum, date)
+        with self.tag_lock:
+            self.untagged.append(insert_path)
+            if len(self.untagged) < BATCH_SIZE:
+                return
+            batch, self.untagged = self.untagged, []
+        self.record_tags(batch)
+
+    def record_tags(self, batch=None):
+        """
+        Read the embedded tags of placed files into the catalog
+
+        Keyword Arguments
+        -----------------
+        batch : list
+            The placed files to read. Defaults to all those still waiting.
+
+        """
+        from .exif import read_tags
+
+        if batch is None:
+            with self.tag_lock:
+                batch, self.untagged = self.untagged, []
+        if not batch:
+            return
+        for filename, tags in read_tags(batch, backend='embedded').items():
+            if tags:
+                self.catalog.set_tags(filename, tags)
+
+    def copy(self, file_obj, insert_path, checksum, date):
+        """
+        Place a file claimed by `settle`, releasing its copy slot
+        """
+        try:
+            if self.io is None:
+                place_file(file_obj, insert_path, self.mode)
+            else:
+                self.io(place_file, file_obj, insert_path, self.mode)
+            if self.catalog is not None:
+                self.record(insert_path, checksum, date)
+            if self.journal is not None:
+                self.journal.done(insert_path)
+            with self.print_lock:
+                print(f"Added {insert_path.name} (from {file_obj}) to the photo repository")
+        finally:
+            self.copy_slots.release()
+
+    def resumed(self, file_obj):
+        """
+        Check whether the interrupted import already handled a file
+
+        Such files are counted and need no further work.
+        """
+        if self.journal is None or not self.journal.finished(file_obj):
+            return False
+        self.summary.resumed_files += 1
+        return True
+
+    def replay(self, copies, submit):
+        """
+        Finish the placements the interrupted import planned
+
+        Arguments
+        ---------
+        copies, submit
+            As for `settle`
+
+        """
+        import os
+        from datetime import datetime
+        from pathlib import Path
+        from .journal import partial_path
+
+        if self.journal is None:
+            return
+
+        for plan in self.journal.pending():
+            source = Path(plan['source'][0])
+            insert_path = Path(plan['dest'])
+            checksum = plan['checksum']
+            date = datetime.fromisoformat(plan['date'])
+            self.claimed[checksum] = insert_path
+            self.claimed_paths.add(insert_path)
+
+            partial = partial_path(insert_path)
+            if not insert_path.exists() and not source.exists() and partial.exists():
+                # moved into the repository but not yet renamed into place
+                os.replace(partial, insert_path)
+
+            if insert_path.exists():
+                # the rename is atomic, so the file is complete
+                if self.catalog is not None and self.catalog.get(insert_path) is None:
+                    self.record(insert_path, checksum, date)
+                self.journal.done(insert_path)
+            elif source.exists():
+                self.summary.added.append((insert_path, checksum))
+                self.copy_slots.acquire()
+                copies.append(submit(self.copy, source, insert_path, checksum, date))
+            else:
+                with self.print_lock:
+                    print(f"WARNING: {source} disappeared before it could be added")
+
+    def decode(self, file_obj):
+        suffix = file_obj.suffix.upper()
+        if suffix in HEIC_EXT:
+            if self.heic_hash is not None:
+                return inspect_file(file_obj, heic_hash=self.heic_hash, photo_hash=self.photo_hash)
+            if self.decode_pool is not None:
+                from .stats import stage
+                # only the decode goes to the pool, and the stages of the
+                # worker process are not collected, so it is timed here
+                with stage('hash', file_obj.stat().st_size):
+                    kind, checksum = self.decode_pool.call(compute_checksum, file_obj, None, None,
+                                                           self.photo_hash)
+                return kind, checksum, file_date(file_obj)
+        if suffix in VIDEO_EXT and self.video_hash is not None:
+            return inspect_file(file_obj, video_hash=self.video_hash)
+        if suffix in PHOTO_EXT and self.photo_hash is not None:
+            return inspect_file(file_obj, photo_hash=self.photo_hash)
+        return inspect_file(file_obj)
+
+    def inspect(self, file_obj):
+        """
+        Find the kind, checksum and date of a file, reusing earlier work
+
+        Returns
+        -------
+        tuple
+            As for `inspect_file`
+
+        """
+        from datetime import datetime
+        from .dedupe import match_existing
+
+        cache = self.cache
+        catalog = self.catalog
+        suffix = file_obj.suffix.upper()
+        if (cache is None and catalog is None) or suffix not in VIDEO_EXT + PHOTO_EXT:
+            return self.decode(file_obj)
+
+        # stat before reading, so a file changing underneath is seen again
+        stat = file_obj.stat()
+        if suffix in VIDEO_EXT:
+            scheme = self.video_hash or ''
+        elif suffix in HEIC_EXT and self.heic_hash is not None:
+            scheme = self.heic_hash
+        else:
+            scheme = self.photo_hash or ''
+        result = cache.get(stat, scheme) if cache is not None else None
+        if result is not None:
+            return result
+        if catalog is not None:
+            # a byte identical copy of a repository file needs no decode
+            record = match_existing(file_obj, stat, catalog)
+            if record is not None:
+                date = datetime.fromisoformat(record['date']) if record['date'] is not None else None
+                if date == self.missing:
+                    date = None
+                result = ('video' if suffix in VIDEO_EXT else 'photo', record['checksum'], date)
+        if result is None:
+            result = self.decode(file_obj)
+        kind, checksum, date = result
+        if cache is not None and checksum is not None:
+            cache.put(stat, kind, checksum, date, scheme)
+        return result
+
+    def _settled(self, file_obj, outcome):
+        if self.journal is not None:
+            self.journal.settled(file_obj, outcome)
+
+    def settle(self, file_obj, result, copies, submit):
+        """
+        Decide what to do with an inspected file
+
+        Arguments
+        ---------
+        file_obj : Path
+            The file
+
+        result : tuple
+            The return value of `inspect`
+
+        copies : list
+            The futures of the copies and catalog records submitted so far
+
+        submit : callable
+            Called as submit(func, *args) to run a copy in the background,
+            returning a concurrent.futures.Future
+
+        """
+        from .stats import stage
+
+        summary = self.summary
+        kind, checksum, date = result
+
+        if kind is None:
+            # File not recoginized as an image. Skip it.
+            with self.print_lock:
+                print(f"{file_obj} not recognized as an image file. Skipping.")
+            summary.skipped_files += 1
+            self._settled(file_obj, 'skipped')
+            return
+        if kind == 'photo' and checksum is None:
+            summary.corrupt_count += 1
+            summary.corrupt_files.append(file_obj)
+            with self.print_lock:
+                print(f"WARNING: {file_obj} is corrupt!")
+            self._settled(file_obj, 'corrupt')
+            return
+
+        if date is None:
+            date = self.missing
+            summary.missing_date += 1
+        summary.add_date(date)
+
+        insert_path = canonical_path(self.repo_path, date, checksum, file_obj.suffix)
+        with stage('exists'):
+            existing = self.claimed.get(checksum)
+            if existing is None and self.catalog is not None:
+                matches = self.catalog.lookup(checksum)
+                if matches:
+                    existing = matches[0]
+            if existing is None and (insert_path in self.claimed_paths or insert_path.exists()):
+                existing = insert_path
+                if self.catalog is not None and insert_path not in self.claimed_paths:
+                    # placed before the catalog existed; record it now
+                    copies.append(submit(self.record, insert_path, checksum, date))
+
+        if existing is not None:
+            with self.print_lock:
+                print(f"File {existing.name} (from {file_obj}) already exists in the repository")
+            summary.duplicate_files += 1
+            self._settled(file_obj, 'duplicate')
+            return
+
+        self.claimed[checksum] = insert_path
+        self.claimed_paths.add(insert_path)
+        summary.added_files += 1
+        summary.added.append((insert_path, checksum))
+        if self.journal is not None:
+            self.journal.plan(file_obj, insert_path, checksum, date)
+        self.copy_slots.acquire()
+        copies.append(submit(self.copy, file_obj, insert_path, checksum, date))
+
+
+def ingest(path, walk, repo_path, jobs=None, copy_jobs=None, summary=None, catalog=None,
+           cache=None, mode='auto', video_hash=None, journal=None, heic_hash=None, walk_filter=None,
+           photo_hash=None):
+    """
+    Add photos and videos to the repository
+
+    Arguments
+    ---------
+    path : list
+        The directory or filenames to process
+
+    walk : bool
+        If True, walk the directory tree below the first entry of path
+
+    repo_path : Path
+        The root of the photo repository
+
+    Keyword Arguments
+    -----------------
+    jobs : int
+        The number of workers computing checksums and dates. Defaults to the
+        number of cores.
+
+    copy_jobs : int
+        The number of workers copying files into the repository. Defaults to
+        the number of checksum workers, capped at 4.
+
+    summary : Summary
+        The statistics to update. A new one is created if not provided.
+
+    catalog : Catalog
+        The repository catalog. If provided, duplicates are looked up by
+        checksum in the catalog and every placed file is recorded in it.
+
+    cache : FingerprintCache
+        The source fingerprint cache. If provided, files seen before in the
+        same state are not read again.
+
+    mode : str
+        How files are placed in the repository, one of photo.placement.MODES
+
+    video_hash : str
+        The streaming checksum scheme used for videos, one of
+        photo.videohash.SCHEMES. Defaults to the MD5 of the whole file.
+
+    journal : Journal
+        The import journal. Placements planned by an interrupted import are
+        finished first, and the files it handled are skipped.
+
+    heic_hash : str
+        The checksum scheme used for HEIC photos, one of photo.heic.SCHEMES
+        other than legacy. Defaults to the pixel checksum, with the photos
+        decoded in a pool of jobs processes.
+
+    walk_filter : WalkFilter
+        The files and directories a walk visits
+
+    photo_hash : str
+        The pixel checksum scheme, 'raw' to hash the pixel bytes. Defaults to
+        the legacy checksum of the text of every pixel.
+
+    Returns
+    -------
+    Summary
+        The statistics of the ingest
+
+    """
+    import os
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from .stats import timed_iter
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if copy_jobs is None:
+        copy_jobs = min(jobs, 4)
+    if jobs < 1 or copy_jobs < 1:
+        raise ValueError('The number of jobs must be at least 1')
+    if summary is None:
+        summary = Summary()
+
+    pipeline = Pipeline(repo_path, summary, catalog=catalog, cache=cache, mode=mode,
+                        video_hash=video_hash, copy_backlog=copy_jobs * COPY_BACKLOG, journal=journal,
+                        heic_hash=heic_hash, processes=jobs, photo_hash=photo_hash)
+
+    # the checksums in flight; results are settled in walk order
+    window = deque()
+    copies = []
+    with pipeline, ThreadPoolExecutor(max_workers=jobs) as hash_executor, \
+            ThreadPoolExecutor(max_workers=copy_jobs) as copy_executor:
+        def settle_next():
+            file_obj, future = window.popleft()
+            pipeline.settle(file_obj, future.result(), copies, copy_executor.submit)
+
+        pipeline.replay(copies, copy_executor.submit)
+        for file_obj in timed_iter(walk_files(path, walk, walk_filter), 'walk'):
+            summary.total_files += 1
+            if pipeline.resumed(file_obj):
+                continue
+
+            window.append((file_obj, hash_executor.submit(pipeline.inspect, file_obj)))
+            while len(window) > 2 * jobs:
+                settle_next()
+
+        while window:
+            settle_next()
+
+        # surface any copy failures
+        for future in copies:
+            future.result()
+
+    return summary
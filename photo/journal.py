@@ -0,0 +1,298 @@
+"""
+Import journal
+
+An ingest writes a journal to the root of the repository as it goes, one JSON
+object per line:
+
+- a 'start' entry with the arguments of the import,
+- a 'plan' entry for every file about to be placed, with its destination,
+  checksum and date,
+- a 'done' entry once the file is placed and recorded,
+- a 'settled' entry for every file found to be a duplicate, unrecognized or
+  corrupt.
+
+Every import writes its own journal, named after the time it started, and
+holds an exclusive lock on it (fcntl.flock) while it runs, so imports into the
+same repository, e.g. `photo add` and the batches of `photo watch`, never
+write to each other's journal. The journal is removed when the import
+completes, so a journal that is left and not locked belongs to an import that
+was interrupted. `photo add --resume` takes the oldest of those and reads it
+back: files already settled are skipped without being read again, and planned
+placements are finished from the journal without computing their checksums
+again.
+
+Source files are identified by path, size and modification time, so a file
+changed since the interrupted run is processed again.
+"""
+
+# the journals in the repository root; each import adds the time it started
+# and a unique suffix to the prefix, and the single journal of older versions
+# matches as well
+JOURNAL_PREFIX = '.photo-import'
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_PATTERN = JOURNAL_PREFIX + '*' + JOURNAL_SUFFIX
+
+
+def partial_path(insert_path):
+    """
+    The temporary name a file is written under before it is renamed into place
+
+    The name is hidden, so walks and duplicate scans of the repository ignore
+    it.
+    """
+    return insert_path.with_name('.' + insert_path.name + '.partial')
+
+
+def _try_lock(fid):
+    """
+    Take the exclusive lock of an open journal without waiting
+
+    Returns
+    -------
+    bool
+        False if another import holds the lock
+
+    """
+    import fcntl
+
+    try:
+        fcntl.flock(fid.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _open_interrupted(path):
+    """
+    Open and lock the journal of an interrupted import
+
+    Returns
+    -------
+    file
+        The journal open for appending, or None if an import still holds it
+        or it was removed in the meantime
+
+    """
+    import os
+
+    try:
+        fid = open(path, 'a')
+    except FileNotFoundError:
+        return None
+    # the import holding the lock may remove the journal just before
+    # releasing it, so the name must still refer to the file locked
+    try:
+        if _try_lock(fid) and os.fstat(fid.fileno()).st_ino == os.stat(path).st_ino:
+            return fid
+    except FileNotFoundError:
+        pass
+    fid.close()
+    return None
+
+
+def interrupted(repo_path):
+    """
+    The journals of the interrupted imports into a repository
+
+    Arguments
+    ---------
+    repo_path : Path
+        The root of the photo repository
+
+    Returns
+    -------
+    list
+        The paths of the journals no running import holds, oldest first
+
+    """
+    from pathlib import Path
+
+    found = []
+    for path in sorted(Path(repo_path).glob(JOURNAL_PATTERN)):
+        fid = _open_interrupted(path)
+        if fid is not None:
+            fid.close()
+            found.append(path)
+    return found
+
+
+class Journal:
+    """
+    The journal of an import into a repository
+
+    Arguments
+    ---------
+    repo_path : Path
+        The root of the photo repository
+
+    Keyword Arguments
+    -----------------
+    resume : bool or Path
+        Read the journal of an interrupted import and append to it: the
+        oldest journal no running import holds, or the given one. Otherwise a
+        new journal is started.
+
+    """
+
+    def __init__(self, repo_path, resume=False):
+        import os
+        import tempfile
+        import threading
+        from datetime import datetime
+        from pathlib import Path
+
+        self.args = None
+        self._settled = set()
+        self._plans = {}
+        self._planned = set()
+        self._lock = threading.Lock()
+        self._fid = None
+
+        if resume:
+            candidates = sorted(Path(repo_path).glob(JOURNAL_PATTERN)) if resume is True else [Path(resume)]
+            for path in candidates:
+                self._fid = _open_interrupted(path)
+                if self._fid is not None:
+                    self.path = path
+                    break
+            else:
+                if resume is True:
+                    raise IOError('There is no interrupted import to resume')
+                raise IOError(f'The journal {resume} is in use by another import or gone')
+            self._load()
+        else:
+            os.makedirs(repo_path, exist_ok=True)
+            prefix = f'{JOURNAL_PREFIX}-{datetime.now():%Y%m%d%H%M%S}-'
+            # locked before it is given a name other imports look for
+            fd, name = tempfile.mkstemp(suffix=JOURNAL_SUFFIX + '.new', prefix=prefix, dir=repo_path)
+            self._fid = os.fdopen(fd, 'w')
+            _try_lock(self._fid)
+            self.path = Path(name[:-len('.new')])
+            os.rename(name, self.path)
+
+    def _load(self):
+        import json
+
+        with open(self.path, 'r') as fid:
+            for line in fid:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of a crashed run may be cut short
+                    continue
+                op = entry['op']
+                if op == 'start':
+                    self.args = entry
+                elif op == 'settled':
+                    self._settled.add(tuple(entry['source']))
+                elif op == 'plan':
+                    self._plans[entry['dest']] = entry
+                elif op == 'done':
+                    plan = self._plans.pop(entry['dest'], None)
+                    if plan is not None:
+                        self._settled.add(tuple(plan['source']))
+        self._planned = {tuple(plan['source']) for plan in self._plans.values()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(complete=exc_type is None)
+
+    def close(self, complete=False):
+        """
+        Close the journal, removing it if the import completed
+        """
+        import os
+
+        with self._lock:
+            if self._fid is None:
+                return
+            # removed while still locked, so no other import resumes it
+            if complete:
+                os.unlink(self.path)
+            self._fid.close()
+            self._fid = None
+
+    def _write(self, entry):
+        import json
+
+        with self._lock:
+            self._fid.write(json.dumps(entry) + '\n')
+            self._fid.flush()
+
+    @staticmethod
+    def source(file_obj):
+        """
+        Identify a source file by its path, size and modification time
+        """
+        import os
+
+        stat = os.stat(file_obj)
+        return (os.path.abspath(file_obj), stat.st_size, stat.st_mtime_ns)
+
+    def start(self, path, walk):
+        """
+        Record the arguments of a new import
+        """
+        import os
+
+        if self.args is None:
+            self.args = {'op': 'start', 'path': [os.path.abspath(entry) for entry in path], 'walk': walk}
+            self._write(self.args)
+
+    def finished(self, file_obj):
+        """
+        Check whether an earlier run already settled or planned a file
+        """
+        if len(self._settled) == 0 and len(self._planned) == 0:
+            return False
+        try:
+            source = self.source(file_obj)
+        except OSError:
+            return False
+        return source in self._settled or source in self._planned
+
+    def pending(self):
+        """
+        The placements planned by an earlier run but not done
+
+        Returns
+        -------
+        list
+            The plan entries, with 'source', 'dest', 'checksum' and 'date'
+
+        """
+        return list(self._plans.values())
+
+    def settled(self, file_obj, outcome):
+        """
+        Record that a file needs no placement
+
+        Arguments
+        ---------
+        file_obj : Path
+            The source file
+
+        outcome : str
+            'duplicate', 'skipped' or 'corrupt'
+
+        """
+        self._write({'op': 'settled', 'source': self.source(file_obj), 'outcome': outcome})
+
+    def plan(self, file_obj, insert_path, checksum, date):
+        """
+        Record a placement about to start
+        """
+        import os
+
+        self._write({'op': 'plan', 'source': self.source(file_obj), 'dest': os.path.abspath(insert_path),
+                     'checksum': checksum, 'date': date.isoformat()})
+
+    def done(self, insert_path):
+        """
+        Record a finished placement
+        """
+        import os
+
+        self._write({'op': 'done', 'dest': os.path.abspath(insert_path)})
@@ -0,0 +1,139 @@
+"""
+Placement of files into the repository
+
+A plain copy pushes every byte through user space. When the inbox and the
+repository share a filesystem there are much cheaper ways to place a file:
+
+- reflink: a copy-on-write clone (FICLONE on btrfs, xfs and friends), which
+  shares the data blocks until either side is modified,
+- copy_file_range: a copy done inside the kernel, which some filesystems turn
+  into a clone or a server side copy on NFS,
+- hardlink: a second name for the same inode,
+- move: a rename of the source into the repository,
+- copy: shutil.copy2, which on Linux already uses sendfile.
+
+The 'auto' mode tries reflink, then copy_file_range, then copy, remembering
+per pair of devices which one worked. It never picks hardlink or move, since
+those do not leave an independent source file behind; ask for them
+explicitly.
+"""
+
+# the placement modes, kept with the command line choices
+from .choices import MODES
+
+# the FICLONE ioctl request number, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# the number of bytes handed to a single copy_file_range call
+RANGE_CHUNK = 1 << 30
+
+# the cheapest working mode for each (source device, destination device)
+_auto_modes = {}
+
+
+def reflink(src, dest):
+    """
+    Clone a file with the FICLONE ioctl
+    """
+    import errno
+    import os
+
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported on this platform')
+
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            os.unlink(dest)
+            raise
+
+
+def copy_range(src, dest):
+    """
+    Copy a file inside the kernel with copy_file_range
+    """
+    import errno
+    import os
+
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.EOPNOTSUPP, 'copy_file_range is not supported on this platform')
+
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        try:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(remaining, RANGE_CHUNK))
+                if copied == 0:
+                    raise OSError(errno.EIO, 'copy_file_range stopped early')
+                remaining -= copied
+        except OSError:
+            fdst.close()
+            os.unlink(dest)
+            raise
+
+
+def place(src, dest, mode='auto'):
+    """
+    Place a file at its destination
+
+    Arguments
+    ---------
+    src : str
+        The file to place
+
+    dest : str
+        The destination path, which must not exist yet. Its directory must
+        exist.
+
+    Keyword Arguments
+    -----------------
+    mode : str
+        One of MODES
+
+    Returns
+    -------
+    str
+        The mode that was used
+
+    """
+    import os
+    import shutil
+
+    if mode not in MODES:
+        raise ValueError('Unrecognized placement mode "{0}"'.format(mode))
+
+    if mode == 'hardlink':
+        os.link(src, dest)
+    elif mode == 'move':
+        shutil.move(src, dest)
+    elif mode == 'copy':
+        shutil.copy2(src, dest)
+    elif mode == 'reflink':
+        reflink(src, dest)
+        shutil.copystat(src, dest)
+    elif mode == 'copy_file_range':
+        copy_range(src, dest)
+        shutil.copystat(src, dest)
+    else:
+        devices = (os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dest))).st_dev)
+        candidates = ['reflink', 'copy_file_range', 'copy']
+        if devices in _auto_modes:
+            candidates = candidates[candidates.index(_auto_modes[devices]):]
+        elif devices[0] != devices[1]:
+            # clones never cross filesystems
+            candidates.remove('reflink')
+
+        for candidate in candidates:
+            try:
+                used = place(src, dest, candidate)
+            except OSError:
+                if candidate == 'copy':
+                    raise
+                continue
+            _auto_modes[devices] = used
+            return used
+
+    return mode
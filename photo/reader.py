@@ -0,0 +1,528 @@
+"""
+In-process reader for the handful of metadata fields the tool needs
+
+Ingesting and tagging only need the capture date, the camera model and the
+ImageDescription field. Spawning exiftool for those is far more expensive than
+reading them, so this module parses them straight out of the file headers:
+
+- JPEG: the TIFF IFDs of the APP1 Exif segment,
+- HEIC/HEIF: the Exif item located through the meta/iinf/iloc boxes,
+- QuickTime/MP4: the mvhd (or mdhd) atom and the Apple model key.
+
+Files are mapped with mmap, so only the header pages that are actually parsed
+are read from disk. Any other format, or a header the reader cannot make sense
+of, is reported as unsupported so callers can fall back to exiftool.
+"""
+
+# EXIF tag ids
+TAG_IMAGE_DESCRIPTION = 0x010E
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_CREATE_DATE = 0x9004
+
+# the brands of the ftyp box identifying a HEIF image rather than a movie
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif'}
+
+# the top level atoms a QuickTime file without an ftyp box may start with
+QUICKTIME_ATOMS = {b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+
+
+def read_fields(filename):
+    """
+    Read the date, model and description fields of a photo or video
+
+    Arguments
+    ---------
+    filename : str
+        The photo or video to read
+
+    Returns
+    -------
+    dict | None
+        None if the format is not handled. Otherwise the values of
+        'DateTimeOriginal', 'CreateDate', 'Model' and 'ImageDescription' as
+        exiftool prints them, or None when absent, along with the 'format'
+        that was parsed ('jpeg', 'heif' or 'quicktime'). QuickTime dates are
+        in UTC.
+
+    """
+    import mmap
+    import struct
+
+    with open(filename, 'rb') as fid:
+        try:
+            buf = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be mapped
+            return None
+
+    try:
+        if buf[:2] == b'\xff\xd8':
+            fields = _read_jpeg(buf)
+        elif buf[4:8] == b'ftyp':
+            size = struct.unpack_from('>I', buf, 0)[0]
+            brands = {bytes(buf[idx:idx + 4]) for idx in range(8, min(size, len(buf)), 4)}
+            if brands & HEIF_BRANDS and not brands & {b'qt  ', b'isom', b'mp41', b'mp42'}:
+                fields = _read_heif(buf)
+            else:
+                fields = _read_quicktime(buf)
+        elif buf[4:8] in QUICKTIME_ATOMS:
+            fields = _read_quicktime(buf)
+        else:
+            fields = None
+    except (struct.error, ValueError, IndexError, KeyError, OverflowError):
+        # a header this reader does not understand; let exiftool have a go
+        fields = None
+    finally:
+        buf.close()
+
+    return fields
+
+
+def read_date(filename, fallback=None):
+    """
+    Get the date a photo or video was taken
+
+    Arguments
+    ---------
+    filename : str
+        The photo or video to read
+
+    Keyword Arguments
+    -----------------
+    fallback : callable
+        Called with the filename when the format is not handled
+
+    Returns
+    -------
+    datetime | None
+        The DateTimeOriginal, or CreateDate if that is missing, in the
+        America/Los_Angeles timezone. None if the file has no date.
+
+    """
+    from datetime import datetime, timezone
+    from zoneinfo import ZoneInfo
+
+    tzla = ZoneInfo("America/Los_Angeles")
+
+    fields = read_fields(filename)
+    if fields is None:
+        return fallback(filename) if fallback is not None else None
+
+    value = fields['DateTimeOriginal'] or fields['CreateDate']
+    if value is None:
+        return None
+    try:
+        date = datetime.strptime(value[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        # zeroed or garbled dates
+        return None
+
+    if fields['format'] == 'quicktime':
+        return date.replace(tzinfo=timezone.utc).astimezone(tzla)
+    return date.replace(tzinfo=tzla)
+
+
+def _new_fields(fmt):
+    return {'format': fmt,
+            'DateTimeOriginal': None,
+            'CreateDate': None,
+            'Model': None,
+            'ImageDescription': None,
+            }
+
+
+def _read_jpeg(buf):
+    """
+    Find the Exif APP1 segment of a JPEG and parse it
+    """
+    import struct
+
+    fields = _new_fields('jpeg')
+    pos = 2
+    while pos + 4 <= len(buf):
+        if buf[pos] != 0xFF:
+            raise ValueError('Lost JPEG marker sync')
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            # end of image or start of scan; the metadata is all before it
+            break
+        length = struct.unpack_from('>H', buf, pos + 2)[0]
+        if marker == 0xE1 and buf[pos + 4:pos + 10] == b'Exif\x00\x00':
+            _read_tiff(buf, pos + 10, fields)
+            break
+        pos += 2 + length
+
+    return fields
+
+
+def _read_tiff(buf, base, fields):
+    """
+    Parse the fields out of a TIFF structure starting at base
+    """
+    import struct
+
+    if buf[base:base + 2] == b'II':
+        order = '<'
+    elif buf[base:base + 2] == b'MM':
+        order = '>'
+    else:
+        raise ValueError('Not a TIFF header')
+
+    ifd0 = _read_ifd(buf, base, struct.unpack_from(order + 'I', buf, base + 4)[0], order)
+    fields['ImageDescription'] = ifd0.get(TAG_IMAGE_DESCRIPTION)
+    fields['Model'] = ifd0.get(TAG_MODEL)
+
+    if TAG_EXIF_IFD in ifd0:
+        exif = _read_ifd(buf, base, ifd0[TAG_EXIF_IFD], order)
+        fields['DateTimeOriginal'] = exif.get(TAG_DATE_TIME_ORIGINAL)
+        fields['CreateDate'] = exif.get(TAG_CREATE_DATE)
+
+    return fields
+
+
+def _read_ifd(buf, base, offset, order):
+    """
+    Read the ASCII and LONG entries of an IFD
+    """
+    import struct
+
+    values = {}
+    count = struct.unpack_from(order + 'H', buf, base + offset)[0]
+    for idx in range(count):
+        entry = base + offset + 2 + 12 * idx
+        tag, kind, length = struct.unpack_from(order + 'HHI', buf, entry)
+        if kind == 2:
+            # ASCII, stored in the entry itself when it fits in 4 bytes
+            start = entry + 8 if length <= 4 else base + struct.unpack_from(order + 'I', buf, entry + 8)[0]
+            raw = bytes(buf[start:start + length]).split(b'\x00', 1)[0]
+            values[tag] = raw.decode('utf-8', errors='replace')
+        elif kind == 4 and length == 1:
+            values[tag] = struct.unpack_from(order + 'I', buf, entry + 8)[0]
+
+    return values
+
+
+def _boxes(buf, start, end):
+    """
+    Iterate over the ISO base media boxes between start and end
+
+    Yields the type, the start of the payload and the end of each box
+    """
+    import struct
+
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            raise ValueError('Malformed box')
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _find_box(buf, start, end, kind):
+    for box, payload, box_end in _boxes(buf, start, end):
+        if box == kind:
+            return payload, box_end
+    return None
+
+
+def _read_heif(buf):
+    """
+    Locate the Exif item of a HEIF file and parse it
+    """
+    import struct
+
+    fields = _new_fields('heif')
+    meta = _heif_meta(buf)
+    if meta is None:
+        return fields
+    start, end = meta
+
+    # find the id of the Exif item
+    exif_id = None
+    for item_id, item_type in _heif_item_types(buf, start, end).items():
+        if item_type == b'Exif':
+            exif_id = item_id
+            break
+    if exif_id is None:
+        return fields
+
+    extents = _heif_extents(buf, _find_box(buf, start, end, b'iloc')).get(exif_id)
+    if not extents:
+        return fields
+    location = extents[0][0]
+
+    # the item starts with the offset to the TIFF header
+    offset = struct.unpack_from('>I', buf, location)[0]
+    return _read_tiff(buf, location + 4 + offset, fields)
+
+
+def heif_image_extents(buf):
+    """
+    Locate the coded data of the primary image of a HEIF file
+
+    A HEIF photo stores its image as HEVC coded data, either as a single item
+    or as a grid of tile items. Nothing outside that data, such as the Exif
+    or XMP items, affects the decoded pixels.
+
+    Arguments
+    ---------
+    buf : buffer
+        The contents of the file
+
+    Returns
+    -------
+    list | None
+        The (offset, length) of each extent of coded data, tile by tile in
+        grid order, or None when the layout is not handled (no primary item,
+        data stored in the idat box, or a derivation other than a grid)
+
+    """
+    import struct
+
+    meta = _heif_meta(buf)
+    if meta is None:
+        return None
+    start, end = meta
+
+    pitm = _find_box(buf, start, end, b'pitm')
+    if pitm is None:
+        return None
+    if buf[pitm[0]] == 0:
+        primary = struct.unpack_from('>H', buf, pitm[0] + 4)[0]
+    else:
+        primary = struct.unpack_from('>I', buf, pitm[0] + 4)[0]
+
+    types = _heif_item_types(buf, start, end)
+    if types.get(primary) == b'grid':
+        items = _heif_references(buf, _find_box(buf, start, end, b'iref'), b'dimg').get(primary)
+    elif primary in types:
+        items = [primary]
+    else:
+        items = None
+    if not items or any(types.get(item) not in (b'hvc1', b'av01') for item in items):
+        return None
+
+    extents = _heif_extents(buf, _find_box(buf, start, end, b'iloc'))
+    result = []
+    for item in items:
+        if not extents.get(item):
+            return None
+        result += extents[item]
+    return result
+
+
+def _heif_meta(buf):
+    """
+    The start and end of the contents of the meta box
+    """
+    meta = _find_box(buf, 0, len(buf), b'meta')
+    if meta is None:
+        return None
+    # meta is a full box; skip version and flags
+    return meta[0] + 4, meta[1]
+
+
+def _heif_item_types(buf, start, end):
+    """
+    The type of each item listed in the iinf box
+    """
+    import struct
+
+    types = {}
+    iinf = _find_box(buf, start, end, b'iinf')
+    if iinf is None:
+        return types
+    version = buf[iinf[0]]
+    entries = iinf[0] + (6 if version == 0 else 8)
+    for box, payload, box_end in _boxes(buf, entries, iinf[1]):
+        if box != b'infe' or buf[payload] < 2:
+            continue
+        if buf[payload] == 2:
+            item_id = struct.unpack_from('>H', buf, payload + 4)[0]
+            types[item_id] = bytes(buf[payload + 8:payload + 12])
+        else:
+            item_id = struct.unpack_from('>I', buf, payload + 4)[0]
+            types[item_id] = bytes(buf[payload + 10:payload + 14])
+    return types
+
+
+def _heif_references(buf, iref, kind):
+    """
+    The items each item refers to with a given reference type
+    """
+    import struct
+
+    references = {}
+    if iref is None:
+        return references
+    fmt, size = ('>H', 2) if buf[iref[0]] == 0 else ('>I', 4)
+    for box, payload, box_end in _boxes(buf, iref[0] + 4, iref[1]):
+        if box != kind:
+            continue
+        from_id = struct.unpack_from(fmt, buf, payload)[0]
+        count = struct.unpack_from('>H', buf, payload + size)[0]
+        pos = payload + size + 2
+        references[from_id] = [struct.unpack_from(fmt, buf, pos + idx * size)[0] for idx in range(count)]
+    return references
+
+
+def _heif_extents(buf, iloc):
+    """
+    The file extents of each item stored in the file, from the iloc box
+
+    Returns
+    -------
+    dict
+        The list of (offset, length) of each item. Items stored in the idat
+        box or in other files are left out.
+
+    """
+    import struct
+
+    if iloc is None:
+        return {}
+
+    def read_sized(pos, size):
+        if size == 0:
+            return 0, pos
+        fmt = {4: '>I', 8: '>Q'}[size]
+        return struct.unpack_from(fmt, buf, pos)[0], pos + size
+
+    pos = iloc[0]
+    version = buf[pos]
+    offset_size, length_size = buf[pos + 4] >> 4, buf[pos + 4] & 0x0F
+    base_offset_size, index_size = buf[pos + 5] >> 4, buf[pos + 5] & 0x0F
+    pos += 6
+    if version < 2:
+        count = struct.unpack_from('>H', buf, pos)[0]
+        pos += 2
+    else:
+        count = struct.unpack_from('>I', buf, pos)[0]
+        pos += 4
+
+    items = {}
+    for idx in range(count):
+        if version < 2:
+            current = struct.unpack_from('>H', buf, pos)[0]
+            pos += 2
+        else:
+            current = struct.unpack_from('>I', buf, pos)[0]
+            pos += 4
+        method = 0
+        if version in (1, 2):
+            method = struct.unpack_from('>H', buf, pos)[0] & 0x0F
+            pos += 2
+        # data reference index
+        reference = struct.unpack_from('>H', buf, pos)[0]
+        pos += 2
+        base_offset, pos = read_sized(pos, base_offset_size)
+        extents = struct.unpack_from('>H', buf, pos)[0]
+        pos += 2
+        found = []
+        for extent in range(extents):
+            if version in (1, 2) and index_size > 0:
+                _, pos = read_sized(pos, index_size)
+            extent_offset, pos = read_sized(pos, offset_size)
+            extent_length, pos = read_sized(pos, length_size)
+            offset = base_offset + extent_offset
+            # a zero length runs to the end of the file
+            found.append((offset, extent_length if extent_length > 0 else len(buf) - offset))
+        if method == 0 and reference == 0:
+            items[current] = found
+
+    return items
+
+
+def _read_quicktime(buf):
+    """
+    Read the creation date and the model from the moov atom
+    """
+    import struct
+    from datetime import datetime, timedelta, timezone
+
+    fields = _new_fields('quicktime')
+    moov = _find_box(buf, 0, len(buf), b'moov')
+    if moov is None:
+        return fields
+
+    def header_time(payload):
+        if buf[payload] == 1:
+            seconds = struct.unpack_from('>Q', buf, payload + 4)[0]
+        else:
+            seconds = struct.unpack_from('>I', buf, payload + 4)[0]
+        if seconds == 0:
+            # never set
+            return None
+        date = datetime(1904, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=seconds)
+        return date.strftime('%Y:%m:%d %H:%M:%S')
+
+    mvhd = _find_box(buf, *moov, b'mvhd')
+    if mvhd is not None:
+        fields['CreateDate'] = header_time(mvhd[0])
+    if fields['CreateDate'] is None:
+        # fall back on the media header of the first track that has one
+        for box, payload, end in _boxes(buf, *moov):
+            if box != b'trak':
+                continue
+            mdia = _find_box(buf, payload, end, b'mdia')
+            mdhd = _find_box(buf, *mdia, b'mdhd') if mdia is not None else None
+            if mdhd is not None:
+                fields['CreateDate'] = header_time(mdhd[0])
+                break
+
+    meta = _find_box(buf, *moov, b'meta')
+    if meta is not None:
+        keys = _quicktime_keys(buf, meta)
+        fields['Model'] = keys.get('com.apple.quicktime.model')
+
+    return fields
+
+
+def _quicktime_keys(buf, meta):
+    """
+    Read the string values of an Apple metadata keys/ilst pair
+    """
+    import struct
+
+    start, end = meta
+    # in QuickTime files meta is a plain box, in MP4 files a full box
+    if buf[start + 4:start + 8] != b'hdlr':
+        start += 4
+
+    names = []
+    keys = _find_box(buf, start, end, b'keys')
+    if keys is not None:
+        pos = keys[0] + 8
+        for box, payload, box_end in _boxes(buf, pos, keys[1]):
+            # each key is a box whose type is the namespace
+            names.append(bytes(buf[payload:box_end]).decode('utf-8', errors='replace'))
+
+    values = {}
+    ilst = _find_box(buf, start, end, b'ilst')
+    if ilst is None:
+        return values
+    for box, payload, box_end in _boxes(buf, *ilst):
+        index = struct.unpack('>I', box)[0]
+        if not 1 <= index <= len(names):
+            continue
+        data = _find_box(buf, payload, box_end, b'data')
+        if data is None:
+            continue
+        # type 1 is UTF-8 text
+        if struct.unpack_from('>I', buf, data[0])[0] == 1:
+            values[names[index - 1]] = bytes(buf[data[0] + 8:data[1]]).decode('utf-8', errors='replace')
+
+    return values
@@ -0,0 +1,173 @@
+"""
+Boolean tag queries against the repository catalog
+
+Queries are answered from the tag index of the catalog, without opening any
+image. The query language is
+
+    travel and karen          both tags (and is implied between terms)
+    travel or sailing         either tag
+    not work                  every file without the tag
+    trav*                     any tag starting with trav
+    "mult word"               a tag containing spaces
+    (home or travel) not work parentheses group terms
+
+Only the files recorded in the catalog are searched. Files placed in the
+repository before it had a catalog, or tagged by other tools, are missing
+from the index until `photo catalog rebuild` records them with the tags
+embedded in them.
+"""
+
+
+def tokenize(query):
+    """
+    Split a query into tags, operators and parentheses
+
+    Arguments
+    ---------
+    query : str
+        The query text
+
+    Returns
+    -------
+    list
+        The tokens. Quoted tags are returned without the quotes, as a tuple of
+        ('tag', text) so they are never mistaken for operators.
+
+    """
+    import re
+
+    tokens = []
+    for match in re.finditer(r'"([^"]*)"|(\()|(\))|([^\s()"]+)', query):
+        quoted, lparen, rparen, word = match.groups()
+        if quoted is not None:
+            tokens.append(('tag', quoted))
+        elif lparen or rparen:
+            tokens.append(lparen or rparen)
+        elif word.lower() in ('and', 'or', 'not'):
+            tokens.append(word.lower())
+        else:
+            tokens.append(('tag', word))
+    return tokens
+
+
+def parse_query(query):
+    """
+    Parse a query into an expression tree
+
+    Arguments
+    ---------
+    query : str
+        The query text
+
+    Returns
+    -------
+    tuple
+        The expression, made of ('tag', name), ('prefix', name),
+        ('not', expr), ('and', left, right) and ('or', left, right) nodes
+
+    """
+    tokens = tokenize(query)
+    if len(tokens) == 0:
+        raise ValueError('Empty query')
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        if pos == len(tokens):
+            raise ValueError('Malformed query: unexpected end')
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        expr = parse_and()
+        while peek() == 'or':
+            take()
+            expr = ('or', expr, parse_and())
+        return expr
+
+    def parse_and():
+        expr = parse_not()
+        while peek() not in (None, 'or', ')'):
+            if peek() == 'and':
+                take()
+            expr = ('and', expr, parse_not())
+        return expr
+
+    def parse_not():
+        if peek() == 'not':
+            take()
+            return ('not', parse_not())
+        return parse_atom()
+
+    def parse_atom():
+        token = take()
+        if token == '(':
+            expr = parse_or()
+            if peek() != ')':
+                raise ValueError('Unbalanced parentheses in query')
+            take()
+            return expr
+        if not isinstance(token, tuple):
+            raise ValueError('Malformed query: expected a tag, found {0}'.format(token))
+        name = token[1]
+        if name.endswith('*'):
+            return ('prefix', name[:-1])
+        return ('tag', name)
+
+    expr = parse_or()
+    if pos != len(tokens):
+        raise ValueError('Malformed query: unexpected {0}'.format(tokens[pos]))
+    return expr
+
+
+def evaluate(expr, catalog):
+    """
+    Evaluate an expression tree against a catalog
+
+    Returns
+    -------
+    set
+        The matching files, relative to the repository
+
+    """
+    op = expr[0]
+    if op == 'tag':
+        return catalog.tagged(expr[1])
+    elif op == 'prefix':
+        return catalog.tagged(expr[1], prefix=True)
+    elif op == 'not':
+        return catalog.paths() - evaluate(expr[1], catalog)
+    elif op == 'and':
+        # a negated right hand side is a difference, no need for the universe
+        if expr[2][0] == 'not':
+            return evaluate(expr[1], catalog) - evaluate(expr[2][1], catalog)
+        return evaluate(expr[1], catalog) & evaluate(expr[2], catalog)
+    elif op == 'or':
+        return evaluate(expr[1], catalog) | evaluate(expr[2], catalog)
+    else:
+        raise ValueError('Unknown query operation "{0}"'.format(op))
+
+
+def search(query, catalog):
+    """
+    Find the repository files matching a tag query
+
+    Arguments
+    ---------
+    query : str
+        The query, for example 'travel and karen not work'
+
+    catalog : Catalog
+        The catalog of the repository to search
+
+    Returns
+    -------
+    list
+        The sorted paths of the matching files
+
+    """
+    matches = evaluate(parse_query(query), catalog)
+    return sorted(catalog.repo_path / path for path in matches)
@@ -0,0 +1,383 @@
+"""
+Perceptual near-duplicate detection
+
+The content checksum only matches photos with identical pixels. A copy that
+was re-encoded, resized or lightly edited has other pixels, but the same
+coarse structure, so its perceptual hash differs from the original in only a
+few of its 64 bits.
+
+Two perceptual hashes are available:
+
+- dhash compares each pixel of a 9x8 grayscale reduction with its right
+  neighbour. It is cheap and robust to scaling and recompression.
+- phash keeps the sign of the lowest 8x8 frequencies of the DCT of a 32x32
+  grayscale reduction, relative to their median. It also survives gamma and
+  contrast changes.
+
+Both start from a reduced decode, so a photo is never decoded at full size.
+
+Near duplicates are found by multi-index hashing. The 64 bits are split into
+distance + 1 blocks; two hashes within the distance must agree exactly on at
+least one block, so only the hashes sharing a block value with the query are
+compared in full. A query over 100k photos looks at a few hundred candidates
+instead of every photo.
+"""
+
+# the perceptual hashes available, kept with the command line choices
+from .choices import SIMILAR_SCHEMES as SCHEMES
+
+# the number of bits in a perceptual hash
+HASH_BITS = 64
+
+# the largest Hamming distance at which two photos are reported as similar
+DISTANCE = 6
+
+# the rows of a large bucket compared at once, bounding the memory of a scan
+BUCKET_ROWS = 1024
+
+
+def _gray(filename, width, height):
+    """
+    Decode a photo as a small upright grayscale array
+    """
+    import numpy as np
+    from PIL import Image, ImageOps
+    from .thumbs import open_image
+
+    with open_image(filename) as img:
+        # a reduced decode; a no-op for formats other than JPEG
+        img.draft('L', (4 * width, 4 * height))
+        img = ImageOps.exif_transpose(img).convert('L')
+        img = img.resize((width, height), Image.Resampling.LANCZOS)
+        return np.asarray(img, dtype=np.float64)
+
+
+def _pack(bits):
+    """
+    The integer whose bits, most significant first, are the flattened bits
+    """
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(filename):
+    """
+    Compute the difference hash of a photo
+
+    Arguments
+    ---------
+    filename : str
+        The photo
+
+    Returns
+    -------
+    int
+        The 64 bit hash
+
+    """
+    pixels = _gray(filename, 9, 8)
+    return _pack(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(filename):
+    """
+    Compute the DCT based perceptual hash of a photo
+
+    Arguments
+    ---------
+    filename : str
+        The photo
+
+    Returns
+    -------
+    int
+        The 64 bit hash
+
+    """
+    import numpy as np
+
+    pixels = _gray(filename, 32, 32)
+    # the orthogonal DCT-II matrix, applied along both axes
+    n = np.arange(32)
+    dct = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / 64)
+    low = (dct @ pixels @ dct.T)[:8, :8]
+    # the DC term only carries the mean brightness
+    median = np.median(low.ravel()[1:])
+    return _pack(low > median)
+
+
+def perceptual_hash(filename, scheme='dhash'):
+    """
+    Compute a perceptual hash of a photo
+
+    Arguments
+    ---------
+    filename : str
+        The photo
+
+    Keyword Arguments
+    -----------------
+    scheme : str
+        'dhash' or 'phash'
+
+    Returns
+    -------
+    int
+        The 64 bit hash
+
+    """
+    if scheme == 'dhash':
+        return dhash(filename)
+    elif scheme == 'phash':
+        return phash(filename)
+    raise ValueError(f'Unrecognized perceptual hash, "{scheme}"')
+
+
+def popcount(values):
+    """
+    Count the set bits of each element of an array of uint64
+    """
+    import numpy as np
+
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    table = np.array([bin(idx).count('1') for idx in range(256)], dtype=np.uint8)
+    return table[np.ascontiguousarray(values).view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+class HammingIndex:
+    """
+    A multi-index over 64 bit hashes for Hamming distance searches
+
+    Arguments
+    ---------
+    hashes : list
+        The hashes to index, as integers
+
+    Keyword Arguments
+    -----------------
+    distance : int
+        The largest distance the index is searched with
+
+    """
+
+    def __init__(self, hashes, distance=DISTANCE):
+        import numpy as np
+
+        if not 0 <= distance < HASH_BITS:
+            raise ValueError(f'The distance must be between 0 and {HASH_BITS - 1}')
+        self.distance = distance
+        self.hashes = np.array(hashes, dtype=np.uint64)
+
+        # split the bits into distance + 1 nearly equal blocks
+        count = distance + 1
+        widths = [HASH_BITS // count + (idx < HASH_BITS % count) for idx in range(count)]
+        self.blocks = []
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self.blocks.append((np.uint64(shift), np.uint64((1 << width) - 1)))
+
+        # the ids of the hashes sorted on each block value
+        self._keys = []
+        self._order = []
+        for shift, mask in self.blocks:
+            keys = (self.hashes >> shift) & mask
+            order = np.argsort(keys, kind='stable')
+            self._keys.append(keys[order])
+            self._order.append(order)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def query(self, value, distance=None):
+        """
+        Find the hashes within a distance of a value
+
+        Arguments
+        ---------
+        value : int
+            The hash to search for
+
+        Keyword Arguments
+        -----------------
+        distance : int
+            The largest distance reported. Defaults to, and may not exceed,
+            the distance of the index.
+
+        Returns
+        -------
+        list
+            The (distance, id) of each match, nearest first, where id is the
+            position of the hash in the indexed list
+
+        """
+        import numpy as np
+
+        distance = self._check(distance)
+        value = np.uint64(value)
+
+        candidates = []
+        for (shift, mask), keys, order in zip(self.blocks, self._keys, self._order):
+            key = (value >> shift) & mask
+            lo = np.searchsorted(keys, key, side='left')
+            hi = np.searchsorted(keys, key, side='right')
+            candidates.append(order[lo:hi])
+        candidates = np.unique(np.concatenate(candidates))
+
+        dists = popcount(self.hashes[candidates] ^ value)
+        keep = dists <= distance
+        return sorted(zip(dists[keep].tolist(), candidates[keep].tolist()))
+
+    def pairs(self, distance=None):
+        """
+        Find every pair of hashes within a distance of each other
+
+        Keyword Arguments
+        -----------------
+        distance : int
+            The largest distance reported. Defaults to, and may not exceed,
+            the distance of the index.
+
+        Returns
+        -------
+        set
+            The (id, id) of each pair, lowest id first
+
+        """
+        import numpy as np
+
+        distance = self._check(distance)
+
+        found = set()
+        for keys, order in zip(self._keys, self._order):
+            # the runs of hashes sharing this block value
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            ends = np.r_[starts[1:], len(keys)]
+            for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+                ids = order[start:end]
+                bucket = self.hashes[ids]
+                for row in range(0, len(ids), BUCKET_ROWS):
+                    dists = popcount(bucket[row:row + BUCKET_ROWS, None] ^ bucket[None, :])
+                    left, right = np.nonzero(dists <= distance)
+                    left = ids[left + row]
+                    right = ids[right]
+                    below = left < right
+                    found.update(zip(left[below].tolist(), right[below].tolist()))
+
+        return found
+
+    def _check(self, distance):
+        if distance is None:
+            return self.distance
+        if not 0 <= distance <= self.distance:
+            raise ValueError(f'The distance may not exceed the distance of the index, {self.distance}')
+        return distance
+
+
+def group_pairs(pairs):
+    """
+    Merge pairs of ids into groups of connected ids
+
+    Returns
+    -------
+    list
+        The sorted ids of each group
+    """
+    parent = {}
+
+    def root(idx):
+        while parent.setdefault(idx, idx) != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    for left, right in pairs:
+        parent[root(left)] = root(right)
+
+    groups = {}
+    for idx in parent:
+        groups.setdefault(root(idx), []).append(idx)
+    return sorted(sorted(group) for group in groups.values())
+
+
+def _hash_job(job):
+    """
+    Hash one photo in a worker process, reporting failures as text
+    """
+    filename, scheme = job
+    try:
+        return perceptual_hash(filename, scheme), None
+    except Exception as err:
+        return None, f"{filename}: {err}"
+
+
+def index_photos(photos, catalog, scheme='dhash', jobs=None):
+    """
+    Record the perceptual hash of the photos missing one in the catalog
+
+    Hashes are stored by content checksum, so each photo is only hashed once
+    however many copies of it the repository holds.
+
+    Arguments
+    ---------
+    photos : iterable
+        The (path, checksum) of each photo. Paths that are not photos are
+        ignored.
+
+    catalog : Catalog
+        The catalog of the repository
+
+    Keyword Arguments
+    -----------------
+    scheme : str
+        'dhash' or 'phash'
+
+    jobs : int
+        The number of worker processes. Defaults to the number of cores.
+
+    Returns
+    -------
+    tuple
+        The number of photos hashed and the list of failures
+
+    """
+    import multiprocessing
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    from pathlib import Path
+    from .ingest import PHOTO_EXT
+
+    known = catalog.perceptual_hashes(scheme)
+    todo = {}
+    for path, checksum in photos:
+        if checksum is None or checksum in known or Path(path).suffix.upper() not in PHOTO_EXT:
+            continue
+        todo.setdefault(checksum, (str(path), scheme))
+
+    if len(todo) == 0:
+        return 0, []
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(todo))
+    if jobs == 1:
+        results = [_hash_job(job) for job in todo.values()]
+    else:
+        # forking a process full of threads is not safe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+            results = list(executor.map(_hash_job, todo.values(), chunksize=8))
+
+    hashes = {}
+    failures = []
+    for checksum, (value, failure) in zip(todo, results):
+        if failure is None:
+            hashes[checksum] = value
+        else:
+            failures.append(failure)
+    catalog.set_perceptual_hashes(scheme, hashes)
+
+    return len(hashes), failures
@@ -0,0 +1,247 @@
+"""
+Per-stage timing and counters
+
+The ingest records the wall time, call count and bytes of each of its stages
+(walk, hash, date, exists, copy and exiftool) into the active Stats object.
+When no Stats is active, `stage` does nothing, so the instrumentation costs a
+function call when it is not used.
+
+Stages run concurrently in several workers, so the seconds of a stage are the
+busy time summed over its workers and may add up to more than the elapsed
+time of the ingest.
+"""
+
+# the stages recorded by photo add, in pipeline order, kept with the command
+# line choices
+from .choices import STAGES
+
+# the Stats object collecting measurements, if any
+_active = None
+
+
+class Stats:
+    """
+    Wall time, call count and bytes per stage
+
+    A profiler can be attached to a single stage; it is then enabled only
+    around the calls of that stage. Profiled calls are serialized, since a
+    profiler follows one thread at a time.
+    """
+
+    def __init__(self):
+        import threading
+        import time
+
+        self.start_time = time.perf_counter()
+        self.elapsed = None
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._profilers = {}
+        self._profile_lock = threading.RLock()
+
+    def attach_profiler(self, name, profiler):
+        """
+        Profile the calls of a single stage
+
+        Arguments
+        ---------
+        name : str
+            The stage to profile
+
+        profiler : object
+            A profiler with enable() and disable() methods, such as
+            cProfile.Profile, or start() and stop() methods, such as
+            pyinstrument.Profiler
+
+        """
+        if hasattr(profiler, 'enable'):
+            self._profilers[name] = (profiler.enable, profiler.disable)
+        else:
+            self._profilers[name] = (profiler.start, profiler.stop)
+
+    def record(self, name, seconds, nbytes=0, calls=1):
+        """
+        Add a measurement to a stage
+        """
+        with self._lock:
+            entry = self._stages.setdefault(name, [0, 0.0, 0])
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] += nbytes
+
+    def finish(self):
+        """
+        Stop the elapsed time clock
+        """
+        import time
+
+        self.elapsed = time.perf_counter() - self.start_time
+
+    def as_dict(self):
+        """
+        The measurements as a dictionary
+
+        Returns
+        -------
+        dict
+            The elapsed seconds, and the calls, seconds and bytes of each
+            stage that ran
+
+        """
+        import time
+
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.start_time
+        with self._lock:
+            names = [name for name in STAGES if name in self._stages]
+            names += sorted(name for name in self._stages if name not in STAGES)
+            stages = {name: dict(zip(['calls', 'seconds', 'bytes'], self._stages[name])) for name in names}
+
+        return {'elapsed': elapsed, 'stages': stages}
+
+    def to_json(self):
+        import json
+        return json.dumps(self.as_dict(), indent=2)
+
+    def to_prometheus(self, prefix='photo_add'):
+        """
+        The measurements in the Prometheus text exposition format
+        """
+        result = self.as_dict()
+        lines = [f"# HELP {prefix}_elapsed_seconds Elapsed time of the run",
+                 f"# TYPE {prefix}_elapsed_seconds gauge",
+                 f"{prefix}_elapsed_seconds {result['elapsed']}",
+                 ]
+        for field, help_text in [('calls', 'Calls of each stage'),
+                                 ('seconds', 'Busy time of each stage summed over workers'),
+                                 ('bytes', 'Bytes processed by each stage')]:
+            metric = f"{prefix}_stage_{field}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, entry in result['stages'].items():
+                lines.append(f'{metric}{{stage="{name}"}} {entry[field]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def to_text(self):
+        """
+        The measurements as a table for the screen
+        """
+        result = self.as_dict()
+        lines = ["", "Stages", "======",
+                 f"{'stage':10s} {'calls':>8s} {'seconds':>10s} {'MB':>10s} {'MB/s':>8s}"]
+        for name, entry in result['stages'].items():
+            rate = entry['bytes'] / 1e6 / entry['seconds'] if entry['seconds'] > 0 else 0.0
+            lines.append(f"{name:10s} {entry['calls']:8d} {entry['seconds']:10.3f} "
+                         f"{entry['bytes'] / 1e6:10.1f} {rate:8.1f}")
+        lines.append(f"Elapsed {result['elapsed']:.3f} s")
+
+        return '\n'.join(lines)
+
+    def export(self, fmt):
+        """
+        Format the measurements as 'text', 'json' or 'prometheus'
+        """
+        if fmt == 'json':
+            return self.to_json()
+        elif fmt == 'prometheus':
+            return self.to_prometheus()
+        elif fmt == 'text':
+            return self.to_text()
+        raise ValueError('Unrecognized stats format "{0}"'.format(fmt))
+
+
+def collect(stats):
+    """
+    Make stats the active collector for the duration of a with block
+
+    Returns
+    -------
+    context manager
+        Yields stats, and stops its elapsed time clock on exit
+
+    """
+    from contextlib import contextmanager
+
+    @contextmanager
+    def activate():
+        global _active
+        previous, _active = _active, stats
+        try:
+            yield stats
+        finally:
+            _active = previous
+            stats.finish()
+
+    return activate()
+
+
+def stage(name, nbytes=0):
+    """
+    Time a block of code as part of a stage
+
+    Arguments
+    ---------
+    name : str
+        The stage
+
+    Keyword Arguments
+    -----------------
+    nbytes : int
+        The number of bytes the block processes
+
+    Returns
+    -------
+    context manager
+        Does nothing when no Stats is active
+
+    """
+    from contextlib import nullcontext
+
+    stats = _active
+    if stats is None:
+        return nullcontext()
+    return _Timer(stats, name, nbytes)
+
+
+def timed_iter(iterable, name):
+    """
+    Record the time taken to produce each item of an iterable as a stage
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class _Timer:
+    """
+    Times one call of a stage, running its profiler if one is attached
+    """
+
+    def __init__(self, stats, name, nbytes):
+        self.stats = stats
+        self.name = name
+        self.nbytes = nbytes
+        self.profiler = stats._profilers.get(name)
+
+    def __enter__(self):
+        import time
+
+        if self.profiler is not None:
+            self.stats._profile_lock.acquire()
+            self.profiler[0]()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        import time
+
+        seconds = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler[1]()
+            self.stats._profile_lock.release()
+        self.stats.record(self.name, seconds, self.nbytes)
@@ -0,0 +1,334 @@
+"""
+Tag storage backends
+
+Tags are stored in the ImageDescription field of each file. Changing them
+with exiftool rewrites the whole file, so retagging a 4 GB video means 4 GB
+of writes and a fresh copy in every backup. Two other backends defer those
+writes:
+
+- sidecar keeps the tags of a file in an XMP sidecar next to it, named after
+  the file with .xmp appended, in the dc:description field that exiftool maps
+  to ImageDescription.
+- catalog keeps the tags of repository files in the catalog only, marked as
+  pending. Files outside the repository are written in place.
+
+Tags held by a backend take precedence over the embedded ones when read.
+`photo tags sync` flushes them into the files in batches and drops the
+sidecars or pending marks, so the rewrites can be scheduled off-hours.
+
+The backend is chosen by the tags backend setting of the configuration file.
+"""
+
+# the ways tags can be stored, kept with the command line choices
+from .choices import TAG_BACKENDS as BACKENDS
+
+# the extension appended to the name of a file for its sidecar
+SIDECAR_EXT = '.xmp'
+
+XMP_NS = {'x': 'adobe:ns:meta/',
+          'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+          'dc': 'http://purl.org/dc/elements/1.1/',
+          'xml': 'http://www.w3.org/XML/1998/namespace',
+          }
+
+
+def resolve_backend(backend=None):
+    """
+    The tag backend to use, by default the one of the configuration file
+    """
+    if backend is None:
+        from .config import get_global_config
+
+        cfg = get_global_config()
+        backend = cfg.get("tags", {}).get("backend", "embedded") if cfg else "embedded"
+    if backend not in BACKENDS:
+        raise ValueError(f'Unrecognized tag backend, "{backend}"')
+    return backend
+
+
+def sidecar_path(filename):
+    """
+    The XMP sidecar of a file
+    """
+    from pathlib import Path
+
+    return Path(str(filename) + SIDECAR_EXT)
+
+
+def remove_sidecar(filename):
+    """
+    Remove the sidecar of a file that is being removed, so it is not left
+    behind without its file
+
+    Returns
+    -------
+    bool
+        True if there was a sidecar
+
+    """
+    try:
+        sidecar_path(filename).unlink()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def read_sidecar(filename):
+    """
+    Read the tags held in the sidecar of a file
+
+    Arguments
+    ---------
+    filename : str
+        The photo or video, not the sidecar
+
+    Returns
+    -------
+    list | None
+        The tags, or None if the file has no sidecar
+
+    """
+    import xml.etree.ElementTree as ET
+    from .exif import split_tags
+
+    try:
+        root = ET.parse(sidecar_path(filename)).getroot()
+    except FileNotFoundError:
+        return None
+    item = root.find('.//dc:description//rdf:li', XMP_NS)
+    return split_tags(item.text or '') if item is not None else []
+
+
+def write_sidecar(filename, tags):
+    """
+    Store the tags of a file in its sidecar
+
+    The sidecar is written under a temporary name and renamed into place.
+    """
+    import os
+    import xml.etree.ElementTree as ET
+
+    for prefix, uri in XMP_NS.items():
+        if prefix != 'xml':
+            ET.register_namespace(prefix, uri)
+
+    def tag(name):
+        prefix, local = name.split(':')
+        return f'{{{XMP_NS[prefix]}}}{local}'
+
+    root = ET.Element(tag('x:xmpmeta'))
+    rdf = ET.SubElement(root, tag('rdf:RDF'))
+    description = ET.SubElement(rdf, tag('rdf:Description'), {tag('rdf:about'): ''})
+    alt = ET.SubElement(ET.SubElement(description, tag('dc:description')), tag('rdf:Alt'))
+    ET.SubElement(alt, tag('rdf:li'), {tag('xml:lang'): 'x-default'}).text = ','.join(tags)
+
+    path = sidecar_path(filename)
+    partial = path.with_name('.' + path.name + '.partial')
+    with open(partial, 'w', encoding='utf-8') as fid:
+        fid.write('<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n')
+        fid.write(ET.tostring(root, encoding='unicode'))
+        fid.write('\n<?xpacket end="w"?>\n')
+    os.replace(partial, path)
+
+
+def read_tags(filenames, backend=None):
+    """
+    Get the tags of many files through a backend
+
+    Files whose tags the backend does not hold are read from the files.
+
+    Arguments
+    ---------
+    filenames : list
+        The filenames of the photos and videos
+
+    Keyword Arguments
+    -----------------
+    backend : str
+        'embedded', 'sidecar' or 'catalog'. Defaults to the configured
+        backend.
+
+    Returns
+    -------
+    dict
+        The list of tags of each file, keyed by the filename as given. Files
+        that could not be read are left out.
+
+    """
+    import os
+    from . import exif
+    from .catalog import repository_catalog
+
+    backend = resolve_backend(backend)
+    filenames = [str(filename) for filename in filenames]
+
+    held = {}
+    if backend == 'sidecar':
+        for filename in filenames:
+            tags = read_sidecar(filename)
+            if tags is not None and os.path.exists(filename):
+                held[filename] = tags
+    elif backend == 'catalog':
+        catalog = repository_catalog()
+        if catalog is not None:
+            with catalog:
+                for filename in filenames:
+                    if catalog.contains(filename) and os.path.exists(filename):
+                        held[filename] = catalog.get_tags(os.path.abspath(filename))
+
+    remaining = [filename for filename in filenames if filename not in held]
+    result = exif.read_tags(remaining, backend='embedded') if remaining else {}
+    result.update(held)
+    return result
+
+
+def write_tags(tag_map, backend=None):
+    """
+    Set the tags of many files through a backend
+
+    Arguments
+    ---------
+    tag_map : dict
+        The list of tags to store for each file
+
+    Keyword Arguments
+    -----------------
+    backend : str
+        'embedded', 'sidecar' or 'catalog'. Defaults to the configured
+        backend.
+
+    Returns
+    -------
+    dict
+        True for each file whose tags were stored, False otherwise
+
+    """
+    import os
+    from . import exif
+    from .catalog import repository_catalog, sync_tag_map
+
+    backend = resolve_backend(backend)
+    # Make sure no comma characters are present in tags
+    tag_map = {str(filename): [tag.replace(',', '.') for tag in tags]
+               for filename, tags in tag_map.items()}
+
+    result = {}
+    if backend == 'sidecar':
+        for filename, tags in tag_map.items():
+            try:
+                if not os.path.exists(filename):
+                    raise FileNotFoundError(filename)
+                write_sidecar(filename, tags)
+                result[filename] = True
+            except OSError:
+                result[filename] = False
+        # Keep the tag index of the repository in step
+        sync_tag_map({filename: tag_map[filename] for filename, success in result.items() if success})
+    elif backend == 'catalog':
+        catalog = repository_catalog()
+        if catalog is not None:
+            with catalog:
+                for filename, tags in tag_map.items():
+                    if catalog.contains(filename):
+                        catalog.set_tags(os.path.abspath(filename), tags, pending=True)
+                        result[filename] = True
+
+    remaining = {filename: tags for filename, tags in tag_map.items() if filename not in result}
+    if remaining:
+        result.update(exif.write_tags(remaining, backend='embedded'))
+    return result
+
+
+def pending_tags(filenames=None, backend=None):
+    """
+    Find the tags held by a backend and not yet written to the files
+
+    Arguments
+    ---------
+    filenames : list
+        The files to look at. Defaults to the whole repository.
+
+    Keyword Arguments
+    -----------------
+    backend : str
+        'sidecar' or 'catalog'. Defaults to the configured backend.
+
+    Returns
+    -------
+    dict
+        The pending list of tags of each file
+
+    """
+    import os
+    from .catalog import repository_catalog
+    from .config import get_global_config
+    from .walker import scan_tree, WalkFilter
+
+    backend = resolve_backend(backend)
+    if backend == 'sidecar':
+        if filenames is None:
+            repo_path = get_global_config()["repo"]["path"]
+            filenames = [entry.path[:-len(SIDECAR_EXT)]
+                         for entry in scan_tree(repo_path, WalkFilter(extensions=[SIDECAR_EXT]))]
+        pending = {}
+        for filename in filenames:
+            tags = read_sidecar(filename)
+            if tags is not None and os.path.exists(filename):
+                pending[str(filename)] = tags
+        return pending
+
+    if backend == 'catalog':
+        catalog = repository_catalog()
+        if catalog is None:
+            return {}
+        with catalog:
+            pending = {str(path): tags for path, tags in catalog.pending_tags().items()}
+        if filenames is not None:
+            wanted = {os.path.abspath(filename): str(filename) for filename in filenames}
+            pending = {wanted[path]: tags for path, tags in pending.items() if path in wanted}
+        return pending
+
+    return {}
+
+
+def sync_tags(filenames=None, backend=None):
+    """
+    Write the tags held by a backend into the files
+
+    The files are written in batches by exiftool. The pending mark of each
+    file is dropped once its tags are read back from the file, as is its
+    sidecar unless it was changed again in the meantime.
+
+    Arguments
+    ---------
+    filenames : list
+        The files to flush. Defaults to the whole repository.
+
+    Keyword Arguments
+    -----------------
+    backend : str
+        'sidecar' or 'catalog'. Defaults to the configured backend.
+
+    Returns
+    -------
+    dict
+        True for each file whose tags were written, False otherwise
+
+    """
+    import os
+    from . import exif
+
+    backend = resolve_backend(backend)
+    pending = pending_tags(filenames, backend)
+    if len(pending) == 0:
+        return {}
+
+    # recording the written tags in the catalog clears their pending marks
+    written = exif.write_tags(pending, backend='embedded')
+
+    if backend == 'sidecar':
+        for filename, success in written.items():
+            if success and read_sidecar(filename) == pending[filename]:
+                os.unlink(sidecar_path(filename))
+
+    return written
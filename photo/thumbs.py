@@ -0,0 +1,187 @@
+"""
+Thumbnail cache
+
+Thumbnails are stored in the repository under .thumbnails, named after the
+content checksum of the photo and the thumbnail size:
+
+    <repo>/.thumbnails/<size>/<checksum[:2]>/<checksum>.jpg
+
+so copies of the same photo share a thumbnail, and a thumbnail never goes
+stale when a photo is renamed or its tags change.
+
+JPEG files are decoded with Pillow's draft mode, which lets the decoder scale
+the DCT blocks down by up to 8 and skips most of the work of a full decode.
+Thumbnails are made by a pool of processes, since decoding holds the GIL.
+"""
+
+# the name of the cache directory in the repository root
+THUMBS_NAME = '.thumbnails'
+
+# the longest side of a thumbnail in pixels
+THUMB_SIZE = 256
+
+# the JPEG quality of the thumbnails
+THUMB_QUALITY = 85
+
+
+def thumb_path(repo_path, checksum, size=THUMB_SIZE):
+    """
+    Locate the thumbnail of a photo
+
+    Arguments
+    ---------
+    repo_path : Path
+        The root of the photo repository
+
+    checksum : str
+        The content checksum of the photo
+
+    Keyword Arguments
+    -----------------
+    size : int
+        The longest side of the thumbnail in pixels
+
+    Returns
+    -------
+    Path
+        The path of the thumbnail, which may not exist yet
+
+    """
+    from pathlib import Path
+
+    return Path(repo_path) / THUMBS_NAME / str(size) / checksum[:2] / f"{checksum}.jpg"
+
+
+def open_image(filename):
+    """
+    Open a photo for reading, including HEIC files through pyheif
+    """
+    from pathlib import Path
+    from PIL import Image
+
+    if Path(filename).suffix.upper() == '.HEIC':
+        try:
+            import pyheif
+        except ImportError:
+            # a registered HEIF plugin such as pillow-heif may still open it
+            return Image.open(filename)
+        heif = pyheif.read(filename)
+        return Image.frombytes(heif.mode, heif.size, heif.data, 'raw', heif.mode, heif.stride)
+
+    return Image.open(filename)
+
+
+def make_thumbnail(filename, dest, size=THUMB_SIZE):
+    """
+    Write the thumbnail of a photo
+
+    Arguments
+    ---------
+    filename : str
+        The photo
+
+    dest : Path
+        Where to write the JPEG thumbnail. It is written under a temporary
+        name and renamed into place.
+
+    Keyword Arguments
+    -----------------
+    size : int
+        The longest side of the thumbnail in pixels
+
+    """
+    import os
+    from PIL import Image, ImageOps
+
+    with open_image(filename) as img:
+        # a reduced decode; a no-op for formats other than JPEG
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        os.makedirs(dest.parent, exist_ok=True)
+        partial = dest.with_name('.' + dest.name + '.partial')
+        img.save(partial, 'JPEG', quality=THUMB_QUALITY)
+        os.replace(partial, dest)
+
+
+def _thumbnail_job(job):
+    """
+    Make one thumbnail in a worker process, reporting failures as text
+    """
+    filename, dest, size = job
+    try:
+        make_thumbnail(filename, dest, size)
+    except Exception as err:
+        return f"{filename}: {err}"
+    return None
+
+
+def build_thumbnails(photos, repo_path, size=THUMB_SIZE, jobs=None, rebuild=False):
+    """
+    Fill the thumbnail cache
+
+    Arguments
+    ---------
+    photos : iterable
+        The (path, checksum) of each photo. Paths that are not photos are
+        ignored.
+
+    repo_path : Path
+        The root of the photo repository
+
+    Keyword Arguments
+    -----------------
+    size : int
+        The longest side of the thumbnails in pixels
+
+    jobs : int
+        The number of worker processes. Defaults to the number of cores.
+
+    rebuild : bool
+        Make the thumbnails again even if they exist
+
+    Returns
+    -------
+    tuple
+        The number of thumbnails made, the number already cached, and the
+        list of failures
+
+    """
+    import multiprocessing
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    from pathlib import Path
+    from .ingest import PHOTO_EXT
+
+    todo = {}
+    seen = set()
+    cached = 0
+    for path, checksum in photos:
+        if checksum is None or Path(path).suffix.upper() not in PHOTO_EXT or checksum in seen:
+            continue
+        seen.add(checksum)
+        dest = thumb_path(repo_path, checksum, size)
+        if not rebuild and dest.exists():
+            cached += 1
+            continue
+        todo[checksum] = (str(path), dest, size)
+
+    if len(todo) == 0:
+        return 0, cached, []
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(todo))
+    if jobs == 1:
+        results = [_thumbnail_job(job) for job in todo.values()]
+    else:
+        # forking a process full of threads is not safe
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+            results = list(executor.map(_thumbnail_job, todo.values(), chunksize=8))
+
+    failures = [result for result in results if result is not None]
+    return len(todo) - len(failures), cached, failures
@@ -0,0 +1,66 @@
+def expand_paths(specs):
+    """
+    Expand filenames, globs, directories and file lists into filenames
+
+    Arguments
+    ---------
+    specs : list
+        Each entry is one of:
+
+        - a filename,
+        - a glob such as 'album/*.jpg', expanded here so it works even when
+          quoted on the command line,
+        - a directory, standing for the non-hidden files directly inside it,
+        - '@list.txt', a file listing one filename per line.
+
+    Returns
+    -------
+    list
+        The filenames, in order and without repeats. Filenames that do not
+        exist are kept so the caller can report them.
+
+    """
+    import glob
+    import os
+
+    result = []
+    for spec in specs:
+        spec = str(spec)
+        if spec.startswith('@') and os.path.isfile(spec[1:]):
+            with open(spec[1:], 'r') as fid:
+                result += [line.strip() for line in fid if line.strip() != '']
+        elif os.path.isdir(spec):
+            result += sorted(entry.path for entry in os.scandir(spec)
+                             if entry.is_file() and not entry.name.startswith('.'))
+        elif has_magic(spec) and not os.path.exists(spec):
+            result += sorted(glob.glob(spec))
+        else:
+            result.append(spec)
+
+    return list(dict.fromkeys(result))
+
+
+def has_magic(spec):
+    """
+    Check whether a path contains glob wildcards
+    """
+    return any(char in spec for char in '*?[')
+
+
+def sha1_hash(filename, chunk_bytes=1024 * 1024):
+    """
+    Compute the SHA-1 checksum of every byte of a file
+
+    Returns
+    -------
+    str
+        The hex digest
+
+    """
+    import hashlib
+
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fid:
+        for chunk in iter(lambda: fid.read(chunk_bytes), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
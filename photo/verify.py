@@ -0,0 +1,282 @@
+"""
+Repository scrubbing
+
+The content checksum of every file is computed once, at ingest, and kept in
+two places: the catalog, and the first eight characters of it in the
+canonical filename. Verifying a file computes the checksum again and compares
+it with both, which tells bit rot (the content matches neither) from a stale
+catalog or a misnamed file.
+
+Files are checksummed by a pool of threads, as in an ingest, with the bytes
+read held under an optional bandwidth cap so a scrub can run alongside other
+work. Each result is recorded in the catalog as it is found, so the catalog
+is also the checkpoint: an interrupted scrub picks up with the files it has
+not reached, and a file verified within the window is not read again. Files
+that failed verification are checked on every run until they pass.
+
+The repository is also walked for photos and videos the catalog lacks, such
+as files placed before it existed. Those are checked against the checksum in
+their canonical name on every run, since there is no record to keep their
+results in, and reported so that `photo catalog rebuild` can record them.
+"""
+
+# the number of days a successful verification stays valid
+WINDOW_DAYS = 30
+
+# the outcomes of verifying a file
+STATUSES = ['ok', 'corrupt', 'catalog_mismatch', 'name_mismatch', 'missing', 'unreadable', 'uncataloged']
+
+
+class RateLimiter:
+    """
+    Hold the bytes read by many threads under an average rate
+
+    Each read reserves the next free stretch of time for its bytes, and waits
+    until that stretch starts.
+
+    Arguments
+    ---------
+    rate : float
+        The rate in bytes per second, or None for no limit
+
+    """
+
+    def __init__(self, rate=None):
+        import threading
+
+        self.rate = rate if rate else None
+        self._clock = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes):
+        """
+        Wait until nbytes may be read
+        """
+        import time
+
+        if self.rate is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._clock)
+            self._clock = start + nbytes / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+def name_checksum(path):
+    """
+    The checksum prefix in a canonical filename
+
+    Returns
+    -------
+    str | None
+        The eight checksum characters of a YYMMDD_HHMMSS_<checksum8> name,
+        or None for any other name
+
+    """
+    import re
+    from pathlib import Path
+
+    match = re.fullmatch(r'\d{6}_\d{6}_([0-9a-fA-F]{8})', Path(path).stem)
+    return match.group(1).lower() if match is not None else None
+
+
+def _checksums(path, video_hash, heic_hash, limiter, photo_hash=None):
+    """
+    The checksums of a file, once per checksum scheme of its kind
+
+    The file is only read again under another scheme when the previous
+    checksum matched nothing, since the catalog does not record the scheme a
+    file was added with.
+    """
+    from .ingest import compute_checksum, PHOTO_EXT, VIDEO_EXT, HEIC_EXT
+    from .videohash import SCHEMES as VIDEO_SCHEMES
+
+    schemes = [(video_hash, heic_hash, photo_hash)]
+    other_photo = None if photo_hash == 'raw' else 'raw'
+    if path.suffix.upper() in VIDEO_EXT:
+        schemes += [(scheme, heic_hash, photo_hash) for scheme in VIDEO_SCHEMES if scheme != (video_hash or 'file')]
+    elif path.suffix.upper() in HEIC_EXT:
+        # the pixel checksum of a HEIC photo follows the photo scheme
+        heic_schemes = [(None, photo_hash), (None, other_photo), ('coded', photo_hash)]
+        schemes += [(video_hash, heic_scheme, photo_scheme) for heic_scheme, photo_scheme in heic_schemes
+                    if (heic_scheme, photo_scheme) != (heic_hash, photo_hash)]
+    elif path.suffix.upper() in PHOTO_EXT:
+        schemes.append((video_hash, heic_hash, other_photo))
+
+    for video_scheme, heic_scheme, photo_scheme in schemes:
+        limiter.acquire(path.stat().st_size)
+        yield compute_checksum(path, video_scheme, heic_scheme, photo_scheme)[1]
+
+
+def verify_file(path, checksum, video_hash=None, limiter=None, heic_hash=None, photo_hash=None):
+    """
+    Check a repository file against its catalog checksum and its name
+
+    Arguments
+    ---------
+    path : Path
+        The file
+
+    checksum : str
+        The checksum recorded in the catalog, or None for a file the catalog
+        lacks, which is checked against its name only
+
+    Keyword Arguments
+    -----------------
+    video_hash : str
+        The video checksum scheme to try first, one of
+        photo.videohash.SCHEMES, or None for the original one
+
+    limiter : RateLimiter
+        Holds the reads under a bandwidth cap
+
+    heic_hash : str
+        The HEIC checksum scheme to try first, 'coded' or None for the pixel
+        checksum
+
+    photo_hash : str
+        The pixel checksum scheme to try first, 'raw' or None for the legacy
+        checksum
+
+    Returns
+    -------
+    tuple
+        The status, one of STATUSES, and the checksum found
+
+    """
+    if limiter is None:
+        limiter = RateLimiter()
+    if not path.exists():
+        return 'missing', None
+
+    named = name_checksum(path)
+    if checksum is None and named is None:
+        # there is nothing to check it against
+        return 'uncataloged', None
+
+    first = None
+    try:
+        for actual in _checksums(path, video_hash, heic_hash, limiter, photo_hash):
+            if actual is None:
+                return 'unreadable', None
+            if first is None:
+                first = actual
+            in_catalog = checksum is not None and actual == checksum
+            in_name = named is None or actual[:8] == named
+            if in_catalog and in_name:
+                return 'ok', actual
+            if in_catalog:
+                return 'name_mismatch', actual
+            if in_name and named is not None:
+                return 'catalog_mismatch' if checksum is not None else 'uncataloged', actual
+    except OSError:
+        return 'unreadable', None
+
+    return 'corrupt', first
+
+
+def _uncataloged(catalog):
+    """
+    The photos and videos in the repository the catalog lacks
+
+    Returns
+    -------
+    iterator
+        The path of each file, with None for its checksum
+
+    """
+    from pathlib import Path
+    from .ingest import PHOTO_EXT, VIDEO_EXT
+    from .walker import scan_tree, WalkFilter
+
+    recorded = catalog.paths()
+    for entry in scan_tree(catalog.repo_path, WalkFilter(extensions=PHOTO_EXT + VIDEO_EXT)):
+        if catalog.relative(entry.path) not in recorded:
+            yield Path(entry.path), None
+
+
+def verify_repository(catalog, jobs=None, rate=None, window_days=WINDOW_DAYS, video_hash=None,
+                      report=None, heic_hash=None, photo_hash=None):
+    """
+    Verify the repository files not verified within a window, and the files
+    the catalog lacks
+
+    Arguments
+    ---------
+    catalog : Catalog
+        The catalog of the repository, which also records the results
+
+    Keyword Arguments
+    -----------------
+    jobs : int
+        The number of files checksummed in parallel. Defaults to the number
+        of cores.
+
+    rate : float
+        The most bytes read per second, or None for no limit
+
+    window_days : float
+        Files verified successfully within this many days are skipped
+
+    video_hash : str
+        The video checksum scheme to try first
+
+    report : callable
+        Called as report(path, status, expected, actual) for every file that
+        fails verification, as it is found. expected is None for the files
+        the catalog lacks.
+
+    heic_hash : str
+        The HEIC checksum scheme to try first
+
+    photo_hash : str
+        The pixel checksum scheme to try first
+
+    Returns
+    -------
+    dict
+        The number of files of each status
+
+    """
+    import itertools
+    import os
+    import time
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    limiter = RateLimiter(rate)
+    cutoff_ns = time.time_ns() - int(window_days * 86400e9)
+    counts = {status: 0 for status in STATUSES}
+
+    due = itertools.chain(catalog.due_for_verification(cutoff_ns), _uncataloged(catalog))
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        while True:
+            # keep a short queue, so an interruption leaves little undone
+            while len(running) < 2 * jobs:
+                entry = next(due, None)
+                if entry is None:
+                    break
+                path, checksum = entry
+                running[executor.submit(verify_file, path, checksum, video_hash, limiter, heic_hash,
+                                        photo_hash)] = entry
+            if len(running) == 0:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, checksum = running.pop(future)
+                status, actual = future.result()
+                counts[status] += 1
+                if checksum is not None:
+                    catalog.set_verified(path, status, time.time_ns())
+                if status != 'ok' and report is not None:
+                    report(path, status, checksum, actual)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return counts
@@ -0,0 +1,175 @@
+"""
+Streaming checksums for large video files
+
+Videos are read sequentially into a single reusable buffer, with
+posix_fadvise telling the kernel to read ahead and to drop the pages once they
+are hashed, so hashing a 20 GB clip neither allocates memory per chunk nor
+pushes everything else out of the page cache. At most IO_SLOTS files are read
+at the same time, so several large files hashing in parallel do not turn a
+sequential disk into a seeking one.
+
+The checksum can cover the whole file, or only the payload of the mdat boxes
+of MOV/MP4 files, so that editing the metadata of a video does not change it.
+"""
+
+# the size of the read buffer; a multiple of any page or sector size
+BUFFER_BYTES = 8 * 1024 * 1024
+
+# the number of videos read at the same time
+IO_SLOTS = 2
+
+# the video checksum schemes understood by hash_video, kept with the command
+# line choices
+from .choices import VIDEO_SCHEMES as SCHEMES
+
+# running totals of the bytes hashed and the time spent, for throughput
+_totals = {'bytes': 0, 'seconds': 0.0}
+
+# the read slots and the lock of the totals, made on first use
+_locks = {}
+
+
+def _lock(name):
+    """
+    The read slots ('io') or the lock of the totals ('totals')
+    """
+    import threading
+
+    if name not in _locks:
+        # setdefault is atomic, so racing first calls share one lock
+        _locks.setdefault(name, threading.BoundedSemaphore(IO_SLOTS) if name == 'io' else threading.Lock())
+    return _locks[name]
+
+
+def mdat_ranges(fid, size):
+    """
+    Find the media payload of an ISO base media (MOV/MP4) file
+
+    Arguments
+    ---------
+    fid : file
+        The open file
+
+    size : int
+        The size of the file
+
+    Returns
+    -------
+    list | None
+        The (start, end) byte range of every top level mdat payload, or None
+        if the file is not made of boxes or has no mdat
+
+    """
+    import struct
+
+    ranges = []
+    pos = 0
+    while pos + 8 <= size:
+        fid.seek(pos)
+        header = fid.read(16)
+        box_size, kind = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if box_size == 1:
+            if len(header) < 16:
+                return None
+            box_size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = size - pos
+        if box_size < header_size or not kind.isascii():
+            return None
+        if kind == b'mdat':
+            ranges.append((pos + header_size, min(pos + box_size, size)))
+        pos += box_size
+
+    return ranges if len(ranges) > 0 else None
+
+
+def hash_video(path, scheme='file', buffer_bytes=BUFFER_BYTES):
+    """
+    Compute the checksum of a video
+
+    Arguments
+    ---------
+    path : str
+        The video to hash
+
+    Keyword Arguments
+    -----------------
+    scheme : str
+        'file' hashes every byte of the file. 'mdat' hashes only the media
+        payload of MOV/MP4 files, and the whole file for other formats.
+
+    buffer_bytes : int
+        The size of the read buffer
+
+    Returns
+    -------
+    str
+        The MD5 checksum
+
+    """
+    import hashlib
+    import io
+    import os
+    import time
+
+    if scheme not in SCHEMES:
+        raise ValueError('Unrecognized video checksum scheme "{0}"'.format(scheme))
+
+    md5_hash = hashlib.md5()
+    buf = bytearray(buffer_bytes)
+    view = memoryview(buf)
+    advise = getattr(os, 'posix_fadvise', None)
+
+    with _lock('io'):
+        start_time = time.perf_counter()
+        hashed = 0
+        with io.FileIO(path, 'r') as fid:
+            size = os.fstat(fid.fileno()).st_size
+            ranges = None
+            if scheme == 'mdat':
+                ranges = mdat_ranges(fid, size)
+            if ranges is None:
+                ranges = [(0, size)]
+
+            if advise is not None:
+                advise(fid.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            for start, end in ranges:
+                fid.seek(start)
+                pos = start
+                while pos < end:
+                    count = fid.readinto(view[:min(buffer_bytes, end - pos)])
+                    if not count:
+                        break
+                    md5_hash.update(view[:count])
+                    if advise is not None:
+                        # done with these pages; let them go before other data
+                        advise(fid.fileno(), pos, count, os.POSIX_FADV_DONTNEED)
+                    pos += count
+                    hashed += count
+        elapsed = time.perf_counter() - start_time
+
+    with _lock('totals'):
+        _totals['bytes'] += hashed
+        _totals['seconds'] += elapsed
+
+    return md5_hash.hexdigest()
+
+
+def throughput():
+    """
+    The video hashing throughput so far in this process
+
+    Returns
+    -------
+    tuple
+        The number of bytes hashed and the rate in MB/s, summed over the
+        time each file took
+
+    """
+    with _lock('totals'):
+        nbytes, seconds = _totals['bytes'], _totals['seconds']
+
+    rate = nbytes / seconds / 1e6 if seconds > 0 else 0.0
+    return nbytes, rate
@@ -0,0 +1,143 @@
+"""
+Directory walker for ingests
+
+The inbox is listed with os.scandir, one directory at a time, and the entries
+are handed on as they are found, so the walk needs memory for the directories
+still to visit rather than for the whole tree. Hidden and excluded directories
+are pruned before they are entered, and the kind of each entry comes from the
+directory listing itself, which on most filesystems needs no stat call.
+
+Files are selected by glob patterns and extensions, matched against the path
+relative to the walked directory:
+
+- a file or directory matching an exclude pattern is skipped; excluded
+  directories are not entered,
+- when include patterns are given, a file must match one of them, and
+- when extensions are given, a file must have one of them.
+"""
+
+
+def _matches(rel_path, name, patterns):
+    """
+    Check a path against glob patterns, by relative path or by name
+    """
+    from fnmatch import fnmatchcase
+
+    return any(fnmatchcase(rel_path, pattern) or fnmatchcase(name, pattern) for pattern in patterns)
+
+
+class WalkFilter:
+    """
+    The files and directories a walk visits
+
+    Keyword Arguments
+    -----------------
+    include : list
+        Glob patterns, e.g. 'DCIM/*' or '*.jpg'. Files must match one, when
+        given.
+
+    exclude : list
+        Glob patterns of files and directories to skip, e.g. 'Trash' or
+        '*.tmp'
+
+    extensions : list
+        The extensions of the files to visit, with or without the dot and in
+        any case, e.g. ['jpg', '.HEIC']. All files are visited when empty.
+
+    """
+
+    def __init__(self, include=None, exclude=None, extensions=None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.extensions = {('.' + ext.lstrip('.')).upper() for ext in extensions or []}
+
+    @classmethod
+    def from_config(cls, cfg, include=None, exclude=None):
+        """
+        The filter of the walk section of the configuration, with patterns
+        added from the command line
+        """
+        section = (cfg or {}).get("walk") or {}
+        return cls(include=list(section.get("include") or []) + list(include or []),
+                   exclude=list(section.get("exclude") or []) + list(exclude or []),
+                   extensions=section.get("extensions") or [])
+
+    def enter(self, rel_path, name):
+        """
+        Check whether a directory should be walked
+        """
+        return not name.startswith('.') and not _matches(rel_path, name, self.exclude)
+
+    def accept(self, rel_path, name):
+        """
+        Check whether a file should be visited
+        """
+        import os
+
+        if name.startswith('.'):
+            return False
+        if self.extensions and os.path.splitext(name)[1].upper() not in self.extensions:
+            return False
+        if self.include and not _matches(rel_path, name, self.include):
+            return False
+        return not _matches(rel_path, name, self.exclude)
+
+
+def scan_tree(root, walk_filter=None):
+    """
+    Walk the files below a directory
+
+    Arguments
+    ---------
+    root : str
+        The directory to walk
+
+    Keyword Arguments
+    -----------------
+    walk_filter : WalkFilter
+        The files and directories to visit. Defaults to every file outside
+        hidden directories, except hidden files.
+
+    Returns
+    -------
+    iterator
+        The os.DirEntry of every file visited, in name order within each
+        directory, with the files of a directory before its subdirectories.
+        Their stat() is cached by the entry.
+
+    """
+    import os
+    import sys
+
+    if walk_filter is None:
+        walk_filter = WalkFilter()
+
+    # the directories still to visit, with their paths relative to root
+    pending = [(os.fspath(root), '')]
+    while pending:
+        directory, rel_dir = pending.pop()
+        try:
+            with os.scandir(directory) as listing:
+                entries = sorted(listing, key=lambda entry: entry.name)
+        except (FileNotFoundError, NotADirectoryError, PermissionError) as err:
+            if rel_dir == '':
+                raise
+            print(f"WARNING: cannot list {directory}: {err}", file=sys.stderr)
+            continue
+
+        subdirs = []
+        for entry in entries:
+            rel_path = rel_dir + entry.name
+            try:
+                # links to directories are not followed, as with rglob
+                is_dir = entry.is_dir(follow_symlinks=False)
+                is_file = not is_dir and entry.is_file()
+            except OSError:
+                continue
+            if is_dir:
+                if walk_filter.enter(rel_path, entry.name):
+                    subdirs.append((entry.path, rel_path + '/'))
+            elif is_file and walk_filter.accept(rel_path, entry.name):
+                yield entry
+
+        pending.extend(reversed(subdirs))
@@ -0,0 +1,584 @@
+"""
+Watch-folder daemon
+
+`photo watch` keeps an inbox under watch and adds files as they land, instead
+of walking the whole inbox on every run. On Linux the inbox is watched with
+inotify; elsewhere it is scanned every few seconds.
+
+A file is only picked up once it has stopped changing: its size and
+modification time must hold still for the settle time, so copies still in
+progress over the network are left alone. Settled files are gathered into
+batches, and each batch goes through the same ingest as `photo add`. At most
+a few batches wait for the ingest; while they do, the watcher stops taking
+events, and the kernel queue (or the next scan) holds the rest. Every batch
+writes and locks its own import journal, so a `photo add` into the same
+repository runs alongside; on start the daemon finishes the imports that were
+interrupted, leaving the journals of running imports alone.
+
+The daemon answers on a Unix socket in the repository with a JSON report of
+its queue depth and throughput.
+"""
+
+# the name of the status socket in the repository root
+SOCKET_NAME = '.photo-watch.sock'
+
+# the seconds a file must hold still before it is added
+SETTLE_SECONDS = 2.0
+
+# the most files added by one ingest
+BATCH_SIZE = 100
+
+# the seconds a partial batch waits for more files
+BATCH_DELAY = 5.0
+
+# the number of batches allowed to wait for the ingest
+MAX_QUEUED = 2
+
+# inotify event bits
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def _visible(path, root):
+    """
+    Check that no part of a path below root is hidden
+    """
+    return not any(part.startswith('.') for part in path.relative_to(root).parts)
+
+
+def scan_files(root):
+    """
+    List the visible files below a directory
+
+    Returns
+    -------
+    dict
+        The (size, mtime_ns) of each file
+
+    """
+    from pathlib import Path
+    from .walker import scan_tree
+
+    found = {}
+    for entry in scan_tree(root):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        found[Path(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+    return found
+
+
+class InotifyWatcher:
+    """
+    Report the files created, written or moved below a directory, with inotify
+
+    Every visible directory is watched, including the ones created later.
+
+    Arguments
+    ---------
+    root : Path
+        The directory to watch
+
+    """
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+
+    def __init__(self, root):
+        import ctypes
+        import ctypes.util
+        from pathlib import Path
+
+        self.root = Path(root)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        self._add_tree(self.root)
+
+    def _add_tree(self, top):
+        """
+        Watch a directory and the visible directories below it
+
+        Returns the files already there, which may predate the watch
+        """
+        import ctypes
+        import os
+        from pathlib import Path
+
+        found = []
+        for directory, dirs, files in os.walk(top):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f'Cannot watch {directory}')
+            self._dirs[wd] = Path(directory)
+            found += [Path(directory) / name for name in files if not name.startswith('.')]
+        return found
+
+    def poll(self, timeout):
+        """
+        Wait up to timeout seconds for changes
+
+        Returns
+        -------
+        list
+            The paths of the files changed
+        """
+        import os
+        import select
+        import struct
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        changed = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = struct.unpack_from('iIII', data, pos)
+                name = data[pos + 16:pos + 16 + length].rstrip(b'\0')
+                pos += 16 + length
+
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost; look at everything again
+                    changed += list(scan_files(self.root))
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None or not name or name.startswith(b'.'):
+                    continue
+                path = directory / os.fsdecode(name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed += self._add_tree(path)
+                else:
+                    changed.append(path)
+
+        return changed
+
+    def close(self):
+        import os
+
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    """
+    Report the files created or changed below a directory, by scanning it
+
+    Arguments
+    ---------
+    root : Path
+        The directory to watch
+
+    interval : float
+        The seconds between scans
+
+    """
+
+    def __init__(self, root, interval=SETTLE_SECONDS):
+        from pathlib import Path
+
+        self.root = Path(root)
+        self.interval = interval
+        self._last_scan = 0.0
+        self._known = scan_files(self.root)
+
+    def poll(self, timeout):
+        """
+        Wait up to timeout seconds for changes
+
+        Returns
+        -------
+        list
+            The paths of the files changed
+        """
+        import time
+
+        wait = self._last_scan + self.interval - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self._last_scan = time.monotonic()
+
+        current = scan_files(self.root)
+        changed = [path for path, state in current.items() if self._known.get(path) != state]
+        self._known = current
+        return changed
+
+    def close(self):
+        pass
+
+
+def open_watcher(root, poll_interval=None):
+    """
+    Watch a directory with inotify, or by scanning it where inotify is not
+    available or poll_interval is given
+    """
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError):
+            poll_interval = SETTLE_SECONDS
+    return PollingWatcher(root, poll_interval)
+
+
+class Settler:
+    """
+    Hold files until they stop changing
+
+    Arguments
+    ---------
+    settle : float
+        The seconds a file must keep its size and modification time
+
+    """
+
+    def __init__(self, settle=SETTLE_SECONDS):
+        self.settle = settle
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, path):
+        """
+        Start or restart the wait of a file
+        """
+        import time
+
+        self._pending[path] = (None, time.monotonic())
+
+    def ready(self):
+        """
+        Take the files that held still for the settle time
+
+        Returns
+        -------
+        list
+            The settled files, in the order they were first seen
+        """
+        import time
+
+        now = time.monotonic()
+        settled = []
+        for path, (state, since) in list(self._pending.items()):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # deleted or moved away before it settled
+                del self._pending[path]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != state:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle:
+                del self._pending[path]
+                settled.append(path)
+        return settled
+
+
+class WatchStatus:
+    """
+    The counters reported by the status socket
+    """
+
+    def __init__(self):
+        import threading
+        import time
+
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.settling = 0
+        self.batching = 0
+        self.queued = 0
+        self.ingesting = 0
+        self.batches = 0
+        self.files = 0
+        self.bytes = 0
+        self.busy_seconds = 0.0
+        self.added = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.corrupt = 0
+        self.errors = 0
+        self.last_error = None
+
+    def update(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                setattr(self, key, value)
+
+    def queue_batch(self, files, batching):
+        with self._lock:
+            self.queued += files
+            self.batching = batching
+
+    def start_batch(self, files):
+        with self._lock:
+            self.queued = max(self.queued - files, 0)
+            self.ingesting = files
+
+    def finish_batch(self, files, nbytes, seconds, error=None):
+        with self._lock:
+            self.batches += 1
+            self.files += files
+            self.bytes += nbytes
+            self.busy_seconds += seconds
+            self.ingesting = 0
+            if error is not None:
+                self.errors += 1
+                self.last_error = str(error)
+
+    def count(self, summary):
+        """
+        Add the outcomes of an ingest
+        """
+        with self._lock:
+            self.added += summary.added_files
+            self.duplicates += summary.duplicate_files
+            self.skipped += summary.skipped_files
+            self.corrupt += summary.corrupt_count
+
+    def as_dict(self):
+        """
+        The status as a dictionary of plain values
+        """
+        import time
+
+        with self._lock:
+            busy = self.busy_seconds
+            return {'uptime': time.time() - self.started,
+                    'queue_depth': self.settling + self.batching + self.queued + self.ingesting,
+                    'settling': self.settling,
+                    'batching': self.batching,
+                    'queued': self.queued,
+                    'ingesting': self.ingesting,
+                    'batches': self.batches,
+                    'files': self.files,
+                    'bytes': self.bytes,
+                    'files_per_second': self.files / busy if busy > 0 else 0.0,
+                    'bytes_per_second': self.bytes / busy if busy > 0 else 0.0,
+                    'added': self.added,
+                    'duplicates': self.duplicates,
+                    'skipped': self.skipped,
+                    'corrupt': self.corrupt,
+                    'errors': self.errors,
+                    'last_error': self.last_error,
+                    }
+
+
+def serve_status(status, socket_path):
+    """
+    Answer every connection to a Unix socket with the status as JSON
+
+    Arguments
+    ---------
+    status : WatchStatus
+        The status to report
+
+    socket_path : Path
+        The socket to create. A stale socket left by a crashed daemon is
+        replaced; a live one raises an error.
+
+    Returns
+    -------
+    socketserver.BaseServer
+        The server, answering from a daemon thread. Call shutdown() and
+        server_close() to stop it.
+
+    """
+    import json
+    import os
+    import socket
+    import socketserver
+    import threading
+
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(socket_path))
+        except OSError:
+            os.unlink(socket_path)
+        else:
+            raise IOError(f'Another photo watch is running on {socket_path}')
+        finally:
+            probe.close()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.wfile.write(json.dumps(status.as_dict()).encode('utf-8') + b'\n')
+
+    server = socketserver.ThreadingUnixStreamServer(str(socket_path), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='photo-watch-status', daemon=True).start()
+    return server
+
+
+def read_status(socket_path, timeout=5.0):
+    """
+    Ask a running daemon for its status
+
+    Returns
+    -------
+    dict
+        The status, as reported by WatchStatus.as_dict
+    """
+    import json
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(socket_path))
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data.decode('utf-8'))
+
+
+def watch(inbox, process, stop, settle=SETTLE_SECONDS, batch_size=BATCH_SIZE, batch_delay=BATCH_DELAY,
+          max_queued=MAX_QUEUED, status=None, poll_interval=None, scan=False):
+    """
+    Feed the files landing in an inbox to process, in batches, until stopped
+
+    Arguments
+    ---------
+    inbox : Path
+        The directory to watch
+
+    process : callable
+        Called as process(paths) with each batch of settled files, from a
+        single worker thread
+
+    stop : threading.Event
+        Set to stop watching. The batch being processed is finished and the
+        queued batches are dropped; their files are picked up again with
+        scan.
+
+    Keyword Arguments
+    -----------------
+    settle : float
+        The seconds a file must hold still before it is processed
+
+    batch_size : int
+        The most files in a batch
+
+    batch_delay : float
+        The seconds a partial batch waits for more files
+
+    max_queued : int
+        The number of batches allowed to wait for process
+
+    status : WatchStatus
+        The counters to keep up to date
+
+    poll_interval : float
+        Scan the inbox at this interval instead of using inotify
+
+    scan : bool
+        Also process the files already in the inbox
+
+    """
+    import queue
+    import sys
+    import threading
+    import time
+    from pathlib import Path
+
+    inbox = Path(inbox)
+    if not inbox.is_dir():
+        raise IOError(f'The inbox {inbox} is not a directory')
+    if status is None:
+        status = WatchStatus()
+
+    batches = queue.Queue(maxsize=max_queued)
+
+    def worker():
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            status.start_batch(len(batch))
+            nbytes = 0
+            for path in batch:
+                try:
+                    nbytes += path.stat().st_size
+                except OSError:
+                    pass
+            start = time.monotonic()
+            error = None
+            try:
+                process(batch)
+            except Exception as err:
+                error = err
+                print(f"WARNING: adding a batch of {len(batch)} files failed: {err}", file=sys.stderr)
+            status.finish_batch(len(batch), nbytes, time.monotonic() - start, error)
+
+    watcher = open_watcher(inbox, poll_interval)
+    settler = Settler(settle)
+    if scan:
+        for path in scan_files(inbox):
+            settler.add(path)
+
+    thread = threading.Thread(target=worker, name='photo-watch-ingest')
+    thread.start()
+    batch = []
+    batch_started = None
+    try:
+        while not stop.is_set():
+            for path in watcher.poll(min(settle, 0.5) or 0.1):
+                if _visible(path, inbox):
+                    settler.add(path)
+
+            for path in settler.ready():
+                if path not in batch:
+                    batch.append(path)
+                    batch_started = batch_started or time.monotonic()
+            status.update(settling=len(settler), batching=len(batch))
+
+            if batch and (len(batch) >= batch_size or time.monotonic() - batch_started >= batch_delay):
+                queued, batch = batch[:batch_size], batch[batch_size:]
+                # wait for room in the queue: this is the backpressure
+                while not stop.is_set():
+                    try:
+                        batches.put(queued, timeout=0.5)
+                    except queue.Full:
+                        continue
+                    status.queue_batch(len(queued), len(batch))
+                    break
+                batch_started = time.monotonic() if batch else None
+    finally:
+        watcher.close()
+        # drop what is still waiting, then let the worker finish its batch
+        while True:
+            try:
+                batches.get_nowait()
+            except queue.Empty:
+                break
+        batches.put(None)
+        thread.join()
+        status.update(settling=0, batching=0, queued=0)
@@ -0,0 +1,204 @@
+import pytest
+
+
+def test_catalog_records(tmp_path):
+    """
+    Files recorded in the catalog can be found by path and by checksum
+
+    """
+    from photo.catalog import Catalog
+    from datetime import datetime
+
+    photo_path = tmp_path / '2015' / '10' / '151017_140628_1e0440aa.jpg'
+    photo_path.parent.mkdir(parents=True)
+    photo_path.write_bytes(b'pixels')
+
+    with Catalog(tmp_path) as catalog:
+        catalog.add(photo_path, '1e0440aabbcc', datetime(2015, 10, 17, 14, 6, 28), ['travel', 'karen'])
+        assert len(catalog) == 1
+
+    # The catalog persists in the repository root
+    with Catalog(tmp_path) as catalog:
+        record = catalog.get('2015/10/151017_140628_1e0440aa.jpg')
+        assert record['checksum'] == '1e0440aabbcc'
+        assert record['date'] == '2015-10-17T14:06:28'
+        assert record['size'] == 6
+        assert record['tags'] == ['travel', 'karen']
+
+        assert catalog.lookup('1e0440aabbcc') == [photo_path]
+        assert catalog.lookup('ffffffff') == []
+
+        catalog.set_tags(photo_path, ['home'])
+        assert catalog.get_tags(photo_path) == ['home']
+
+        catalog.remove(photo_path)
+        assert catalog.get(photo_path) is None
+        assert catalog.get_tags(photo_path) == []
+
+
+def test_ingest_catalog_duplicates(tmp_path, monkeypatch):
+    """
+    With a catalog, the same content is a duplicate even under another date
+
+    """
+    from photo import ingest, exif
+    from photo.catalog import Catalog
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+    import hashlib
+
+    tzla = ZoneInfo("America/Los_Angeles")
+    dates = {'a.jpg': datetime(2020, 1, 1, tzinfo=tzla),
+             'b.jpg': datetime(2021, 6, 1, tzinfo=tzla),
+             }
+
+    def fake_inspect(file_obj):
+        checksum = hashlib.md5(file_obj.read_bytes()).hexdigest()
+        return 'photo', checksum, dates[file_obj.name]
+
+    monkeypatch.setattr(ingest, 'inspect_file', fake_inspect)
+    # the tags of the placed files are read in one batch, never one by one
+    batches = []
+    monkeypatch.setattr(exif, 'read_tags', lambda filenames, backend=None: batches.append(filenames) or
+                        {str(filename): ['inbox'] for filename in filenames})
+    monkeypatch.setattr(exif, 'get_tags', lambda filename: pytest.fail('read one by one'))
+
+    inbox = tmp_path / 'inbox'
+    repo = tmp_path / 'repo'
+    inbox.mkdir()
+    (inbox / 'a.jpg').write_bytes(b'same pixels')
+
+    with Catalog(repo) as catalog:
+        summary = ingest.ingest([inbox / 'a.jpg'], False, repo, catalog=catalog)
+        assert summary.added_files == 1
+        assert len(catalog) == 1
+
+        (inbox / 'b.jpg').write_bytes(b'same pixels')
+        summary = ingest.ingest([inbox / 'b.jpg'], False, repo, catalog=catalog)
+        assert summary.added_files == 0
+        assert summary.duplicate_files == 1
+
+        checksum = hashlib.md5(b'same pixels').hexdigest()
+        placed, = catalog.lookup(checksum)
+        assert placed.parent == repo / '2020' / '01'
+        assert catalog.get_tags(placed) == ['inbox']
+        assert batches == [[placed]]
+
+
+def test_find_duplicates(tmp_path, monkeypatch):
+    """
+    Only files sharing a size and partial hash are read in full
+
+    """
+    from photo import dedupe
+    import os
+
+    payload = os.urandom(200000)
+    files = {'a.jpg': payload,
+             'b.jpg': payload,
+             # same size and ends, different middle
+             'c.jpg': payload[:100000] + bytes([payload[100000] ^ 1]) + payload[100001:],
+             'd.jpg': os.urandom(1000),
+             }
+    for name, content in files.items():
+        (tmp_path / name).write_bytes(content)
+
+    hashed = []
+    file_hash = dedupe.file_hash
+    monkeypatch.setattr(dedupe, 'file_hash', lambda path: hashed.append(path.name) or file_hash(path))
+
+    groups = dedupe.find_duplicates(sorted(tmp_path.iterdir()))
+    assert groups == [[tmp_path / 'a.jpg', tmp_path / 'b.jpg']]
+    assert sorted(hashed) == ['a.jpg', 'b.jpg', 'c.jpg']
+
+
+def test_repository_dedupe(tmp_path, monkeypatch):
+    """
+    Repository duplicates are reported, and byte identical ones reclaimed
+
+    """
+    from photo import ingest
+    from photo.catalog import Catalog
+    from photo.dedupe import repository_duplicates, reclaim
+    from photo.tagstore import sidecar_path, write_sidecar
+
+    (tmp_path / '2020').mkdir()
+    names = ['2020/a.jpg', '2020/b.jpg', '2020/c.jpg', '2020/d.jpg']
+    contents = [b'same bytes', b'same bytes', b'same pixels, other tags', b'unique']
+    checksums = ['one', 'one', 'one', 'two']
+
+    with Catalog(tmp_path) as catalog:
+        for name, content, checksum in zip(names, contents, checksums):
+            (tmp_path / name).write_bytes(content)
+            catalog.add(tmp_path / name, checksum)
+
+        write_sidecar(tmp_path / '2020/a.jpg', ['kept'])
+        write_sidecar(tmp_path / '2020/b.jpg', ['dropped'])
+
+        identical, similar = repository_duplicates(tmp_path, catalog)
+        assert identical == [[tmp_path / '2020/a.jpg', tmp_path / '2020/b.jpg']]
+        assert similar == [[tmp_path / name for name in names[:3]]]
+
+        assert reclaim(identical, catalog) == len(b'same bytes')
+        assert not (tmp_path / '2020/b.jpg').exists()
+        # the sidecar goes with its file
+        assert not sidecar_path(tmp_path / '2020/b.jpg').exists()
+        assert sidecar_path(tmp_path / '2020/a.jpg').exists()
+        assert catalog.lookup('one') == [tmp_path / '2020/a.jpg', tmp_path / '2020/c.jpg']
+
+        # A byte identical copy arriving in the inbox is matched without
+        # computing its checksum
+        monkeypatch.setattr(ingest, 'inspect_file', lambda file_obj: pytest.fail('decoded'))
+        inbox = tmp_path.parent / 'inbox'
+        inbox.mkdir()
+        (inbox / 'copy.jpg').write_bytes(b'unique')
+        summary = ingest.ingest([inbox / 'copy.jpg'], False, tmp_path, catalog=catalog)
+        assert summary.duplicate_files == 1
+
+
+def test_rebuild_catalog(tmp_path, monkeypatch):
+    """
+    A rebuild records the files of a repository the catalog lacks, with their
+    embedded tags, and forgets the files that are gone
+
+    """
+    from photo.catalog import Catalog, rebuild
+    from photo.exif import calculate_checksum
+    from PIL import Image
+
+    repo = tmp_path / 'repo'
+    source = tmp_path / 'source.jpg'
+    exif = Image.Exif()
+    exif[0x010e] = 'travel,karen'
+    Image.new('RGB', (32, 24), 'teal').save(source, exif=exif)
+    checksum = calculate_checksum(source, legacy=True)
+    placed = repo / '2021' / '05' / f'210506_070809_{checksum[:8]}.jpg'
+    placed.parent.mkdir(parents=True)
+    source.rename(placed)
+    misnamed = repo / '2021' / '05' / '210506_070810_00000000.jpg'
+    Image.new('RGB', (32, 24), 'navy').save(misnamed)
+    (repo / '2021' / 'notes.txt').write_text('not a photo')
+
+    problems = []
+    # a relative root gives the same keys as an absolute one
+    monkeypatch.chdir(tmp_path)
+    with Catalog('repo') as catalog:
+        gone = repo / '2020' / '01' / '200101_000000_deadbeef.jpg'
+        gone.parent.mkdir(parents=True)
+        gone.write_bytes(b'gone')
+        catalog.add(gone, 'deadbeef')
+        gone.unlink()
+
+        counts = rebuild(catalog, jobs=2, report=lambda path, problem: problems.append(path))
+        assert counts == {'added': 2, 'unchanged': 0, 'removed': 1, 'unreadable': 0}
+        assert problems == [misnamed]
+
+        record = catalog.get(placed)
+        assert record['checksum'] == checksum
+        assert record['date'] == '2021-05-06T07:08:09'
+        assert record['tags'] == ['travel', 'karen']
+        assert catalog.tagged('karen') == {'2021/05/' + placed.name}
+        assert catalog.get(gone) is None
+
+        # a second run reads nothing
+        assert rebuild(catalog)['unchanged'] == 2
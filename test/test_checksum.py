@@ -0,0 +1,119 @@
+import pytest
+
+
+def reference_checksum(image_path):
+    """
+    The original per-pixel checksum, kept here to pin the legacy mode
+
+    """
+    import hashlib
+    from PIL import Image
+
+    img = Image.open(image_path)
+    md5_hash = hashlib.md5()
+    width, height = img.size
+    for y in range(height):
+        for x in range(width):
+            md5_hash.update(str(img.getpixel((x, y))).encode('utf-8'))
+    return md5_hash.hexdigest()
+
+
+def test_legacy_checksum(tmp_path):
+    """
+    The legacy mode must reproduce checksums computed by earlier versions
+
+    """
+    from photo.exif import calculate_checksum
+    from PIL import Image
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    rgb = Image.fromarray(rng.integers(0, 256, (23, 37, 3), dtype=np.uint8), 'RGB')
+    samples = {'RGB': rgb, 'L': rgb.convert('L'), 'RGBA': rgb.convert('RGBA'), 'P': rgb.convert('P'),
+               '1': rgb.convert('1'), 'I': rgb.convert('I'), 'F': rgb.convert('F')}
+    for mode, img in samples.items():
+        img_path = tmp_path / 'sample_{0}.{1}'.format(mode, 'tif' if mode in ['I', 'F'] else 'png')
+        img.save(img_path)
+
+        expected = reference_checksum(img_path)
+        assert calculate_checksum(img_path, legacy=True) == expected, mode
+        assert calculate_checksum(img_path, legacy=True, strip_bytes=100) == expected, mode
+
+
+def test_checksum_ignores_metadata():
+    """
+    The checksum should only depend on the pixels, never on the strip size
+    or the metadata
+
+    """
+    from photo.exif import calculate_checksum
+    from os.path import dirname, join
+    from PIL import Image
+    import tempfile
+
+    test_root = dirname(__file__)
+    test_img = join(test_root, 'data', 'test_iphone_photo.jpg')
+
+    checksum = calculate_checksum(test_img)
+    assert calculate_checksum(test_img, strip_bytes=4096) == checksum
+
+    # Same pixels in a different container
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        png_path = join(tmp_dir, 'copy.png')
+        with Image.open(test_img) as img:
+            img.save(png_path)
+        assert calculate_checksum(png_path) == checksum
+
+
+def test_video_hash(tmp_path):
+    """
+    Streamed video checksums match a plain hash, and the mdat scheme ignores
+    the metadata boxes
+
+    """
+    from photo.videohash import hash_video, throughput
+    import hashlib
+    import os
+    import struct
+
+    def box(kind, payload):
+        return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+    media = os.urandom(300000)
+    first = tmp_path / 'first.mov'
+    second = tmp_path / 'second.mov'
+    first.write_bytes(box(b'ftyp', b'qt  ') + box(b'mdat', media) + box(b'moov', b'old'))
+    second.write_bytes(box(b'ftyp', b'qt  ') + box(b'mdat', media) + box(b'moov', b'edited'))
+
+    before, _ = throughput()
+    # a small buffer exercises the chunking
+    assert hash_video(first, buffer_bytes=4096) == hashlib.md5(first.read_bytes()).hexdigest()
+    assert hash_video(first) != hash_video(second)
+    assert hash_video(first, 'mdat') == hash_video(second, 'mdat', buffer_bytes=4096)
+    assert hash_video(first, 'mdat') == hashlib.md5(media).hexdigest()
+    nbytes, rate = throughput()
+    assert nbytes > before and rate > 0
+
+    # files that are not made of boxes are hashed in full
+    other = tmp_path / 'clip.avi'
+    other.write_bytes(b'RIFF' + os.urandom(1000))
+    assert hash_video(other, 'mdat') == hashlib.md5(other.read_bytes()).hexdigest()
+
+    with pytest.raises(ValueError):
+        hash_video(first, 'pixels')
+
+
+def test_video_checksum(tmp_path):
+    """
+    The ingest hashes videos through the streaming hash, whole by default
+
+    """
+    from photo.ingest import compute_checksum
+    import hashlib
+    import os
+
+    clip = tmp_path / 'clip.mov'
+    clip.write_bytes(os.urandom(5000))
+    expected = hashlib.md5(clip.read_bytes()).hexdigest()
+    assert compute_checksum(clip) == ('video', expected)
+    assert compute_checksum(clip, video_hash='file') == ('video', expected)
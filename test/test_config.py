@@ -0,0 +1,172 @@
+import pytest
+
+
+def configure(tmp_path, monkeypatch, text):
+    """
+    Point the configuration at a photorc in tmp_path with the given text
+
+    """
+    from photo import config
+
+    (tmp_path / 'config' / 'photo').mkdir(parents=True)
+    (tmp_path / 'config' / 'photo' / 'photorc').write_text(text)
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setattr(config, '_cache', {})
+    for name in list(config._environment()):
+        monkeypatch.delenv(name[0])
+
+
+def test_config_layers(tmp_path, monkeypatch):
+    """
+    The repository file and the environment override the global file, and
+    the compiled settings are read without touching the disk
+
+    """
+    from photo import config
+    import os
+
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    configure(tmp_path, monkeypatch, f'repo:\n    path: {repo}\nadd:\n    mode: copy\n    video_hash: mdat\n')
+    (repo / config.REPO_CONFIG_NAME).write_text('add:\n    mode: hardlink\nrepo:\n    path: /elsewhere\n')
+    monkeypatch.setenv('PHOTO_ADD_VIDEO_HASH', 'file')
+    monkeypatch.setenv('PHOTO_VERIFY_RATE', '12.5')
+
+    cfg = config.get_global_config()
+    assert cfg['repo']['path'] == str(repo)
+    assert cfg['add'] == {'mode': 'hardlink', 'video_hash': 'file', 'heic_hash': 'legacy',
+                          'photo_hash': 'legacy'}
+    assert cfg['verify']['rate'] == 12.5
+    # settings missing from every layer have their defaults
+    assert cfg['walk']['exclude'] == []
+
+    def no_disk(*args, **kwargs):
+        raise AssertionError('the disk was read')
+
+    monkeypatch.setattr(os, 'stat', no_disk)
+    monkeypatch.setattr(os.path, 'exists', no_disk)
+    assert config.get_global_config() is cfg
+
+
+def test_config_validation(tmp_path, monkeypatch, capsys):
+    """
+    Settings of the wrong type or outside their choices are refused
+
+    """
+    from photo import config
+
+    configure(tmp_path, monkeypatch, 'add:\n    mode: teleport\n')
+    with pytest.raises(ValueError, match='add.mode must be one of'):
+        config.get_global_config()
+
+    monkeypatch.setattr(config, '_cache', {})
+    (tmp_path / 'config' / 'photo' / 'photorc').write_text('similar:\n    distance: many\n')
+    with pytest.raises(ValueError, match='similar.distance must be a whole number'):
+        config.get_global_config()
+
+    # a setting with a whole number default takes no fractions
+    monkeypatch.setattr(config, '_cache', {})
+    (tmp_path / 'config' / 'photo' / 'photorc').write_text('thumbs:\n    size: 2.5\n')
+    with pytest.raises(ValueError, match='thumbs.size must be a whole number'):
+        config.get_global_config()
+
+    monkeypatch.setattr(config, '_cache', {})
+    (tmp_path / 'config' / 'photo' / 'photorc').write_text('thumbs:\n    size: 300\nverify:\n    rate: 2\n')
+    cfg = config.get_global_config()
+    assert cfg['thumbs']['size'] == 300 and cfg['verify']['rate'] == 2
+
+    monkeypatch.setattr(config, '_cache', {})
+    (tmp_path / 'config' / 'photo' / 'photorc').write_text('tags:\n    backend: sidecar\n')
+    monkeypatch.setenv('PHOTO_WALK_EXCLUDE', '[Trash, "*.tmp"]')
+    monkeypatch.setenv('PHOTO_ADD_SPEED', 'fast')
+    capsys.readouterr()
+    cfg = config.get_global_config()
+    assert cfg['tags']['backend'] == 'sidecar'
+    assert cfg['walk']['exclude'] == ['Trash', '*.tmp']
+    # warnings stay out of the output of the commands
+    captured = capsys.readouterr()
+    assert captured.out == '' and 'PHOTO_ADD_SPEED is not a setting' in captured.err
+
+
+def test_config_choices():
+    """
+    The choices of the schema are the ones the modules accept
+
+    """
+    from photo.choices import PHOTO_SCHEMES
+    from photo.config import choices
+    from photo.heic import SCHEMES as HEIC_SCHEMES
+    from photo.placement import MODES
+    from photo.similar import SCHEMES as SIMILAR_SCHEMES
+    from photo.tagstore import BACKENDS
+    from photo.videohash import SCHEMES as VIDEO_SCHEMES
+
+    assert choices[('add', 'mode')] == MODES
+    assert choices[('add', 'video_hash')] == ['legacy'] + VIDEO_SCHEMES
+    assert choices[('add', 'heic_hash')] == HEIC_SCHEMES
+    assert choices[('add', 'photo_hash')] == PHOTO_SCHEMES
+    assert choices[('tags', 'backend')] == BACKENDS
+    assert choices[('similar', 'scheme')] == SIMILAR_SCHEMES
+
+
+def test_refresh_config(tmp_path, monkeypatch):
+    """
+    The settings are compiled again once a layer changes
+
+    """
+    from photo import config
+    import os
+
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    configure(tmp_path, monkeypatch, f'repo:\n    path: {repo}\n')
+    cfg = config.get_global_config()
+    assert config.refresh_config() is False
+    assert config.get_global_config() is cfg
+
+    # a new repository file
+    (repo / config.REPO_CONFIG_NAME).write_text('thumbs:\n    size: 512\n')
+    assert config.refresh_config() is True
+    cfg = config.get_global_config()
+    assert cfg['thumbs']['size'] == 512
+
+    # an edit in place, even within the same second
+    rc_file = repo / config.REPO_CONFIG_NAME
+    stat = rc_file.stat()
+    rc_file.write_text('thumbs:\n    size: 1024\n')
+    os.utime(rc_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert config.refresh_config() is True
+    assert config.get_global_config()['thumbs']['size'] == 1024
+
+
+def test_legacy_preferences(tmp_path, monkeypatch):
+    """
+    The original flat preferences file is understood
+
+    """
+    from photo import config
+    from pathlib import Path
+    import os
+
+    text = (Path(__file__).parent.parent / 'config' / 'preferences.yaml').read_text()
+    configure(tmp_path, monkeypatch, text)
+    cfg = config.get_global_config()
+    assert cfg['repo']['path'] == os.path.expanduser('~/photos')
+    assert 'name_format' not in cfg
+
+
+def test_repository_root(tmp_path, monkeypatch):
+    """
+    The repository root is made absolute once, so every command and the
+    catalog agree on it
+
+    """
+    from photo import config
+    from photo.catalog import Catalog, repository_path
+
+    configure(tmp_path, monkeypatch, 'repo:\n    path: photos\n')
+    monkeypatch.chdir(tmp_path)
+    assert config.get_global_config()['repo']['path'] == str(tmp_path / 'photos')
+
+    Catalog(tmp_path / 'photos').close()
+    assert repository_path() == tmp_path / 'photos'
@@ -0,0 +1,64 @@
+import pytest
+
+
+def test_pool_reuses_workers():
+    """
+    Repeated commands should be served by the same long-lived exiftool process
+
+    """
+    from photo.exiftool import ExifToolPool
+    from os.path import dirname, join
+
+    test_root = dirname(__file__)
+    test_img = join(test_root, 'data', 'test_iphone_photo.jpg')
+
+    pool = ExifToolPool(size=1)
+    try:
+        first = pool.execute(test_img, '-Model')
+        pid = pool._workers[0].process.pid
+        for _ in range(10):
+            assert pool.execute(test_img, '-Model') == first
+        assert pool._workers[0].process.pid == pid
+        assert b'iPhone 5s' in first
+    finally:
+        pool.close()
+
+
+def test_pool_threads():
+    """
+    Concurrent callers should each get their own reply
+
+    """
+    from photo.exiftool import ExifToolPool
+    from concurrent.futures import ThreadPoolExecutor
+    from os.path import dirname, join
+    import os
+
+    test_root = dirname(__file__)
+    data_dir = join(test_root, 'data')
+    samples = sorted(os.listdir(data_dir))
+
+    pool = ExifToolPool(size=3)
+    try:
+        expected = [pool.execute('-FileName', join(data_dir, img)) for img in samples]
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            replies = list(executor.map(lambda img: pool.execute('-FileName', join(data_dir, img)),
+                                        samples * 4))
+        assert replies == expected * 4
+        assert len(pool._workers) <= 3
+    finally:
+        pool.close()
+
+
+def test_newline_rejected():
+    """
+    Arguments are newline separated in -stay_open mode, so embedded newlines
+    must be refused rather than silently split
+
+    """
+    from photo.exiftool import ExifTool
+
+    worker = ExifTool()
+    with pytest.raises(ValueError):
+        worker.execute('-imagedescription=one\ntwo')
+    worker.terminate()
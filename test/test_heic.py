@@ -0,0 +1,140 @@
+import pytest
+
+
+def heif_file(path, tiles, description='home', primary=1):
+    """
+    Write a HEIF photo made of a grid of HEVC tiles and an Exif item
+
+    """
+    from test_reader import box, tiff_exif
+    import struct
+
+    exif_item = struct.pack('>I', 0) + tiff_exif(description, 'iPhone 12', '2021:03:01 08:00:00')
+    items = [(idx + 2, b'hvc1', tile) for idx, tile in enumerate(tiles)]
+    exif_id = len(tiles) + 2
+
+    ftyp = box(b'ftyp', b'heic' + struct.pack('>I', 0) + b'mif1heic')
+    hdlr = box(b'hdlr', bytes(8) + b'pict' + bytes(13))
+    pitm = box(b'pitm', bytes(4) + struct.pack('>H', primary))
+    entries = [(1, b'grid')] + [(item_id, kind) for item_id, kind, _ in items] + [(exif_id, b'Exif')]
+    infe = b''.join(box(b'infe', bytes([2, 0, 0, 0]) + struct.pack('>HH', item_id, 0) + kind + b'\x00')
+                    for item_id, kind in entries)
+    iinf = box(b'iinf', bytes(4) + struct.pack('>H', len(entries)) + infe)
+    dimg = box(b'dimg', struct.pack('>HH', 1, len(tiles)) + b''.join(struct.pack('>H', item_id)
+                                                                     for item_id, _, _ in items))
+    iref = box(b'iref', bytes(4) + dimg)
+    stored = items + [(exif_id, b'Exif', exif_item)]
+
+    def build(offset):
+        # version 0, 4 byte offsets and lengths, no base offset
+        locations = b''
+        for item_id, _, data in stored:
+            locations += struct.pack('>HHHII', item_id, 0, 1, offset, len(data))
+            offset += len(data)
+        iloc = box(b'iloc', bytes(4) + bytes([0x44, 0x00]) + struct.pack('>H', len(stored)) + locations)
+        meta = box(b'meta', bytes(4) + hdlr + pitm + iinf + iref + iloc)
+        return ftyp + meta
+
+    header = build(0)
+    path.write_bytes(build(len(header) + 8) + box(b'mdat', b''.join(data for _, _, data in stored)))
+
+
+def test_coded_checksum(tmp_path):
+    """
+    The coded checksum covers the tiles of the primary image and nothing else
+
+    """
+    from photo.heic import coded_checksum
+    import hashlib
+
+    tiles = [b'tile one' * 100, b'tile two' * 50]
+    expected = hashlib.md5(b''.join(tiles)).hexdigest()
+
+    heif_file(tmp_path / 'a.heic', tiles)
+    assert coded_checksum(tmp_path / 'a.heic') == expected
+
+    # retagging does not change the checksum, editing the image does
+    heif_file(tmp_path / 'b.heic', tiles, description='home,travel')
+    assert coded_checksum(tmp_path / 'b.heic') == expected
+    heif_file(tmp_path / 'c.heic', [tiles[0], b'tile 2!' * 50])
+    assert coded_checksum(tmp_path / 'c.heic') != expected
+
+    # a single coded image rather than a grid
+    heif_file(tmp_path / 'd.heic', tiles, primary=2)
+    assert coded_checksum(tmp_path / 'd.heic') == hashlib.md5(tiles[0]).hexdigest()
+
+    # the primary item is the Exif item; not an image
+    heif_file(tmp_path / 'e.heic', tiles, primary=4)
+    assert coded_checksum(tmp_path / 'e.heic') is None
+    (tmp_path / 'f.heic').write_bytes(b'\xff\xd8 not a heif')
+    assert coded_checksum(tmp_path / 'f.heic') is None
+
+
+def test_heic_ingest_checksum(tmp_path):
+    """
+    Under the coded scheme a HEIC photo is never decoded
+
+    """
+    from photo.heic import coded_checksum
+    from photo.ingest import compute_checksum
+    from photo.reader import read_date
+    from datetime import datetime
+
+    heif_file(tmp_path / 'IMG_0001.HEIC', [b'tile'])
+    assert compute_checksum(tmp_path / 'IMG_0001.HEIC', heic_hash='coded') == (
+        'photo', coded_checksum(tmp_path / 'IMG_0001.HEIC'))
+    assert read_date(tmp_path / 'IMG_0001.HEIC').replace(tzinfo=None) == datetime(2021, 3, 1, 8, 0, 0)
+
+
+def test_decode_pool():
+    """
+    Work handed to the decode pool runs in another process
+
+    """
+    from photo.heic import DecodePool
+    import os
+
+    pool = DecodePool(2)
+    try:
+        assert pool.call(os.getpid) != os.getpid()
+        assert pool.call(pow, 2, 10) == 1024
+    finally:
+        pool.close()
+    pool.close()
+
+
+def test_decode_pool_stages(tmp_path):
+    """
+    Only the checksum runs in the decode pool; the date is read and timed on
+    its own
+
+    """
+    from photo import ingest
+    from photo.stats import Stats, collect
+    from datetime import datetime
+    import time
+
+    class InlinePool:
+        def call(self, func, *args):
+            calls.append(func)
+            time.sleep(0.05)
+            return 'photo', 'f' * 32
+
+        def close(self):
+            pass
+
+    calls = []
+    heif_file(tmp_path / 'IMG_0001.HEIC', [b'tile'])
+
+    pipeline = ingest.Pipeline(tmp_path / 'repo', ingest.Summary())
+    pipeline.decode_pool = InlinePool()
+    stats = Stats()
+    with collect(stats):
+        result = pipeline.decode(tmp_path / 'IMG_0001.HEIC')
+
+    kind, checksum, date = result
+    assert (kind, checksum) == ('photo', 'f' * 32)
+    assert date.replace(tzinfo=None) == datetime(2021, 3, 1, 8, 0, 0)
+    assert calls == [ingest.compute_checksum]
+    stages = stats.as_dict()['stages']
+    assert stages['hash']['calls'] == 1 and stages['date']['calls'] == 1
@@ -0,0 +1,422 @@
+import pytest
+
+
+def fake_inspect(file_obj):
+    """
+    Stand in for the checksum and date stage using the raw file bytes
+
+    """
+    import hashlib
+    from datetime import datetime
+    from zoneinfo import ZoneInfo
+    from photo.ingest import PHOTO_EXT
+
+    if file_obj.suffix.upper() not in PHOTO_EXT:
+        return None, None, None
+    checksum = hashlib.md5(file_obj.read_bytes()).hexdigest()
+    date = datetime(2020, 10, 18, 12, 30, 0, tzinfo=ZoneInfo("America/Los_Angeles"))
+    return 'photo', checksum, date
+
+
+def test_canonical_path():
+    """
+    Files are placed by date with the checksum prefix in the name
+
+    """
+    from photo.ingest import canonical_path
+    from datetime import datetime
+    from pathlib import Path
+
+    date = datetime(2015, 10, 17, 14, 6, 28)
+    insert_path = canonical_path('/repo', date, '1e0440aabbccdd', '.jpg')
+    assert insert_path == Path('/repo/2015/10/151017_140628_1e0440aa.jpg')
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_ingest_summary(tmp_path, monkeypatch, jobs):
+    """
+    The pipeline should place files and count them the same way for any
+    number of workers
+
+    """
+    from photo import ingest
+
+    monkeypatch.setattr(ingest, 'inspect_file', fake_inspect)
+
+    inbox = tmp_path / 'inbox'
+    repo = tmp_path / 'repo'
+    (inbox / '.thumbnails').mkdir(parents=True)
+    for idx in range(20):
+        (inbox / 'img{0}.jpg'.format(idx)).write_bytes(bytes([idx]) * 100)
+    # same content as img3, so it lands on the same canonical path
+    (inbox / 'copy.jpg').write_bytes(bytes([3]) * 100)
+    (inbox / 'notes.txt').write_text('not a photo')
+    (inbox / '.thumbnails' / 'img0.jpg').write_bytes(b'thumb')
+
+    summary = ingest.ingest([inbox], True, repo, jobs=jobs)
+    # the hidden directory is pruned from the walk
+    assert summary.total_files == 22
+    assert summary.added_files == 20
+    assert summary.duplicate_files == 1
+    assert summary.skipped_files == 1
+    assert len(list(repo.rglob('*.jpg'))) == 20
+
+    # a second run only finds duplicates
+    summary = ingest.ingest([inbox], True, repo, jobs=jobs)
+    assert summary.added_files == 0
+    assert summary.duplicate_files == 21
+
+
+def test_ingest_fingerprint_cache(tmp_path, monkeypatch):
+    """
+    A second walk over an unchanged inbox should not read any file again
+
+    """
+    from photo import ingest
+    from photo.fingerprint import FingerprintCache
+    import os
+
+    calls = []
+
+    def counting_inspect(file_obj):
+        calls.append(file_obj.name)
+        return fake_inspect(file_obj)
+
+    monkeypatch.setattr(ingest, 'inspect_file', counting_inspect)
+
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    for idx in range(5):
+        (inbox / 'img{0}.jpg'.format(idx)).write_bytes(bytes([idx]) * 100)
+
+    with FingerprintCache(tmp_path / 'cache.db') as cache:
+        summary = ingest.ingest([inbox], True, tmp_path / 'repo', cache=cache)
+        assert summary.added_files == 5
+        assert len(calls) == 5
+
+        summary = ingest.ingest([inbox], True, tmp_path / 'repo', cache=cache)
+        assert summary.duplicate_files == 5
+        assert len(calls) == 5
+        assert cache.hits == 5
+
+    # Touching a file makes it new again, even across processes
+    stat = os.stat(inbox / 'img0.jpg')
+    os.utime(inbox / 'img0.jpg', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    with FingerprintCache(tmp_path / 'cache.db') as cache:
+        ingest.ingest([inbox], True, tmp_path / 'repo', cache=cache)
+        assert calls[5:] == ['img0.jpg']
+
+
+def test_fingerprint_cache_eviction(tmp_path):
+    """
+    The cache keeps only the most recently used entries
+
+    """
+    from photo.fingerprint import FingerprintCache
+    import os
+
+    stats = []
+    for idx in range(4):
+        file_path = tmp_path / 'file{0}'.format(idx)
+        file_path.write_bytes(bytes(idx))
+        stats.append(os.stat(file_path))
+
+    with FingerprintCache(tmp_path / 'cache.db', max_entries=2) as cache:
+        for idx, stat in enumerate(stats):
+            cache.put(stat, 'photo', 'checksum{0}'.format(idx), None)
+        # use the oldest entry so it survives
+        assert cache.get(stats[0]) == ('photo', 'checksum0', None)
+
+    with FingerprintCache(tmp_path / 'cache.db', max_entries=2) as cache:
+        assert len(cache) == 2
+        assert cache.get(stats[0]) is not None
+        assert cache.get(stats[3]) is not None
+        assert cache.get(stats[1]) is None
+
+
+@pytest.mark.parametrize('mode', ['auto', 'copy_file_range', 'hardlink', 'move', 'copy'])
+def test_place_modes(tmp_path, mode):
+    """
+    Every placement mode leaves an identical file at the destination
+
+    """
+    from photo.placement import place
+    import os
+
+    src = tmp_path / 'src.jpg'
+    dest = tmp_path / 'dest.jpg'
+    src.write_bytes(os.urandom(100000))
+    os.utime(src, (1000000000, 1000000000))
+    content = src.read_bytes()
+
+    if mode == 'copy_file_range' and not hasattr(os, 'copy_file_range'):
+        pytest.skip('copy_file_range is not available')
+
+    used = place(src, dest, mode)
+    assert dest.read_bytes() == content
+    assert dest.stat().st_mtime == 1000000000
+    if mode == 'auto':
+        assert used in ['reflink', 'copy_file_range', 'copy']
+    else:
+        assert used == mode
+    assert src.exists() == (mode != 'move')
+    if mode == 'hardlink':
+        assert src.stat().st_ino == dest.stat().st_ino
+
+
+def test_ingest_stats(tmp_path, monkeypatch):
+    """
+    The stages of an ingest are timed and counted, and can be exported
+
+    """
+    from photo import ingest
+    from photo.stats import Stats, collect, stage
+    import cProfile
+    import json
+
+    monkeypatch.setattr(ingest, 'inspect_file', fake_inspect)
+
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    for idx in range(3):
+        (inbox / 'img{0}.jpg'.format(idx)).write_bytes(bytes([idx]) * 100)
+
+    # nothing is recorded outside of collect
+    with stage('copy', 100):
+        pass
+
+    stats = Stats()
+    profiler = cProfile.Profile()
+    stats.attach_profiler('copy', profiler)
+    with collect(stats):
+        ingest.ingest([inbox], True, tmp_path / 'repo', jobs=2)
+
+    result = stats.as_dict()
+    assert list(result['stages']) == ['walk', 'exists', 'copy']
+    assert result['stages']['copy'] == {'calls': 3, 'seconds': result['stages']['copy']['seconds'], 'bytes': 300}
+    assert result['stages']['exists']['calls'] == 3
+    assert result['elapsed'] > 0
+    assert profiler.getstats()
+
+    assert json.loads(stats.export('json'))['stages']['copy']['bytes'] == 300
+    prometheus = stats.export('prometheus')
+    assert 'photo_add_stage_bytes_total{stage="copy"} 300' in prometheus.splitlines()
+    assert '# TYPE photo_add_stage_calls_total counter' in prometheus
+    assert 'copy' in stats.export('text')
+
+
+def test_async_ingest(tmp_path, monkeypatch):
+    """
+    The asyncio driver places files like the threaded one, retrying
+    transient errors
+
+    """
+    from photo import ingest
+    from photo.async_ingest import ingest_async, RetryPolicy
+    import asyncio
+    import errno
+
+    monkeypatch.setattr(ingest, 'inspect_file', fake_inspect)
+
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    for idx in range(10):
+        (inbox / 'img{0}.jpg'.format(idx)).write_bytes(bytes([idx]) * 100)
+    (inbox / 'copy.jpg').write_bytes(bytes([3]) * 100)
+    (inbox / 'notes.txt').write_text('not a photo')
+
+    # every first placement of a file fails as a flaky mount would
+    failed = set()
+    place_file = ingest.place_file
+
+    def flaky_place(file_obj, insert_path, mode='auto'):
+        if file_obj not in failed:
+            failed.add(file_obj)
+            raise OSError(errno.EIO, 'Input/output error')
+        place_file(file_obj, insert_path, mode)
+
+    monkeypatch.setattr(ingest, 'place_file', flaky_place)
+
+    retry = RetryPolicy(delay=0)
+    summary = asyncio.run(ingest_async([inbox], True, tmp_path / 'async', concurrency=3, retry=retry))
+    assert (summary.added_files, summary.duplicate_files, summary.skipped_files) == (10, 1, 1)
+    assert retry.retries == 10
+
+    monkeypatch.setattr(ingest, 'place_file', place_file)
+    ingest.ingest([inbox], True, tmp_path / 'threaded')
+    assert ({path.relative_to(tmp_path / 'async') for path in (tmp_path / 'async').rglob('*.jpg')}
+            == {path.relative_to(tmp_path / 'threaded') for path in (tmp_path / 'threaded').rglob('*.jpg')})
+
+    # errors that are not transient are not retried
+    def denied_place(file_obj, insert_path, mode='auto'):
+        raise PermissionError(errno.EACCES, 'Permission denied')
+
+    monkeypatch.setattr(ingest, 'place_file', denied_place)
+    with pytest.raises(PermissionError):
+        asyncio.run(ingest_async([inbox], True, tmp_path / 'denied', retry=retry))
+
+
+def test_resume_ingest(tmp_path, monkeypatch):
+    """
+    An interrupted import leaves no partial file behind and resumes from its
+    journal without reading finished files again
+
+    """
+    from photo import ingest
+    from photo.journal import Journal, JOURNAL_PATTERN
+
+    calls = []
+
+    def counting_inspect(file_obj):
+        calls.append(file_obj.name)
+        return fake_inspect(file_obj)
+
+    monkeypatch.setattr(ingest, 'inspect_file', counting_inspect)
+
+    inbox = tmp_path / 'inbox'
+    repo = tmp_path / 'repo'
+    inbox.mkdir()
+    for idx in range(6):
+        (inbox / 'img{0}.jpg'.format(idx)).write_bytes(bytes([idx]) * 100)
+    (inbox / 'notes.txt').write_text('not a photo')
+
+    from photo import placement
+    place = placement.place
+
+    def crashing_place(src, dest, mode='auto'):
+        if src.name == 'img4.jpg':
+            # half a file, then the machine goes down
+            dest.write_bytes(b'\x04' * 10)
+            raise KeyboardInterrupt
+        return place(src, dest, mode)
+
+    monkeypatch.setattr(placement, 'place', crashing_place)
+    with pytest.raises(KeyboardInterrupt):
+        with Journal(repo) as journal:
+            journal.start([inbox], True)
+            ingest.ingest([inbox], True, repo, jobs=1, copy_jobs=1, journal=journal)
+
+    assert len(list(repo.glob(JOURNAL_PATTERN))) == 1
+    placed = list(repo.rglob('*.jpg'))
+    assert len(placed) == 5
+    # nothing truncated sits at a canonical path, and no partial is left
+    assert all(len(path.read_bytes()) == 100 for path in placed)
+    assert list(repo.rglob('.*.partial')) == []
+
+    monkeypatch.setattr(placement, 'place', place)
+    inspected = len(calls)
+    with Journal(repo, resume=True) as journal:
+        assert journal.args['walk'] is True
+        summary = ingest.ingest([inbox], True, repo, jobs=1, journal=journal)
+
+    # nothing is read again; the planned placement is finished from the
+    # journal
+    assert calls[inspected:] == []
+    assert summary.resumed_files == 7
+    assert len(list(repo.rglob('*.jpg'))) == 6
+    assert list(repo.glob(JOURNAL_PATTERN)) == []
+
+
+def test_journal_lock(tmp_path):
+    """
+    Concurrent imports write separate journals, and only the journals of
+    imports no longer running are resumed
+
+    """
+    from photo.journal import Journal, interrupted
+
+    repo = tmp_path / 'repo'
+    first = Journal(repo)
+    first.start([tmp_path / 'a'], False)
+    with Journal(repo) as second:
+        second.start([tmp_path / 'b'], False)
+        assert first.path != second.path
+        # both are held by running imports
+        assert interrupted(repo) == []
+        with pytest.raises(IOError):
+            Journal(repo, resume=True)
+        with pytest.raises(IOError):
+            Journal(repo, resume=first.path)
+
+    # the completed import left nothing; the interrupted one is resumable
+    first.close()
+    assert interrupted(repo) == [first.path]
+    with Journal(repo, resume=True) as resumed:
+        assert resumed.path == first.path
+        assert resumed.args['path'] == [str(tmp_path / 'a')]
+        assert interrupted(repo) == []
+    assert not first.path.exists()
+
+
+def test_ingest_real_photo(tmp_path):
+    """
+    A generated JPEG goes through the real checksum and date readers
+
+    """
+    from photo.catalog import Catalog
+    from photo.exif import calculate_checksum
+    from photo.ingest import ingest
+    from PIL import Image
+
+    inbox = tmp_path / 'inbox'
+    repo = tmp_path / 'repo'
+    inbox.mkdir()
+    img = Image.new('RGB', (64, 48), 'purple')
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9003] = '2021:05:06 07:08:09'
+    exif[0x010e] = 'travel,karen'
+    img.save(inbox / 'IMG_0001.JPG', exif=exif)
+    # the same pixels under other metadata are a duplicate
+    img.save(inbox / 'IMG_0002.JPG', exif=exif, comment=b'edited')
+
+    with Catalog(repo) as catalog:
+        summary = ingest([inbox], True, repo, jobs=2, catalog=catalog)
+        assert summary.added_files == 1 and summary.duplicate_files == 1
+        assert summary.corrupt_count == 0 and summary.missing_date == 0
+
+        checksum = calculate_checksum(inbox / 'IMG_0001.JPG', legacy=True)
+        placed = repo / '2021' / '05' / f'210506_070809_{checksum[:8]}.JPG'
+        assert placed.exists()
+        assert catalog.get(placed)['checksum'] == checksum
+        assert catalog.get_tags(placed) == ['travel', 'karen']
+
+
+def test_photo_hash_schemes(tmp_path):
+    """
+    Photos keep the legacy checksum unless the raw scheme is asked for
+
+    """
+    from photo.exif import calculate_checksum
+    from photo.ingest import compute_checksum
+    from PIL import Image
+
+    source = tmp_path / 'IMG_0001.JPG'
+    Image.new('RGB', (64, 48), 'purple').save(source)
+
+    legacy = calculate_checksum(source, legacy=True)
+    raw = calculate_checksum(source, legacy=False)
+    assert legacy != raw
+    assert compute_checksum(source) == ('photo', legacy)
+    assert compute_checksum(source, photo_hash='raw') == ('photo', raw)
+
+
+def test_async_ingest_processes(tmp_path, monkeypatch):
+    """
+    The asyncio driver sizes the HEIC decode pool from jobs
+
+    """
+    from photo import ingest
+    from photo.async_ingest import ingest_async
+    import asyncio
+
+    sizes = []
+
+    class RecordingPipeline(ingest.Pipeline):
+        def __init__(self, *args, processes=0, **kwargs):
+            sizes.append(processes)
+            super().__init__(*args, processes=processes, **kwargs)
+
+    monkeypatch.setattr(ingest, 'Pipeline', RecordingPipeline)
+    (tmp_path / 'inbox').mkdir()
+    asyncio.run(ingest_async([tmp_path / 'inbox'], True, tmp_path / 'repo', jobs=3))
+    assert sizes == [3]
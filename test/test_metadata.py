@@ -96,3 +96,38 @@ def test_filename_creation():
         elif img == 'test_scanned_photo.jpg':
             assert name is None
             assert loc is None
+
+
+def test_cli_meta_formats(tmp_path, capsys):
+    """
+    Native fields of many files are shown as a table, json or csv
+
+    """
+    from photo.cli import cli_meta
+    from PIL import Image
+    import csv
+    import io
+    import json
+
+    for idx in range(3):
+        exif = Image.Exif()
+        exif[0x0110] = 'Camera {0}'.format(idx)
+        exif[0x010E] = 'travel, home'
+        Image.new('RGB', (8, 8)).save(tmp_path / 'img{0}.jpg'.format(idx), exif=exif)
+    (tmp_path / 'files.txt').write_text('\n'.join(str(tmp_path / 'img{0}.jpg'.format(idx)) for idx in [2, 0]))
+
+    fields = ['Model', 'ImageDescription']
+    assert cli_meta([str(tmp_path / '*.jpg')], 'json', fields) == 3
+    records = json.loads(capsys.readouterr().out)
+    assert [record['Model'] for record in records] == ['Camera 0', 'Camera 1', 'Camera 2']
+    assert records[0]['ImageDescription'] == 'travel, home'
+
+    assert cli_meta(['@' + str(tmp_path / 'files.txt')], 'csv', fields) == 2
+    rows = list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+    assert [row['Model'] for row in rows] == ['Camera 2', 'Camera 0']
+    assert list(rows[0]) == ['SourceFile', 'Model', 'ImageDescription']
+
+    cli_meta([str(tmp_path / 'img1.jpg')], 'table', fields)
+    header, rule, row = capsys.readouterr().out.splitlines()
+    assert header.split() == ['SourceFile', 'Model', 'ImageDescription']
+    assert row.endswith('Camera 1  travel, home')
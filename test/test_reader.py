@@ -0,0 +1,173 @@
+import pytest
+
+
+def box(kind, payload):
+    import struct
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def tiff_exif(description, model, date):
+    """
+    Build a little endian TIFF block with the fields the reader looks for
+
+    """
+    from PIL import Image
+
+    exif = Image.Exif()
+    exif[0x010E] = description
+    exif[0x0110] = model
+    exif.get_ifd(0x8769)[0x9003] = date
+    # Pillow prefixes the Exif APP1 identifier
+    return exif.tobytes()[6:]
+
+
+def test_read_sample_files():
+    """
+    The native reader agrees with exiftool on the sample files
+
+    """
+    from photo.reader import read_fields
+    from os.path import dirname, join
+
+    test_root = dirname(__file__)
+    data_dir = join(test_root, 'data')
+
+    fields = read_fields(join(data_dir, 'test_iphone_photo.jpg'))
+    assert fields['format'] == 'jpeg'
+    assert fields['Model'] == 'iPhone 5s'
+    assert fields['CreateDate'] == '2015:10:17 14:06:28'
+
+    fields = read_fields(join(data_dir, 'test_iphone_video.mov'))
+    assert fields['format'] == 'quicktime'
+    assert fields['Model'] == 'iPhone 5s'
+    assert fields['CreateDate'] == '2016:08:10 17:17:36'
+
+    fields = read_fields(join(data_dir, 'test_scanned_photo.jpg'))
+    assert fields['CreateDate'] is None and fields['Model'] is None
+
+    assert read_fields(join(data_dir, 'test_not_photo.txt')) is None
+
+
+def test_read_jpeg(tmp_path):
+    """
+    Descriptions and dates written into a JPEG are read back
+
+    """
+    from photo.reader import read_fields, read_date
+    from PIL import Image
+
+    img_path = tmp_path / 'tagged.jpg'
+    exif = Image.Exif()
+    exif[0x010E] = 'travel,karen'
+    exif.get_ifd(0x8769)[0x9003] = '2019:07:04 21:30:00'
+    Image.new('RGB', (8, 8)).save(img_path, exif=exif)
+
+    fields = read_fields(img_path)
+    assert fields['ImageDescription'] == 'travel,karen'
+    assert fields['DateTimeOriginal'] == '2019:07:04 21:30:00'
+
+    date = read_date(img_path)
+    assert (date.year, date.month, date.day, date.hour) == (2019, 7, 4, 21)
+    assert date.tzinfo is not None
+
+
+def test_read_heif(tmp_path):
+    """
+    The Exif item of a HEIF file is found through iinf and iloc
+
+    """
+    from photo.reader import read_fields
+    import struct
+
+    tiff = tiff_exif('home', 'iPhone 12', '2021:03:01 08:00:00')
+    exif_item = struct.pack('>I', 0) + tiff
+
+    ftyp = box(b'ftyp', b'heic' + struct.pack('>I', 0) + b'mif1heic')
+    hdlr = box(b'hdlr', bytes(8) + b'pict' + bytes(13))
+    infe = box(b'infe', bytes([2, 0, 0, 0]) + struct.pack('>HH', 7, 0) + b'Exif' + b'\x00')
+    iinf = box(b'iinf', bytes(4) + struct.pack('>H', 1) + infe)
+
+    def build(offset):
+        # version 0, 4 byte offsets and lengths, no base offset
+        iloc = box(b'iloc', bytes(4) + bytes([0x44, 0x00]) + struct.pack('>H', 1)
+                   + struct.pack('>HHHII', 7, 0, 1, offset, len(exif_item)))
+        meta = box(b'meta', bytes(4) + hdlr + iinf + iloc)
+        return ftyp + meta
+
+    header = build(0)
+    data = build(len(header) + 8) + box(b'mdat', exif_item)
+    img_path = tmp_path / 'sample.heic'
+    img_path.write_bytes(data)
+
+    fields = read_fields(img_path)
+    assert fields['format'] == 'heif'
+    assert fields['ImageDescription'] == 'home'
+    assert fields['Model'] == 'iPhone 12'
+    assert fields['DateTimeOriginal'] == '2021:03:01 08:00:00'
+
+
+def test_read_quicktime(tmp_path):
+    """
+    Movie dates come from mvhd, or mdhd when mvhd is not set
+
+    """
+    from photo.reader import read_fields, read_date
+    from datetime import datetime, timezone
+    import struct
+
+    seconds = int((datetime(2016, 8, 10, 17, 17, 36, tzinfo=timezone.utc)
+                   - datetime(1904, 1, 1, tzinfo=timezone.utc)).total_seconds())
+
+    mvhd = box(b'mvhd', bytes(4) + struct.pack('>II', seconds, seconds) + bytes(88))
+    movie = box(b'ftyp', b'qt  ' + bytes(4)) + box(b'mdat', bytes(64)) + box(b'moov', mvhd)
+    mov_path = tmp_path / 'clip.mov'
+    mov_path.write_bytes(movie)
+
+    fields = read_fields(mov_path)
+    assert fields['CreateDate'] == '2016:08:10 17:17:36'
+    assert read_date(mov_path).astimezone(timezone.utc).hour == 17
+
+    mvhd = box(b'mvhd', bytes(4) + struct.pack('>II', 0, 0) + bytes(88))
+    mdhd = box(b'mdhd', bytes([1, 0, 0, 0]) + struct.pack('>QQ', seconds, seconds) + bytes(12))
+    trak = box(b'trak', box(b'mdia', mdhd))
+    mov_path.write_bytes(box(b'moov', mvhd + trak))
+    assert read_fields(mov_path)['CreateDate'] == '2016:08:10 17:17:36'
+
+
+def test_read_fallback(tmp_path):
+    """
+    Unsupported formats are handed to the fallback
+
+    """
+    from photo.reader import read_date
+
+    other = tmp_path / 'photo.png'
+    other.write_bytes(b'\x89PNG\r\n\x1a\n' + bytes(32))
+    assert read_date(other) is None
+    assert read_date(other, fallback=lambda filename: 'fallback') == 'fallback'
+
+
+def test_date_fallback(tmp_path, monkeypatch):
+    """
+    Formats the reader does not parse get their date from exiftool
+
+    """
+    from photo import exiftool
+    from photo.ingest import inspect_file
+    from datetime import datetime
+    from PIL import Image
+    import json
+
+    calls = []
+
+    def fake_execute(*args):
+        calls.append(args)
+        return json.dumps([{'SourceFile': args[-1], 'CreateDate': '2019:07:04 21:15:00'}]).encode('utf-8')
+
+    monkeypatch.setattr(exiftool, 'execute', fake_execute)
+    Image.new('RGB', (8, 8), 'green').save(tmp_path / 'scan.png')
+
+    kind, checksum, date = inspect_file(tmp_path / 'scan.png')
+    assert kind == 'photo' and checksum is not None
+    assert date.replace(tzinfo=None) == datetime(2019, 7, 4, 21, 15, 0)
+    assert len(calls) == 1
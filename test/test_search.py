@@ -0,0 +1,101 @@
+import pytest
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    from photo.catalog import Catalog
+
+    tagged = {'a.jpg': ['travel', 'karen'],
+              'b.jpg': ['travel', 'work'],
+              'c.jpg': ['home', 'karen'],
+              'd.jpg': ['travelogue', 'mult word'],
+              'e.jpg': [],
+              }
+
+    catalog = Catalog(tmp_path)
+    for name, tags in tagged.items():
+        (tmp_path / name).write_bytes(name.encode())
+        catalog.add(tmp_path / name, name, tags=tags)
+    yield catalog
+    catalog.close()
+
+
+def names(paths):
+    return [path.name for path in paths]
+
+
+def test_search_queries(catalog):
+    """
+    Boolean tag queries are answered from the catalog
+
+    """
+    from photo.search import search
+
+    assert names(search('travel', catalog)) == ['a.jpg', 'b.jpg']
+    assert names(search('travel and karen', catalog)) == ['a.jpg']
+    assert names(search('travel karen', catalog)) == ['a.jpg']
+    assert names(search('travel or home', catalog)) == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert names(search('karen not travel', catalog)) == ['c.jpg']
+    assert names(search('not karen', catalog)) == ['b.jpg', 'd.jpg', 'e.jpg']
+    assert names(search('trav*', catalog)) == ['a.jpg', 'b.jpg', 'd.jpg']
+    assert names(search('(home OR work) and not karen', catalog)) == ['b.jpg']
+    assert names(search('"mult word"', catalog)) == ['d.jpg']
+    assert names(search('football', catalog)) == []
+
+
+def test_malformed_queries(catalog):
+    """
+    Malformed queries raise a ValueError
+
+    """
+    from photo.search import search
+
+    for query in ['', 'travel and', '(travel', 'travel)', 'or karen']:
+        with pytest.raises(ValueError):
+            search(query, catalog)
+
+
+def test_update_tags_syncs_catalog(tmp_path, monkeypatch):
+    """
+    Changing the tags of a repository file updates the catalog
+
+    """
+    from photo.catalog import Catalog, sync_tags
+    from photo.search import search
+
+    photo_path = tmp_path / 'a.jpg'
+    photo_path.write_bytes(b'pixels')
+    with Catalog(tmp_path) as catalog:
+        catalog.add(photo_path, 'abc', tags=['travel'])
+
+    import photo.config
+    monkeypatch.setattr(photo.config, 'get_global_config', lambda: {'repo': {'path': str(tmp_path)}})
+    sync_tags(photo_path, ['home'])
+    # files outside the repository are ignored
+    sync_tags(tmp_path.parent / 'elsewhere.jpg', ['home'])
+
+    with Catalog(tmp_path) as catalog:
+        assert names(search('home', catalog)) == ['a.jpg']
+        assert search('travel', catalog) == []
+
+
+def test_search_after_rebuild(tmp_path):
+    """
+    Tags embedded in files placed before the catalog are found once the
+    catalog is rebuilt
+
+    """
+    from photo.catalog import Catalog, rebuild
+    from photo.search import search
+    from PIL import Image
+
+    photo_path = tmp_path / '2019' / '03' / '190302_101010_0badc0de.jpg'
+    photo_path.parent.mkdir(parents=True)
+    exif = Image.Exif()
+    exif[0x010e] = 'travel,karen'
+    Image.new('RGB', (16, 16), 'olive').save(photo_path, exif=exif)
+
+    with Catalog(tmp_path) as catalog:
+        assert search('karen', catalog) == []
+        rebuild(catalog, jobs=1)
+        assert search('karen and travel', catalog) == [photo_path]
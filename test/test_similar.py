@@ -0,0 +1,87 @@
+import pytest
+
+
+def test_perceptual_hash(tmp_path):
+    """
+    A re-encoded, resized copy hashes close to the original, another photo
+    does not
+
+    """
+    from photo.similar import perceptual_hash, SCHEMES
+    from PIL import Image
+    import numpy as np
+
+    rng = np.random.default_rng(1)
+    scene = rng.integers(0, 256, (60, 80, 3), dtype=np.uint8)
+    original = Image.fromarray(scene).resize((1600, 1200), Image.Resampling.BICUBIC)
+    original.save(tmp_path / 'original.jpg', quality=95)
+    original.resize((400, 300)).save(tmp_path / 'copy.jpg', quality=60)
+    other = rng.integers(0, 256, (60, 80, 3), dtype=np.uint8)
+    Image.fromarray(other).resize((1600, 1200)).save(tmp_path / 'other.jpg')
+
+    for scheme in SCHEMES:
+        hashes = {name: perceptual_hash(tmp_path / f'{name}.jpg', scheme) for name in ['original', 'copy', 'other']}
+        assert (hashes['original'] ^ hashes['copy']).bit_count() <= 4
+        assert (hashes['original'] ^ hashes['other']).bit_count() > 12
+
+    with pytest.raises(ValueError):
+        perceptual_hash(tmp_path / 'original.jpg', 'ahash')
+
+
+def test_hamming_index():
+    """
+    The multi-index finds exactly what a full comparison finds
+
+    """
+    from photo.similar import HammingIndex, group_pairs
+    import random
+
+    rng = random.Random(2)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    for idx in range(0, 200, 2):
+        flips = rng.sample(range(64), rng.randrange(8))
+        hashes[idx + 1] = hashes[idx] ^ sum(1 << bit for bit in flips)
+    # the top bit set, which SQLite and NumPy must not mangle
+    hashes.append(hashes[0] | 1 << 63)
+
+    index = HammingIndex(hashes, distance=6)
+    expected = {(left, right) for left in range(len(hashes)) for right in range(left + 1, len(hashes))
+                if (hashes[left] ^ hashes[right]).bit_count() <= 6}
+    assert index.pairs() == expected
+    assert index.pairs(2) == {pair for pair in expected if (hashes[pair[0]] ^ hashes[pair[1]]).bit_count() <= 2}
+
+    for idx in range(0, 40):
+        matches = index.query(hashes[idx])
+        assert sorted(match for _, match in matches) == sorted(
+            other for other in range(len(hashes)) if (hashes[idx] ^ hashes[other]).bit_count() <= 6)
+        assert (0, idx) in matches
+
+    assert group_pairs([(1, 2), (5, 4), (2, 3)]) == [[1, 2, 3], [4, 5]]
+    with pytest.raises(ValueError):
+        index.query(hashes[0], 7)
+
+
+def test_index_photos(tmp_path):
+    """
+    Perceptual hashes are stored once per checksum in the catalog
+
+    """
+    from photo.catalog import Catalog
+    from photo.similar import index_photos, perceptual_hash
+    from PIL import Image
+
+    Image.new('RGB', (64, 48), (200, 10, 10)).save(tmp_path / 'a.jpg')
+    (tmp_path / 'b.jpg').write_bytes((tmp_path / 'a.jpg').read_bytes())
+    (tmp_path / 'broken.jpg').write_bytes(b'not a jpeg')
+    photos = [(tmp_path / 'a.jpg', 'red'), (tmp_path / 'b.jpg', 'red'), (tmp_path / 'broken.jpg', 'broken'),
+              (tmp_path / 'clip.mov', 'video')]
+
+    with Catalog(tmp_path) as catalog:
+        catalog.set_perceptual_hashes('phash', {'top': 1 << 63})
+        hashed, failures = index_photos(photos, catalog, 'dhash', jobs=1)
+        assert hashed == 1 and len(failures) == 1
+        assert catalog.perceptual_hashes('dhash') == {'red': perceptual_hash(tmp_path / 'a.jpg')}
+        assert catalog.perceptual_hashes('phash') == {'top': 1 << 63}
+
+        # only photos without a hash are read again
+        assert index_photos(photos[:2], catalog, 'dhash', jobs=1) == (0, [])
@@ -0,0 +1,101 @@
+import pytest
+
+# the time allowed for importing the command line entry point, in seconds
+STARTUP_BUDGET = 0.1
+
+
+def run_python(code, tmp_path):
+    """
+    Run code in a fresh interpreter with an empty configuration directory
+
+    """
+    import os
+    import subprocess
+    import sys
+
+    env = dict(os.environ)
+    env['XDG_CONFIG_HOME'] = str(tmp_path / 'config')
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True,
+                            check=True)
+    return result.stdout
+
+
+def test_import_is_lazy(tmp_path):
+    """
+    Importing the command line entry point loads no heavy dependency and
+    writes no configuration
+
+    """
+    code = ('import sys, photo.cli\n'
+            'print(" ".join(sorted(m for m in sys.modules if m in '
+            '["yaml", "PIL", "numpy", "sqlite3", "photo.exif", "photo.config"])))')
+    assert run_python(code, tmp_path).strip() == ''
+    assert not (tmp_path / 'config').exists()
+
+
+def test_version_is_lazy(tmp_path):
+    """
+    Building the argument parser and printing the version loads none of the
+    command modules
+
+    """
+    code = ('import sys, photo.cli\n'
+            'photo.cli.main_entry(["version"])\n'
+            'print(" ".join(sorted(m for m in sys.modules if m in '
+            '["yaml", "PIL", "numpy", "sqlite3", "photo.exif", "photo.config", "photo.placement", '
+            '"photo.videohash", "photo.stats", "photo.similar", "photo.heic"])))')
+    version, loaded = run_python(code, tmp_path).splitlines()
+    assert version.startswith('Photo Version: ') and version != 'Photo Version: '
+    assert loaded == ''
+    assert not (tmp_path / 'config').exists()
+
+
+@pytest.mark.parametrize('statement', ['import photo.cli, argparse',
+                                       'import photo.cli; photo.cli.main_entry(["version"])'])
+def test_startup_budget(tmp_path, statement):
+    """
+    The command line entry point imports, and answers photo version, within
+    the startup budget
+
+    """
+    code = ('import time\n'
+            'start = time.perf_counter()\n'
+            f'{statement}\n'
+            'print(time.perf_counter() - start)')
+    # the best of a few runs, to ride out a busy machine
+    elapsed = min(float(run_python(code, tmp_path).splitlines()[-1]) for _ in range(3))
+    assert elapsed < STARTUP_BUDGET
+
+
+def test_config_written_by_init_only(tmp_path, monkeypatch, capsys):
+    """
+    Reading the configuration writes nothing; photo config init creates the
+    file, which is then parsed once
+
+    """
+    from photo import config
+    from photo.cli import main_entry
+
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path))
+    monkeypatch.setattr(config, '_cache', {})
+
+    # without a file the defaults apply, with a warning on stderr
+    cfg = config.get_global_config()
+    rc_file = tmp_path / 'photo' / 'photorc'
+    assert not rc_file.exists()
+    assert cfg['add']['mode'] == config.cfgmap['add']['mode']
+    captured = capsys.readouterr()
+    assert captured.out == '' and 'photo config init' in captured.err
+
+    main_entry(['config', 'init'])
+    assert rc_file.exists()
+    cfg = config.get_global_config()
+    assert set(config.cfgmap) <= set(cfg)
+    assert 'doc' not in cfg['add']
+
+    # later reads come from the cache, and a complete file is not rewritten
+    contents = rc_file.read_text()
+    assert config.get_global_config() is cfg
+    config.generate_global_config()
+    assert rc_file.read_text() == contents
@@ -136,3 +136,164 @@ def test_cli_tag():
     assert tags == []
 
 
+
+
+def test_cli_tag_batch(tmp_path):
+    """
+    Test tagging globs, directories and file lists in one pass
+
+    """
+    from photo.cli import cli_tag
+    import photo
+    import shutil
+    from os.path import dirname, join
+
+    test_root = dirname(__file__)
+    data_dir = join(test_root, 'data')
+
+    album = tmp_path / 'album'
+    album.mkdir()
+    for idx in range(3):
+        shutil.copy(join(data_dir, 'test_gopro_photo.jpg'), album / 'img{0}.jpg'.format(idx))
+    filelist = tmp_path / 'files.txt'
+    filelist.write_text('{0}\n{1}\n'.format(album / 'img0.jpg', album / 'missing.jpg'))
+
+    # Globs are expanded even when quoted
+    results = cli_tag(str(album / '*.jpg'), '+travel +karen')
+    assert list(results.values()) == [True, True, True]
+    for idx in range(3):
+        assert photo.get_tags(str(album / 'img{0}.jpg'.format(idx))) == ['travel', 'karen']
+
+    # Files from a list; missing files are reported rather than raised
+    results = cli_tag(['@{0}'.format(filelist)], '-karen')
+    assert results == {str(album / 'img0.jpg'): True, str(album / 'missing.jpg'): False}
+    assert photo.get_tags(str(album / 'img0.jpg')) == ['travel']
+
+    # Directories stand for the files inside them
+    results = cli_tag([str(album)], 'sailing')
+    assert all(results.values())
+    assert photo.get_tags(str(album / 'img0.jpg')) == ['travel', 'sailing']
+    assert photo.get_tags(str(album / 'img2.jpg')) == ['travel', 'karen', 'sailing']
+
+
+def configure(tmp_path, monkeypatch, backend):
+    """
+    Point the configuration at a repository in tmp_path with a tag backend
+
+    """
+    from photo import config
+
+    (tmp_path / 'config' / 'photo').mkdir(parents=True)
+    (tmp_path / 'config' / 'photo' / 'photorc').write_text(
+        f'repo:\n    path: {tmp_path / "repo"}\ntags:\n    backend: {backend}\n')
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setattr(config, '_cache', {})
+
+
+def test_sidecar_backend(tmp_path, monkeypatch):
+    """
+    Tags are kept in an XMP sidecar until they are synced into the file
+
+    """
+    from photo import exif, tagstore
+
+    configure(tmp_path, monkeypatch, 'sidecar')
+    photo_path = tmp_path / 'a.jpg'
+    photo_path.write_bytes(b'pixels')
+
+    assert exif.write_tags({photo_path: ['one', 'two, three', '<&>']}) == {str(photo_path): True}
+    assert photo_path.read_bytes() == b'pixels'
+    assert tagstore.sidecar_path(photo_path).exists()
+    assert exif.read_tags([photo_path]) == {str(photo_path): ['one', 'two. three', '<&>']}
+    assert exif.get_tags(str(photo_path)) == ['one', 'two. three', '<&>']
+    assert exif.search_tags(str(photo_path), 'one')
+    assert exif.write_tags({tmp_path / 'missing.jpg': ['one']}) == {str(tmp_path / 'missing.jpg'): False}
+
+    flushed = {}
+    monkeypatch.setattr(exif, 'write_tags', lambda tag_map, backend=None: flushed.update(tag_map) or
+                        {filename: True for filename in tag_map})
+    assert tagstore.pending_tags([photo_path]) == {str(photo_path): ['one', 'two. three', '<&>']}
+    assert tagstore.sync_tags([photo_path]) == {str(photo_path): True}
+    assert flushed == {str(photo_path): ['one', 'two. three', '<&>']}
+    assert not tagstore.sidecar_path(photo_path).exists()
+    assert tagstore.sync_tags([photo_path]) == {}
+
+
+def test_catalog_backend(tmp_path, monkeypatch):
+    """
+    Tags of repository files are kept in the catalog, marked pending
+
+    """
+    from photo import exif, tagstore
+    from photo.catalog import Catalog, sync_tag_map
+
+    configure(tmp_path, monkeypatch, 'catalog')
+    photo_path = tmp_path / 'repo' / '2020' / 'a.jpg'
+    photo_path.parent.mkdir(parents=True)
+    photo_path.write_bytes(b'pixels')
+    with Catalog(tmp_path / 'repo') as catalog:
+        catalog.add(photo_path, 'checksum', tags=['old'])
+
+    assert exif.write_tags({photo_path: ['new']}) == {str(photo_path): True}
+    assert photo_path.read_bytes() == b'pixels'
+    assert exif.read_tags([photo_path]) == {str(photo_path): ['new']}
+    assert tagstore.pending_tags() == {str(photo_path): ['new']}
+
+    # the embedded write records the tags in the catalog, clearing the mark
+    def embed(tag_map, backend=None):
+        sync_tag_map(tag_map)
+        return {filename: True for filename in tag_map}
+
+    monkeypatch.setattr(exif, 'write_tags', embed)
+    assert tagstore.sync_tags() == {str(photo_path): True}
+    assert tagstore.pending_tags() == {}
+    with Catalog(tmp_path / 'repo') as catalog:
+        assert catalog.get_tags(photo_path) == ['new']
+
+
+def test_split_tag_args():
+    """
+    Files are told from tags by -f or --, never by what the arguments look
+    like
+
+    """
+    from photo.cli import split_tag_args
+
+    assert split_tag_args('2021/01/x.jpg', None, ['2021']) == (['2021/01/x.jpg'], ['2021'])
+    assert split_tag_args('a.jpg', None, ['b.jpg', '--', '+travel', '-work']) == \
+        (['a.jpg', 'b.jpg'], ['+travel', '-work'])
+    assert split_tag_args('2021', ['a.jpg', 'b.jpg'], ['-work']) == (['a.jpg', 'b.jpg'], ['2021', '-work'])
+    with pytest.raises(ValueError):
+        split_tag_args(None, None, [])
+
+
+def test_write_tags_newline(tmp_path):
+    """
+    A tag with a line break fails its file instead of the whole batch
+
+    """
+    from photo.exif import write_tags
+
+    photo_path = tmp_path / 'a.jpg'
+    photo_path.write_bytes(b'pixels')
+    assert write_tags({photo_path: ['two\nlines']}, backend='embedded') == {str(photo_path): False}
+
+
+def test_pending_sidecars(tmp_path, monkeypatch):
+    """
+    The sidecars of the repository are found by walking it, outside hidden
+    directories
+
+    """
+    from photo import tagstore
+
+    configure(tmp_path, monkeypatch, 'sidecar')
+    photo_path = tmp_path / 'repo' / '2020' / 'a.jpg'
+    hidden_path = tmp_path / 'repo' / '.thumbs' / 'b.jpg'
+    for path in [photo_path, hidden_path]:
+        path.parent.mkdir(parents=True)
+        path.write_bytes(b'pixels')
+        tagstore.write_sidecar(path, ['one'])
+    tagstore.write_sidecar(tmp_path / 'repo' / '2020' / 'gone.jpg', ['two'])
+
+    assert tagstore.pending_tags() == {str(photo_path): ['one']}
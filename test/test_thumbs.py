@@ -0,0 +1,43 @@
+import pytest
+
+
+def test_build_thumbnails(tmp_path):
+    """
+    Thumbnails are made once per checksum, upright and within the size
+
+    """
+    from photo.thumbs import build_thumbnails, thumb_path
+    from PIL import Image
+
+    photos = []
+    for idx, (mode, shape) in enumerate([('RGB', (1200, 800)), ('L', (300, 900)), ('RGBA', (640, 480))]):
+        img_path = tmp_path / 'img{0}.{1}'.format(idx, 'png' if mode == 'RGBA' else 'jpg')
+        Image.new(mode, shape).save(img_path)
+        photos.append((img_path, 'checksum{0}'.format(idx)))
+
+    # rotated a quarter turn by its Exif orientation
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new('RGB', (800, 400)).save(tmp_path / 'rotated.jpg', exif=exif)
+    photos.append((tmp_path / 'rotated.jpg', 'rotated'))
+    # a second copy of a photo, and a video
+    photos.append((tmp_path / 'img0.jpg', 'checksum0'))
+    photos.append((tmp_path / 'clip.mov', 'video'))
+
+    made, cached, failures = build_thumbnails(photos, tmp_path, size=128, jobs=2)
+    assert (made, cached, failures) == (4, 0, [])
+
+    sizes = {checksum: Image.open(thumb_path(tmp_path, checksum, 128)).size
+             for checksum in ['checksum0', 'checksum1', 'checksum2', 'rotated']}
+    assert sizes == {'checksum0': (128, 85), 'checksum1': (43, 128), 'checksum2': (128, 96),
+                     'rotated': (64, 128)}
+    assert not thumb_path(tmp_path, 'video', 128).exists()
+
+    # only missing thumbnails are made again
+    thumb_path(tmp_path, 'checksum1', 128).unlink()
+    assert build_thumbnails(photos, tmp_path, size=128, jobs=1) == (1, 3, [])
+
+    # failures are reported rather than raised
+    (tmp_path / 'broken.jpg').write_bytes(b'not a jpeg')
+    made, cached, failures = build_thumbnails([(tmp_path / 'broken.jpg', 'broken')], tmp_path, size=128)
+    assert made == 0 and len(failures) == 1
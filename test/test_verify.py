@@ -0,0 +1,151 @@
+import pytest
+
+
+def test_verify_repository(tmp_path, monkeypatch):
+    """
+    Changed files are told apart from stale records, and files verified
+    within the window are not read again
+
+    """
+    from photo import ingest
+    from photo.catalog import Catalog
+    from photo.verify import verify_repository
+    import hashlib
+
+    def fake_checksum(file_obj, video_hash=None, heic_hash=None, photo_hash=None):
+        reads.append(file_obj.name)
+        return 'photo', hashlib.md5(file_obj.read_bytes()).hexdigest()
+
+    monkeypatch.setattr(ingest, 'compute_checksum', fake_checksum)
+
+    files = {}
+    for name, content in [('good', b'good'), ('rotten', b'rotten'), ('renamed', b'renamed'),
+                          ('stale', b'stale'), ('gone', b'gone')]:
+        checksum = hashlib.md5(content).hexdigest()
+        prefix = checksum[:8] if name != 'renamed' else '00000000'
+        path = tmp_path / '2020' / '01' / f'200101_120000_{prefix}.jpg'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        files[name] = (path, checksum)
+    (tmp_path / 'plain.jpg').write_bytes(b'plain')
+    files['plain'] = (tmp_path / 'plain.jpg', hashlib.md5(b'plain').hexdigest())
+
+    with Catalog(tmp_path) as catalog:
+        for name, (path, checksum) in files.items():
+            catalog.add(path, 'f' * 32 if name == 'stale' else checksum)
+        files['rotten'][0].write_bytes(b'bit rot')
+        files['gone'][0].unlink()
+
+        reads = []
+        failures = {}
+        counts = verify_repository(catalog, jobs=2, report=lambda path, status, expected, actual:
+                                   failures.update({path.name: status}))
+        assert counts == {'ok': 2, 'corrupt': 1, 'catalog_mismatch': 1, 'name_mismatch': 1,
+                          'missing': 1, 'unreadable': 0, 'uncataloged': 0}
+        assert failures == {files['rotten'][0].name: 'corrupt', files['stale'][0].name: 'catalog_mismatch',
+                            files['renamed'][0].name: 'name_mismatch', files['gone'][0].name: 'missing'}
+        # the corrupt photo is read again under the other photo scheme
+        assert len(reads) == 6
+
+    # the results persist; only the failures are checked again
+    with Catalog(tmp_path) as catalog:
+        reads = []
+        counts = verify_repository(catalog, jobs=1)
+        assert counts['ok'] == 0 and sum(counts.values()) == 4
+        assert sorted(reads) == sorted(files[name][0].name for name in ['rotten', 'rotten', 'stale', 'renamed'])
+
+        # an empty window checks everything
+        reads = []
+        counts = verify_repository(catalog, jobs=1, window_days=0)
+        assert sum(counts.values()) == 6
+
+
+def test_verify_real_files(tmp_path):
+    """
+    Photos are verified with the real checksum, including the photos the
+    catalog lacks, which are checked against their names
+
+    """
+    from photo.catalog import Catalog
+    from photo.exif import calculate_checksum
+    from photo.verify import verify_repository
+    from PIL import Image
+
+    folder = tmp_path / '2021' / '05'
+    folder.mkdir(parents=True)
+    paths = {}
+    for name, colour in [('good', 'red'), ('rotten', 'green'), ('older', 'blue'), ('changed', 'white')]:
+        source = tmp_path / f'{name}.png'
+        Image.new('RGB', (16, 16), colour).save(source)
+        checksum = calculate_checksum(source, legacy=True)
+        paths[name] = folder / f'210506_070809_{checksum[:8]}.png'
+        source.rename(paths[name])
+    (folder / 'IMG_0001.png').write_bytes(paths['good'].read_bytes())
+
+    with Catalog(tmp_path) as catalog:
+        for name in ['good', 'rotten']:
+            catalog.add(paths[name], calculate_checksum(paths[name], legacy=True))
+        Image.new('RGB', (16, 16), 'black').save(paths['rotten'])
+        Image.new('RGB', (16, 16), 'black').save(paths['changed'])
+
+        failures = {}
+        counts = verify_repository(catalog, jobs=2, report=lambda path, status, expected, actual:
+                                   failures.update({path.name: status}))
+        assert counts['ok'] == 1 and counts['corrupt'] == 2 and counts['uncataloged'] == 2
+        assert failures == {paths['rotten'].name: 'corrupt', paths['changed'].name: 'corrupt',
+                            paths['older'].name: 'uncataloged', 'IMG_0001.png': 'uncataloged'}
+
+        # files the catalog lacks have nowhere to record a result, so they
+        # are checked again
+        counts = verify_repository(catalog, jobs=1)
+        assert counts['ok'] == 0 and counts['corrupt'] == 2 and counts['uncataloged'] == 2
+
+
+def test_verify_photo_schemes(tmp_path):
+    """
+    Photos added under the legacy checksum still verify once the raw scheme
+    is the configured one
+
+    """
+    from photo.catalog import Catalog
+    from photo.exif import calculate_checksum
+    from photo.verify import verify_repository
+    from PIL import Image
+
+    folder = tmp_path / '2021' / '05'
+    folder.mkdir(parents=True)
+    paths = []
+    for colour in ['red', 'green']:
+        source = tmp_path / f'{colour}.png'
+        Image.new('RGB', (16, 16), colour).save(source)
+        checksum = calculate_checksum(source, legacy=True)
+        paths.append(folder / f'210506_070809_{checksum[:8]}.png')
+        source.rename(paths[-1])
+
+    with Catalog(tmp_path) as catalog:
+        catalog.add(paths[0], calculate_checksum(paths[0], legacy=True))
+        for photo_hash in ['raw', None]:
+            counts = verify_repository(catalog, jobs=1, window_days=0, photo_hash=photo_hash)
+            assert counts['ok'] == 1 and counts['uncataloged'] == 1
+            assert sum(counts.values()) == 2
+
+
+def test_rate_limiter():
+    """
+    Reads from many threads are held to the rate on average
+
+    """
+    from photo.verify import RateLimiter
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+
+    limiter = RateLimiter(1e6)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(limiter.acquire, [50000] * 8))
+    # the first read goes at once, the other seven wait their turn
+    assert time.monotonic() - start >= 0.35
+
+    start = time.monotonic()
+    RateLimiter(None).acquire(10 ** 12)
+    assert time.monotonic() - start < 0.1
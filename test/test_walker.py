@@ -0,0 +1,86 @@
+import pytest
+
+
+def make_tree(root):
+    """
+    Lay out an inbox with hidden, excluded and nested entries
+
+    """
+    for rel in ['a.jpg', 'b.MOV', 'notes.txt', '.hidden.jpg', 'DCIM/100/c.jpg', 'DCIM/100/d.tmp',
+                'Trash/e.jpg', '.thumbnails/f.jpg', 'z/g.heic']:
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'x')
+
+
+def test_scan_tree(tmp_path, monkeypatch):
+    """
+    Hidden directories are never listed, and files come in a stable order
+
+    """
+    from photo.walker import scan_tree
+    import os
+
+    make_tree(tmp_path)
+    listed = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        listed.append(os.path.relpath(path, tmp_path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', recording_scandir)
+    found = [os.path.relpath(entry.path, tmp_path) for entry in scan_tree(tmp_path)]
+    assert found == ['a.jpg', 'b.MOV', 'notes.txt', os.path.join('DCIM', '100', 'c.jpg'),
+                     os.path.join('DCIM', '100', 'd.tmp'), os.path.join('Trash', 'e.jpg'),
+                     os.path.join('z', 'g.heic')]
+    assert not any(path.startswith('.thumbnails') for path in listed)
+
+    with pytest.raises(FileNotFoundError):
+        list(scan_tree(tmp_path / 'missing'))
+
+
+def test_scan_tree_unlistable(tmp_path, monkeypatch, capsys):
+    """
+    A subdirectory that cannot be listed is skipped with a warning on stderr
+
+    """
+    from photo.walker import scan_tree
+    import os
+
+    make_tree(tmp_path)
+    scandir = os.scandir
+
+    def failing_scandir(path):
+        if os.path.basename(path) == 'DCIM':
+            raise PermissionError('denied')
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    found = [entry.name for entry in scan_tree(tmp_path)]
+    assert found == ['a.jpg', 'b.MOV', 'notes.txt', 'e.jpg', 'g.heic']
+    captured = capsys.readouterr()
+    assert 'WARNING: cannot list' in captured.err and captured.out == ''
+
+
+def test_walk_filter(tmp_path):
+    """
+    Include and exclude globs and extensions select the files walked
+
+    """
+    from photo.walker import scan_tree, WalkFilter
+    import os
+
+    make_tree(tmp_path)
+
+    def walk(**kwargs):
+        return [os.path.relpath(entry.path, tmp_path).replace(os.sep, '/')
+                for entry in scan_tree(tmp_path, WalkFilter(**kwargs))]
+
+    assert walk(exclude=['Trash', '*.tmp']) == ['a.jpg', 'b.MOV', 'notes.txt', 'DCIM/100/c.jpg', 'z/g.heic']
+    assert walk(include=['DCIM/*']) == ['DCIM/100/c.jpg', 'DCIM/100/d.tmp']
+    assert walk(extensions=['jpg', '.HEIC']) == ['a.jpg', 'DCIM/100/c.jpg', 'Trash/e.jpg', 'z/g.heic']
+
+    cfg = {'walk': {'exclude': ['Trash'], 'extensions': ['.jpg']}}
+    walk_filter = WalkFilter.from_config(cfg, exclude=['DCIM'])
+    assert [entry.name for entry in scan_tree(tmp_path, walk_filter)] == ['a.jpg']
@@ -0,0 +1,169 @@
+import pytest
+
+
+def test_settler(tmp_path):
+    """
+    A file is only ready once it has stopped growing for the settle time
+
+    """
+    from photo.watch import Settler
+    import time
+
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(b'part')
+    settler = Settler(0.2)
+    settler.add(path)
+    assert settler.ready() == []
+
+    time.sleep(0.15)
+    with open(path, 'ab') as fid:
+        fid.write(b'more')
+    assert settler.ready() == []
+    time.sleep(0.15)
+    assert settler.ready() == []
+    time.sleep(0.1)
+    assert settler.ready() == [path]
+    assert len(settler) == 0
+
+    # files removed before they settle are dropped
+    settler.add(tmp_path / 'gone.jpg')
+    assert settler.ready() == [] and len(settler) == 0
+
+
+@pytest.mark.parametrize('poll_interval', [None, 0.1])
+def test_watch(tmp_path, poll_interval):
+    """
+    Files landing in the inbox are handed over in batches once settled, and
+    the status socket reports the progress
+
+    """
+    from photo.watch import watch, WatchStatus, serve_status, read_status
+    import threading
+    import time
+
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    (inbox / 'old.jpg').write_bytes(b'old')
+
+    batches = []
+    status = WatchStatus()
+    stop = threading.Event()
+    thread = threading.Thread(target=watch, args=(inbox, batches.append, stop),
+                              kwargs=dict(settle=0.2, batch_size=2, batch_delay=0.1, status=status,
+                                          poll_interval=poll_interval))
+    server = serve_status(status, tmp_path / 'watch.sock')
+    thread.start()
+    try:
+        time.sleep(0.3)
+        (inbox / 'a.jpg').write_bytes(b'a')
+        (inbox / 'b.jpg').write_bytes(b'bb')
+        (inbox / 'sub').mkdir()
+        (inbox / 'sub' / 'c.jpg').write_bytes(b'ccc')
+        (inbox / '.hidden.jpg').write_bytes(b'hidden')
+
+        deadline = time.monotonic() + 5
+        while status.files < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        report = read_status(tmp_path / 'watch.sock')
+    finally:
+        stop.set()
+        thread.join()
+        server.shutdown()
+        server.server_close()
+
+    names = sorted(path.name for batch in batches for path in batch)
+    assert names == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert all(len(batch) <= 2 for batch in batches)
+    assert report['files'] == 3 and report['bytes'] == 6 and report['queue_depth'] == 0
+
+
+def test_watch_batch_failure(tmp_path, capsys):
+    """
+    A failing batch is counted and reported on stderr, and watching goes on
+
+    """
+    from photo.watch import watch, WatchStatus
+    import threading
+    import time
+
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    (inbox / 'a.jpg').write_bytes(b'a')
+
+    def process(batch):
+        raise OSError('disk full')
+
+    status = WatchStatus()
+    stop = threading.Event()
+    thread = threading.Thread(target=watch, args=(inbox, process, stop),
+                              kwargs=dict(settle=0.1, batch_delay=0.1, status=status, poll_interval=0.1,
+                                          scan=True))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while status.errors == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert status.errors == 1 and status.last_error == 'disk full'
+    captured = capsys.readouterr()
+    assert 'WARNING: adding a batch of 1 files failed: disk full' in captured.err
+    assert 'WARNING' not in captured.out
+
+
+def test_serve_status_running(tmp_path):
+    """
+    A second daemon on the same socket is refused, a stale socket is replaced
+
+    """
+    from photo.watch import WatchStatus, serve_status, read_status
+    import socket
+
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(tmp_path / 'watch.sock'))
+    stale.close()
+
+    server = serve_status(WatchStatus(), tmp_path / 'watch.sock')
+    try:
+        assert read_status(tmp_path / 'watch.sock')['files'] == 0
+        with pytest.raises(IOError):
+            serve_status(WatchStatus(), tmp_path / 'watch.sock')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_cli_watch_resume(tmp_path, monkeypatch):
+    """
+    The watch finishes interrupted imports first and leaves the journal of a
+    running import alone
+
+    """
+    from photo import config, ingest, watch
+    from photo.cli import cli_watch
+    from photo.journal import Journal
+
+    repo = tmp_path / 'repo'
+    (tmp_path / 'config' / 'photo').mkdir(parents=True)
+    (tmp_path / 'config' / 'photo' / 'photorc').write_text(f'repo:\n    path: {repo}\n')
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / 'config'))
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    monkeypatch.setattr(config, '_cache', {})
+
+    ingested = []
+    monkeypatch.setattr(ingest, 'ingest', lambda path, walk, *args, **kwargs: ingested.append((path, walk)))
+    monkeypatch.setattr(watch, 'watch', lambda *args, **kwargs: None)
+
+    interrupted = Journal(repo)
+    interrupted.start([tmp_path / 'crashed'], True)
+    interrupted.close()
+    with Journal(repo) as running:
+        running.start([tmp_path / 'running'], False)
+        cli_watch(tmp_path / 'inbox')
+        assert running.path.exists()
+        assert running.args['path'] == [str(tmp_path / 'running')]
+
+    assert ingested == [([str(tmp_path / 'crashed')], True)]
+    assert not interrupted.path.exists()